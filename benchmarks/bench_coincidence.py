@@ -0,0 +1,76 @@
+""" GReX x STARE coincidence search, the per-trigger loop
+coincidence_grex_dumps used to run versus the sorted-array
+coincidence_engine, up to 10^6 x 10^6 candidates, then
+N-station clustering with cluster_stations.
+
+usage: poetry run python benchmarks/bench_coincidence.py [ncand_max]
+"""
+import sys
+import time
+
+import numpy as np
+
+from grex_t3 import coincidence_engine
+
+# the loop is O(N M), so only run it up to here
+NLOOP_MAX = 2 * 10**4
+
+
+def make_cands(n, seed):
+    rng = np.random.default_rng(seed)
+    # ~1 candidate per second from each station
+    mjd = 60000. + rng.uniform(0, n, n) / 86400.
+    return mjd, rng.uniform(0, 1000, n), rng.uniform(8, 50, n)
+
+def loop_match(mjd_grex, dms_grex, mjd_stare, dms_stare, snr_stare,
+               t_thresh_sec, dm_diff_thresh):
+    ia, ib = [], []
+    for ii in range(len(mjd_grex)):
+        delta_t_sec = np.abs(mjd_grex[ii] - mjd_stare) * 86400
+        delta_dm = np.abs(dms_grex[ii] - dms_stare)
+        ind_coince = np.where((delta_t_sec < t_thresh_sec) & (delta_dm < dm_diff_thresh))[0]
+        if len(ind_coince):
+            ia.append(ii)
+            ib.append(ind_coince[np.argmax(snr_stare[ind_coince])])
+    return np.array(ia, dtype=int), np.array(ib, dtype=int)
+
+
+if __name__ == '__main__':
+    ncand_max = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+
+    print("    ncand   loop (s)   engine (s)   matches")
+    for ncand in [10**3, 10**4, 10**5, 10**6, 10**7]:
+        if ncand > ncand_max:
+            break
+        mjd_grex, dms_grex, _ = make_cands(ncand, 1)
+        mjd_stare, dms_stare, snr_stare = make_cands(ncand, 2)
+
+        t0 = time.perf_counter()
+        ia, ib = coincidence_engine.match_pairs(mjd_grex, mjd_stare, 0.5,
+                                                dms_grex, dms_stare, dm_thresh=25.)
+        ia, ib = coincidence_engine.best_match(ia, ib, snr_stare)
+        t_engine = time.perf_counter() - t0
+
+        t_loop = float('nan')
+        if ncand <= NLOOP_MAX:
+            t0 = time.perf_counter()
+            ia_loop, ib_loop = loop_match(mjd_grex, dms_grex, mjd_stare, dms_stare,
+                                          snr_stare, 0.5, 25.)
+            t_loop = time.perf_counter() - t0
+            assert np.array_equal(ia, ia_loop) and np.array_equal(ib, ib_loop)
+
+        print(f"{ncand:9d}   {t_loop:8.2f}   {t_engine:10.3f}   {len(ia):7d}")
+
+    print("\n    ncand   nstation   cluster (s)   clusters")
+    for ncand in [10**4, 10**5, 10**6]:
+        if ncand > ncand_max:
+            break
+        for nstation in [3, 8]:
+            cands = [make_cands(ncand, seed) for seed in range(nstation)]
+            t0 = time.perf_counter()
+            members = coincidence_engine.cluster_stations([c[0] for c in cands], 0.25,
+                                                          [c[1] for c in cands],
+                                                          dm_thresh=5., dm_frac=0.07)
+            t_cluster = time.perf_counter() - t0
+            print(f"{ncand:9d}   {nstation:8d}   {t_cluster:11.3f}   "
+                  f"{members['cluster'].nunique():8d}")
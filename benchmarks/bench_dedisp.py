@@ -0,0 +1,48 @@
+""" Compare the dedisp_tools CPU engine against YOUR's 
+CPU fallback for dedispersion, DM-time and decimation 
+of a candidate at 2048 channels x 8.192 us.
+
+usage: poetry run python benchmarks/bench_dedisp.py [ntime] [dm] [ndm]
+"""
+import sys
+import time
+
+import numpy as np
+
+from grex_t3 import candproc_tools
+
+NFREQ = 2048
+TSAMP = 8.192e-6
+
+
+def make_cand(ntime, dm):
+    data = np.random.default_rng(0).normal(size=(ntime, NFREQ)).astype(np.float32)
+    return candproc_tools.ArrayCandidate(data, fch1=1530., foff=-250./NFREQ,
+                                         tsamp=TSAMP, tstart=60000., dm=dm)
+
+
+def run(backend, ntime, dm, ndm, ibox=4):
+    cand = make_cand(ntime, dm)
+    t0 = time.perf_counter()
+    candproc_tools.proc_cand(cand, dm=dm, zero_topbottom=False, ndm=ndm,
+                             dmtime_transform=True, backend=backend)
+    t1 = time.perf_counter()
+    candproc_tools.decimate_cand(cand, freq_factor=16, time_factor=ibox,
+                                 backend=backend)
+    t2 = time.perf_counter()
+    return t1 - t0, t2 - t1
+
+
+if __name__ == '__main__':
+    ntime = int(sys.argv[1]) if len(sys.argv) > 1 else 2**14
+    dm = float(sys.argv[2]) if len(sys.argv) > 2 else 100.
+    ndm = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+
+    print(f"ntime={ntime} nfreq={NFREQ} tsamp={TSAMP*1e6:.3f} us dm={dm} ndm={ndm}")
+    # compile the kernels before timing
+    run('cpu', 256, dm, 2)
+
+    for backend in ('your', 'cpu'):
+        t_dedisp, t_dec = run(backend, ntime, dm, ndm)
+        print(f"{backend:5s}: dedisperse+dmtime {t_dedisp:7.3f} s   "
+              f"decimate {t_dec:6.3f} s")
@@ -0,0 +1,63 @@
+""" Per-candidate render time and resident memory of the
+plot_grex layout: a new figure per candidate left open
+(as plot_grex did), a new figure closed after saving, and
+the reused GrexCandPlot template.
+
+usage: poetry run python benchmarks/bench_plot_templates.py [ncand]
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from grex_t3 import plot_templates
+
+NTIME, NFREQ, NDM = 1024, 112, 32
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+
+def render(tpl, rng, fn):
+    times = np.linspace(0, 100., NTIME)
+    freqs = np.linspace(1300., 1500., NFREQ)
+    tpl.render(times, rng.normal(size=NTIME), rng.normal(size=(NFREQ, NTIME)),
+               (-50., 50., 1300., 1500.), 2., np.zeros(NFREQ), freqs,
+               rng.normal(size=(NDM, NTIME)), (-50., 50., 0., 200.), 'Time (ms)',
+               rng.uniform(-30, 30, 50), rng.uniform(0, 500, 50),
+               rng.uniform(8, 20, 50), (-30., 30.), 'Time (s)',
+               ['DM = 100', 'SNR = 10'])
+    tpl.save(fn)
+
+
+def run(mode, ncand, tmp):
+    rng = np.random.default_rng(0)
+    rss0 = rss_mb()
+    t0 = time.perf_counter()
+    for ii in range(ncand):
+        fn = os.path.join(tmp, 'cand.png')
+        if mode == 'template':
+            tpl = plot_templates.get_template(plot_templates.GrexCandPlot)
+        else:
+            tpl = plot_templates.GrexCandPlot(num=f'{mode}{ii}')
+        render(tpl, rng, fn)
+        if mode == 'new+close':
+            tpl.close()
+    dt = (time.perf_counter() - t0) / ncand
+    print(f"{mode:>10}: {dt*1e3:7.1f} ms/cand, RSS +{rss_mb()-rss0:7.1f} MB after {ncand}")
+    plt.close('all')
+    plot_templates.close_templates()
+
+
+if __name__ == '__main__':
+    ncand = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ['new+leak', 'new+close', 'template']:
+            run(mode, ncand, tmp)
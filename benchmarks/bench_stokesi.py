@@ -0,0 +1,67 @@
+""" Compare the fused integer Stokes I kernel in 
+candproc_tools.read_voltage_data against the original 
+complex xarray expression, on a synthetic voltage dump.
+
+usage: poetry run python benchmarks/bench_stokesi.py [ntime] [nfreq]
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+import xarray
+
+from grex_t3 import candproc_tools
+
+
+def make_dump(fn, ntime, nfreq):
+    rng = np.random.default_rng(0)
+    voltages = rng.integers(-20, 20, size=(ntime, nfreq, 2, 2), dtype=np.int8)
+    ds = xarray.Dataset(
+        {"voltages": (("time", "freq", "pol", "reim"), voltages)},
+        coords={"time": 60000. + np.arange(ntime) * 8.192e-6 / 86400.,
+                "freq": np.linspace(1530., 1280., nfreq),
+                "pol": ["a", "b"],
+                "reim": ["real", "imaginary"]})
+    ds.to_netcdf(fn)
+
+
+def stokesi_xarray(fn, nbit='float32'):
+    """ The original read_voltage_data expression """
+    ds = xarray.open_dataset(fn, chunks={"time": 2048})
+    voltages = ds["voltages"].sel(reim="real") + ds["voltages"].sel(reim="imaginary") * 1j
+    stokesi = np.square(np.abs(voltages)).astype(nbit)
+    stokesi = stokesi.sum(dim='pol').astype(nbit)
+    return stokesi.compute()
+
+
+def timeit(func, *args, nrep=3, **kwargs):
+    best = np.inf
+    for ii in range(nrep):
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+if __name__ == '__main__':
+    ntime = int(sys.argv[1]) if len(sys.argv) > 1 else 2**16
+    nfreq = int(sys.argv[2]) if len(sys.argv) > 2 else 2048
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, 'grex_dump-bench.nc')
+        make_dump(fn, ntime, nfreq)
+        print(f"Synthetic dump: ntime={ntime} nfreq={nfreq} "
+              f"({os.path.getsize(fn)/1024**2:.1f} MB)")
+
+        # compile the kernel before timing
+        candproc_tools.read_voltage_data(fn, nbit='float32', half_width=8)
+
+        t_xr, ref = timeit(stokesi_xarray, fn)
+        t_fused, stokesi = timeit(candproc_tools.read_voltage_data, fn, nbit='float32')
+
+    assert np.allclose(ref.values, stokesi.values)
+    print(f"xarray expression : {t_xr:.3f} s")
+    print(f"fused kernel      : {t_fused:.3f} s")
+    print(f"speedup           : {t_xr/t_fused:.1f}x")
@@ -0,0 +1,62 @@
+""" Per-candidate cost of finding nearby T2 candidates,
+re-reading cluster_output.csv with pandas versus a
+window query on the t2_store, as the CSV grows. The last
+column is the cost of reading just the appended rows
+with a T2Tail.
+
+usage: poetry run python benchmarks/bench_t2_store.py [nrows_max]
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from grex_t3 import t2_store
+
+COLUMNS = ['snr', 'if', 'specnum', 'mjds', 'ibox', 'idm', 'dm',
+           'ibeam', 'cl', 'cntc', 'cntb', 'trigger']
+
+
+def write_rows(fn, nrows, mjd0, header):
+    rng = np.random.default_rng(nrows)
+    df = pd.DataFrame({
+        'snr': rng.uniform(8, 50, nrows), 'if': 0, 'specnum': np.arange(nrows),
+        # ~1 candidate per second
+        'mjds': mjd0 + np.arange(nrows) / 86400., 'ibox': rng.integers(1, 16, nrows),
+        'idm': 0, 'dm': rng.uniform(0, 1000, nrows), 'ibeam': rng.integers(0, 256, nrows),
+        'cl': 0, 'cntc': 1, 'cntb': 1, 'trigger': '0'})
+    df[COLUMNS].to_csv(fn, mode='a', header=header, index=False)
+
+
+if __name__ == '__main__':
+    nrows_max = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fn = os.path.join(tmp, 'cluster_output.csv')
+        store = t2_store.T2Store(fn)
+        tail = t2_store.T2Tail(fn, from_start=True)
+        nrows, mjd0 = 0, 60000.
+        print("    nrows   read_csv (ms)   ingest (ms)   window (ms)   tail (ms)")
+        for nadd in [10**4, 9*10**4, 9*10**5, 9*10**6]:
+            if nrows + nadd > nrows_max:
+                break
+            write_rows(fn, nadd, mjd0 + nrows / 86400., header=(nrows == 0))
+            nrows += nadd
+            mjd = mjd0 + (nrows - 100.5) / 86400.
+
+            t0 = time.perf_counter()
+            df = pd.read_csv(fn)
+            df = df.iloc[np.where(np.abs(df['mjds'] - mjd) < 60./86400)[0]]
+            t1 = time.perf_counter()
+            store.update()
+            t2 = time.perf_counter()
+            cands = store.window(mjd, 60.)
+            t3 = time.perf_counter()
+            new = tail.read()
+            t4 = time.perf_counter()
+            assert len(cands) == len(df) and len(new) == nadd
+            print(f"{nrows:9d}   {(t1-t0)*1e3:13.1f}   {(t2-t1)*1e3:11.1f}   {(t3-t2)*1e3:11.2f}"
+                  f"   {(t4-t3)*1e3:9.1f}")
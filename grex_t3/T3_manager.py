@@ -4,21 +4,42 @@ import numpy as np
 #import dsautils.dsa_syslog as dsl
 from grex_t3 import filplot_funcs as filf
 from grex_t3 import data_manager
-import time, os
+from grex_t3 import pol_tools
+from grex_t3 import file_ready
+from grex_t3 import cand_priority
+import os
 import json
 from dask.distributed import Client
 
 import logging as LOGGER
-logger.basicConfig(filename='logs/output.log',
+os.makedirs('logs', exist_ok=True)
+LOGGER.basicConfig(filename='logs/output.log',
                     encoding='utf-8',
-                    level=logger.DEBUG)
+                    level=LOGGER.DEBUG)
 
-client = Client('12.0.0.1:8786')
 #ds = dsa_store.DsaStore()
 
 TIMEOUT_FIL = 60
 FILPATH = '/home/liam/grexdata/'
 OUTPUT_PATH = '/home/liam/grexdata/output'
+VOLTAGE_PATH = '/hdd/data/voltages/' # GReX dumps, grex_dump-<trigname>.nc
+DASK_SCHEDULER = '12.0.0.1:8786'
+FN_COINCIDENCE = '/hdd/data/candidates/T3/coincidence/coincidence.csv' # from coincidence.run_coincidencer
+SCORE_WEIGHTS = cand_priority.SCORE_WEIGHTS # see cand_priority.candidate_score
+POL_TIMEDOWNSAMPLE = 16
+POL_FREQDOWNSAMPLE = 1
+
+_client = None
+
+
+def get_client():
+    """ The dask Client of the T3 cluster, connected on first use
+    rather than on import.
+    """
+    global _client
+    if _client is None:
+        _client = Client(DASK_SCHEDULER)
+    return _client
 
 
 def run_filplot(a, wait=False, lock=None):
@@ -73,6 +94,24 @@ def run_filplot(a, wait=False, lock=None):
     return output_dict
 
 
+def submit_filplot(a, lock=None, wait=False, client=None):
+    """ Submit run_filplot for candidate dictionary a to the 
+    dask cluster with its cand_priority.candidate_score as 
+    the task priority, so during a burst of triggers the 
+    best candidates are run first. Coincidence with another
+    station is looked up by trigname in FN_COINCIDENCE.
+    Returns the future.
+    """
+    trigname = list(a.keys())[0]
+    od = a[trigname]
+    coincident = trigname in cand_priority.coincident_triggers(FN_COINCIDENCE)
+    score = cand_priority.candidate_score(od['snr'], od['dm'], coincident,
+                                          **SCORE_WEIGHTS)
+    LOGGER.info('Submitting run_filplot on {0} with priority {1:.1f}'.format(trigname, score))
+    client = client or get_client()
+    return client.submit(run_filplot, a, wait=wait, lock=lock, priority=score)
+
+
 def run_burstfit(dd, lock=None):
     """ Given candidate dictionary, run burstfit analysis.
     Returns new dictionary with refined DM, width, arrival time.
@@ -135,6 +174,22 @@ def run_pol(d_hr, lock=None):
     print('run_pol on {0}'.format(d_hr['trigname']))
     LOGGER.info('run_pol on {0}'.format(d_hr['trigname']))
 
+    # build I, Q, U, V in one pass over the voltage dump
+    voltfile = d_hr.get('voltfile') or os.path.join(
+        VOLTAGE_PATH, f"grex_dump-{d_hr['trigname']}.nc")
+    if os.path.exists(voltfile):
+        d_hr['voltfile'] = voltfile
+        polfile = os.path.join(OUTPUT_PATH, f"{d_hr['trigname']}_iquv.h5")
+        try:
+            d_hr['polfile'] = pol_tools.write_stokes_product(
+                voltfile, polfile, timedownsample=POL_TIMEDOWNSAMPLE,
+                freqdownsample=POL_FREQDOWNSAMPLE)
+        except Exception as exception:
+            LOGGER.error('Could not make IQUV product for {0}: {1}'.format(
+                d_hr['trigname'], exception))
+    else:
+        LOGGER.warning('No voltage dump {0} for {1}'.format(voltfile, d_hr['trigname']))
+
     update_json(d_hr, lock=lock)
     
     return d_hr.copy()
@@ -236,12 +291,13 @@ def run_final(dds, lock=None):
     return dd
 
 
-def update_json(dd, lock, outpath=OUTPUT_PATH):
+def update_json(dd, lock, outpath=None):
     """ Lock, read, write, unlock json file on disk.
-    Uses trigname field to find file
+    Uses trigname field to find file in outpath
+    (OUTPUT_PATH by default).
     """
 
-    fn = outpath + dd['trigname'] + '.json'
+    fn = os.path.join(outpath or OUTPUT_PATH, dd['trigname'] + '.json')
 
     lock.acquire(timeout="5s")
     
@@ -288,16 +344,6 @@ def wait_for_local_file(fl, timeout):
     If timeout (in seconds) exceeded, then return None.
     """
 
-    time_counter = 0
-    while not os.path.exists(fl):
-        time.sleep(1)
-        time_counter += 1
-        if time_counter > timeout:
-            return None
-
-    # wait in case file hasn't been written
-    time.sleep(10)
-
-    return fl
+    return file_ready.wait_for_file(fl, timeout)
 
 
@@ -6,10 +6,15 @@
 import inotify.adapters as ia
 import os
 import sys
-import slack_sdk as slk
 import time
 import logging
 import cand_plotter
+from grex_t3 import worker_pool
+from grex_t3 import file_ready
+from grex_t3 import slack_uploader
+from grex_t3 import cand_priority
+from grex_t3 import cand_ledger
+from grex_t3 import stage_trace
 
 
 
@@ -18,6 +23,13 @@ env_dir = "/home/user/zghuai/GReX-T3/grex_t3/"
 mon_dir = "/hdd/data/voltages/" # monitoring dir
 dir_plot = "/hdd/data/candidates/T3/candplots/" # place to save output plots
 dir_fil  = "/hdd/data/candidates/T3/candfils/"  # place to save output filterbank files
+fn_coincidence = "/hdd/data/candidates/T3/coincidence/coincidence.csv" # from coincidence.run_coincidencer
+ledger_file = "/hdd/data/candidates/T3/ledger.jsonl" # status of every candidate processed
+trace_file = "/hdd/data/candidates/T3/trace.jsonl"   # stage timings, see stage_trace
+nworker = 2      # candidates processed at once
+max_backlog = 32 # candidates waiting for a worker before the lowest priority are deferred
+max_deferred = 256 # deferred candidates, run once the backlog drains, before the lowest are dropped
+score_weights = cand_priority.SCORE_WEIGHTS # see cand_priority.candidate_score
 
 # Configure the logger
 logging.basicConfig(filename=logfile,
@@ -26,140 +38,183 @@ logging.basicConfig(filename=logfile,
                     datefmt='%Y-%m-%d %H:%M:%S')
 logging.info('Starting the monitoring and T3-plotting service')
 
+ledger = cand_ledger.Ledger(ledger_file)
+
 
 # Function to upload a plot to Slack
-def upload_to_slack(pdffile):
-
-    # set up slack client
-    slack_file = '{0}/.config/slack_api'.format(
-        os.path.expanduser("~")
-    )
-
-    # if the slack api token file is missing
-    if not os.path.exists(slack_file):
-        raise RuntimeError(
-            "Could not find file with slack api token at {0}".format(
-                slack_file
-            )
-        )
-    # otherwise load the token file and start a webclient talking to slack
-    with open(slack_file) as sf_handler:
-        slack_token = sf_handler.read()
-        # initialize slack client
-        client = slk.WebClient(token=slack_token)
-    
+def upload_to_slack(pdffile, callback=None):
+    """ Queue pdffile for the #candidates channel. The upload 
+    runs in the background, retrying until Slack accepts it.
+    """
     # Define message parameters
     message = "New candidate plot generated!" ## add some cand details?
-    
-    try:
-        # Upload the plot file to Slack
-        response = client.files_upload(
-            channels="candidates",
-            file=pdffile,
-            initial_comment=message
-        )
-        
-        print("Plot uploaded to Slack:", response["file"]["permalink"])
-    except slk.errors.SlackApiError as err:
-        print(f"Error uploading plot to Slack: {err}")
+    slack_uploader.get_uploader().upload(pdffile, channels="candidates",
+                                         initial_comment=message,
+                                         callback=callback)
 
 
 # Function to send a slack message (test)
 def send_to_slack(message):
-
-    # set up slack client
-    slack_file = '{0}/.config/slack_api'.format(
-        os.path.expanduser("~")
-    )
-
-    # if the slack api token file is missing
-    if not os.path.exists(slack_file):
-        raise RuntimeError(
-            "Could not find file with slack api token at {0}".format(
-                slack_file
-            )
-        )
-    # otherwise load the token file and start a webclient talking to slack
-    with open(slack_file) as sf_handler:
-        slack_token = sf_handler.read()
-        # initialize slack client
-        client = slk.WebClient(token=slack_token)
-    
-    # Define message parameters
-    try:
-        response = client.chat_postMessage(
-            channel="candidates",
-            text=message
-        )  
-        
-        print("Done", response.status_code)
-    except slk.errors.SlackApiError as err:
-        print(f"Error uploading plot to Slack: {err}")
-
-
-
-def main(path, post=True):
+    slack_uploader.get_uploader().post(message, channel="candidates")
+
+
+
+def candidate_products(c):
+    """ The .fil and plot made for candidate c. """
+    return dict(fil=dir_fil + "cand{}.fil".format(c), # output dedispersed candidate .fil
+                png=dir_plot + "grex_cand"+c+".png")
+
+
+def process_candidate(c, post=True, t_queued=None, wait_ready=False):
+    """ Make the .fil and plot for candidate c and post it to 
+    Slack. Runs in a worker process of the monitor's pool.
+    The time spent in each stage goes to trace_file. If 
+    wait_ready, first wait for the dump to be completely 
+    written, as for those found by the startup backfill.
+    """
+    t0 = time.time()
+    trace = stage_trace.Trace(trace_file, c)
+    if t_queued is not None:
+        trace.record('queue_wait', t0 - t_queued, t_start=t_queued)
+    filename_json = c+".json"
+    v = mon_dir + "grex_dump-"+c+".nc" # voltage file
+    products = candidate_products(c)
+    fn_outfil, pdffile = products['fil'], products['png']
+
+    if wait_ready:
+        with trace.span('wait_ready'):
+            ready = file_ready.wait_for_file(v, timeout=60.)
+        if ready is None:
+            logging.error(f"Timed out waiting for {v} to be written.")
+            ledger.record(c, 'failed', fn_vol=v, error='dump not complete')
+            return
+
+    try: 
+        (cand, tab) = cand_plotter.gen_cand(v, fn_outfil, filename_json, trace=trace)
+
+        with trace.span('plot'):
+            cand_plotter.plot_grex(cand, tab, filename_json) 
+        logging.info("Done with cand_plotter.py")
+        logging.info(f"Successfully plotted the canidate {c}!")
+    except Exception as e:
+        logging.error("Error plotting candidate %s: %s", c, str(e))
+        ledger.record(c, 'failed', fn_vol=v, error=str(e))
+        trace.record('total', time.time() - t0, t_start=t0, ok=False)
+        return
+
+    logging.info(f"Saved {c} in {pdffile}")
+    ledger.record(c, cand_ledger.DONE, fn_vol=v, products=products)
+
+    trace.record('total', time.time() - t0, t_start=t0, ok=True)
+
+    if post==True:
+        def traced(ok, seconds, attempts):
+            trace.record('slack_upload', seconds, ok=ok, attempts=attempts)
+        try:
+            upload_to_slack(pdffile, callback=traced) # upload to Slack #candidates channel
+            logging.info(f"Queued for Slack #candidates!")
+        except Exception as e:
+            logging.error("Error queueing candidate plot for Slack: %s", str(e))
+        logging.info("DONE")
+
+
+def score_candidate(c):
+    """ Priority of candidate c from its T2 .json and 
+    whether it is in the coincidence list.
+    """
+    tab = cand_plotter.get_cand(c+".json")
+    if tab is None:
+        return 0.
+    coincident = c in cand_priority.coincident_triggers(fn_coincidence)
+    return cand_priority.candidate_score(tab["snr"].values[0], tab["dm"].values[0],
+                                         coincident, **score_weights)
+
+
+def main(path, post=True, nworker=nworker, max_backlog=max_backlog,
+         max_deferred=max_deferred):
 
     # initiate an inotify instance
     i = ia.Inotify()
     # add the directory to monitor to the instance
     i.add_watch(path)
 
+    # workers start in this directory, so change it once up front
+    os.chdir(env_dir)
+    # candidates wait in the priority queue, the pool only holds 
+    # what its workers are about to run
+    pool = worker_pool.WorkerPool(process_candidate, nworker=nworker, 
+                                  max_queued=nworker)
+    queue = cand_priority.CandidateQueue(max_backlog=max_backlog)
+    # preempted from a full backlog, run when there is nothing else to do
+    deferred = cand_priority.CandidateQueue(max_backlog=max_deferred)
+    queued = set()
+    t_queued = {}
+    wait_ready = set()
+
+    def enqueue(c, wait=False):
+        queued.add(c)
+        t_queued[c] = time.time()
+        if wait:
+            wait_ready.add(c)
+        for cdef, sdef in queue.push(c, score_candidate(c)):
+            ledger.record(cdef, 'deferred', fn_vol=mon_dir+"grex_dump-"+cdef+".nc")
+            logging.warning(f"Backlog full, deferred {cdef} with priority {sdef:.1f}.")
+            for cdrop, sdrop in deferred.push(cdef, sdef):
+                queued.discard(cdrop)
+                t_queued.pop(cdrop, None)
+                wait_ready.discard(cdrop)
+                ledger.record(cdrop, 'dropped', fn_vol=mon_dir+"grex_dump-"+cdrop+".nc")
+                logging.warning(f"Too many deferred, dropped {cdrop} with priority {sdrop:.1f}.")
+
+    # dumps written while the monitor was down, now that new ones are being 
+    # watched. Any finished just before the watch started won't get another
+    # event, so all are taken, with workers waiting for them to be complete.
+    backfill = cand_ledger.unprocessed_dumps(path, ledger, products=candidate_products)
+    for c, fn_vol in backfill:
+        enqueue(c, wait=True)
+    logging.info(f"Backfilling {len(backfill)} unprocessed dumps.")
+
     try:
         # create a test file, as a marker for the start of the monitoring process
         with open(path+'start_inotify_monitor', 'w'): 
             pass
-        # loop and monitor the directory
-        for event in i.event_gen(yield_nones=False):
-            (_, type_names, path, filename) = event
+        # loop and monitor the directory, with a None every second
+        # or so to hand queued candidates to idle workers
+        for event in i.event_gen(yield_nones=True):
+            (_, type_names, path, filename) = event or (None, [], None, '')
 
             # print("PATH=[{}] FILENAME=[{}] EVENT_TYPES={}".format(
             #     path, filename, type_names))
             # print(filename)
             
-            # if new file is created
-            if type_names == ['IN_CREATE']:
-                # if the filename ends with .nc
-                if filename.endswith('.nc'): # created a new .nc file
-                    logging.info(f"New NetCDF file created, waiting to plot.")
-                    print('Created {}'.format(filename))
-
-                    ### T3 goes here. 
-                    c = filename.split('.')[0].split('/')[-1].split('-')[-1] # candidate ID
-                    filename_json = c+".json"
-                    print('filename = ', filename_json)
-
-                    os.chdir(env_dir)
-                    time.sleep(10)
-
-                    try: 
-                        v = mon_dir + "grex_dump-"+c+".nc" # voltage file
-                        fn_tempfil = dir_plot + "intermediate.fil" # output temporary .fil
-                        fn_outfil = dir_fil + "cand{}.fil".format(c) # output dedispersed candidate .fil
-                        (cand, tab) = cand_plotter.gen_cand(v, fn_tempfil, fn_outfil, c+'.json')
-
-                        cand_plotter.plot_grex(cand, tab, c+".json") 
-                        logging.info("Done with cand_plotter.py")
-
-                        cmd = "rm {}".format(fn_tempfil)
-                        print(cmd)
-                        os.system(cmd)
-                        logging.info("Successfully plotted the canidate!")
-                    except Exception as e:
-                        logging.error("Error plotting candidates: %s", str(e))
-
-                    pdffile = dir_plot + "grex_cand"+filename_json.split('.')[0]+".png"
-                    print("saved in ", pdffile)
-
-                    if post==True:
-                        try:
-                            upload_to_slack(pdffile) # upload to Slack #candidates channel
-                            logging.info(f"Successfully posted to Slack #candidates!")
-                        except Exception as e:
-                            logging.error("Error uploading candidate plot to Slack: %s", str(e))
-                        logging.info("DONE")
-
-                    del cand
+            # once a new file has been closed by its writer, or moved into place
+            if file_ready.is_ready_event(type_names):
+                ### T3 goes here. 
+                c = filename.split('.')[0].split('/')[-1].split('-')[-1] # candidate ID
+                # if the filename ends with .nc, and wasn't already queued 
+                # by an earlier close of the same file
+                if filename.endswith('.nc') and c not in queued: # finished a new .nc file
+                    logging.info(f"New NetCDF file {filename} complete, queueing {c} to plot.")
+                    enqueue(c)
+                elif filename.endswith('.nc'):
+                    logging.info(f"{c} is already queued or running, ignoring {filename}.")
+
+            for job, err, dt in pool.poll():
+                logging.info(f"Finished {job[0]} in {dt:.1f} s.")
+                # a later dump with the same ID is a new candidate
+                queued.discard(job[0])
+                if err is not None and err.startswith(worker_pool.CRASHED):
+                    # process_candidate never got to record it
+                    ledger.record(job[0], 'failed', fn_vol=mon_dir+"grex_dump-"+job[0]+".nc",
+                                  error=err)
+
+            # highest priority first, whenever a worker is free,
+            # and the deferred candidates once the backlog is empty
+            while (len(queue) or len(deferred)) and pool.pending < nworker:
+                c = queue.pop() if len(queue) else deferred.pop()
+                pool.submit(c, post, t_queued.pop(c, None), c in wait_ready)
+                wait_ready.discard(c)
+                logging.info(f"Started {c}, {len(queue)} candidates waiting, {len(deferred)} deferred.")
 
     except PermissionError:
         logging.error("Permission denied: Unable to create inotify test file.")
@@ -167,6 +222,9 @@ def main(path, post=True):
     except Exception as e:
         logging.error("An error occurred: %s", str(e))
 
+    finally:
+        pool.close(wait=False)
+
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,171 @@
+""" Convert a backlog of grex_dump-*.nc voltage files
+to Stokes I SIGPROC filterbanks in parallel.
+
+    poetry run grex-batch-convert /hdd/data/voltages/grex_dump-*.nc \
+        -o /hdd/data/filterbanks -t 16 -f 1 -n 4 --memory-gb 16
+
+Outputs are written to a .part file and renamed when
+complete, so an interrupted run can simply be started
+again: finished files are skipped and partial ones redone.
+"""
+import os
+import time
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import xarray
+import dask
+
+from grex_t3 import candproc_tools
+
+# samples per dask chunk in read_voltage_data
+CHUNK_TIME = 2048
+
+
+def output_path(fn_vol, outdir, timedownsample=1, freqdownsample=1):
+    """ Name of the .fil written for one voltage dump. """
+    fn = os.path.basename(fn_vol)
+    if fn.endswith('.nc'):
+        fn = fn[:-3]
+    return os.path.join(outdir, f"{fn}_t{timedownsample}_f{freqdownsample}.fil")
+
+def estimate_memory(fn_vol, timedownsample=1, freqdownsample=1):
+    """ Rough peak memory in bytes to convert one dump.
+    Chunks are streamed to disk, so this is a few chunks
+    in flight plus the time axis.
+    """
+    with xarray.open_dataset(fn_vol) as ds:
+        ntime, nfreq = ds.sizes['time'], ds.sizes['freq']
+    # int8 voltages (x4) and float32 Stokes I (x4) per chunk
+    nchunk = 4 * max(CHUNK_TIME, timedownsample) * nfreq * 8
+
+    return nchunk + ntime * 8
+
+def convert_dump(fn_vol, fnout, timedownsample=1, freqdownsample=1):
+    """ Convert one voltage dump to a .fil file.
+
+    Returns
+    -------
+    stats : dict
+        file names, bytes read and written, and timing
+    """
+    t0 = time.time()
+    fnpart = fnout + '.part'
+    # one worker per process, dask threads would oversubscribe
+    with dask.config.set(scheduler='synchronous'):
+        candproc_tools.read_voltage_data(
+            fn_vol, timedownsample=timedownsample,
+            freqdownsample=freqdownsample, nbit='float32', fnfilout=fnpart)
+    os.replace(fnpart, fnout)
+    dt = time.time() - t0
+
+    nbytes_in = os.path.getsize(fn_vol)
+    return dict(fn_vol=fn_vol, fnout=fnout, seconds=dt,
+                nbytes_in=nbytes_in, nbytes_out=os.path.getsize(fnout),
+                mb_per_s=nbytes_in / 1e6 / max(dt, 1e-9))
+
+def plan_conversions(files, outdir, timedownsample=1, freqdownsample=1,
+                     overwrite=False):
+    """ Pair each dump with its output, dropping those
+    already converted and any stale .part files.
+    """
+    todo = []
+    for fn_vol in sorted(files):
+        fnout = output_path(fn_vol, outdir, timedownsample, freqdownsample)
+        if os.path.exists(fnout + '.part'):
+            os.remove(fnout + '.part')
+        if os.path.exists(fnout) and not overwrite:
+            print(f"Skipping {fn_vol}, {fnout} exists")
+            continue
+        todo.append((fn_vol, fnout))
+
+    return todo
+
+def convert_dumps(files, outdir, timedownsample=1, freqdownsample=1,
+                  nproc=4, memory_budget=8e9, overwrite=False):
+    """ Convert voltage dumps to filterbanks with a process pool.
+
+    Parameters
+    ----------
+    files : list
+        .nc voltage files
+    outdir : str
+        Directory for the .fil files
+    timedownsample, freqdownsample : int
+        Downsampling factors
+    nproc : int
+        Maximum number of worker processes
+    memory_budget : float
+        Bytes the workers may use together, which
+        limits how many run at once
+    overwrite : bool
+        Redo outputs that already exist
+
+    Returns
+    -------
+    stats : list
+        One dict per converted file, see convert_dump
+    """
+    os.makedirs(outdir, exist_ok=True)
+    todo = plan_conversions(files, outdir, timedownsample,
+                            freqdownsample, overwrite=overwrite)
+    if len(todo) == 0:
+        return []
+
+    per_file = max(estimate_memory(fn, timedownsample, freqdownsample)
+                   for fn, _ in todo)
+    nworker = int(min(nproc, len(todo), max(1, memory_budget // per_file)))
+    print(f"Converting {len(todo)} dumps with {nworker} workers, "
+          f"~{per_file/1e9:.2f} GB each")
+
+    stats = []
+    t0 = time.time()
+    with ProcessPoolExecutor(max_workers=nworker) as pool:
+        futures = {pool.submit(convert_dump, fn_vol, fnout,
+                               timedownsample, freqdownsample): fn_vol
+                   for fn_vol, fnout in todo}
+        for future in as_completed(futures):
+            try:
+                st = future.result()
+            except Exception as e:
+                print(f"Failed on {futures[future]}: {e}")
+                continue
+            stats.append(st)
+            print(f"{st['fn_vol']} -> {st['fnout']}: "
+                  f"{st['seconds']:.1f} s, {st['mb_per_s']:.1f} MB/s")
+
+    dt = time.time() - t0
+    nbytes = sum(st['nbytes_in'] for st in stats)
+    print(f"Converted {len(stats)}/{len(todo)} dumps in {dt:.1f} s, "
+          f"{nbytes/1e6/max(dt, 1e-9):.1f} MB/s total")
+
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert grex_dump-*.nc voltage files to Stokes I .fil")
+    parser.add_argument('files', nargs='+', help='Voltage files or glob patterns')
+    parser.add_argument('-o', '--outdir', default='.', help='Output directory')
+    parser.add_argument('-t', '--timedownsample', type=int, default=1)
+    parser.add_argument('-f', '--freqdownsample', type=int, default=1)
+    parser.add_argument('-n', '--nproc', type=int, default=4,
+                        help='Maximum number of worker processes')
+    parser.add_argument('--memory-gb', type=float, default=8.,
+                        help='Memory budget shared by the workers')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Redo files that were already converted')
+    args = parser.parse_args(argv)
+
+    files = []
+    for pattern in args.files:
+        files += glob.glob(pattern) or [pattern]
+
+    stats = convert_dumps(files, args.outdir, args.timedownsample,
+                          args.freqdownsample, nproc=args.nproc,
+                          memory_budget=args.memory_gb*1e9,
+                          overwrite=args.overwrite)
+    return stats
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+""" A persistent record of which candidates have been
+processed, so T3_monitor can pick up dumps written while
+it was down and skip those it has already done.
+
+Each status change is appended as one JSON line (id, time,
+status, input file, products), under a file lock so the
+monitor's worker processes can all write to it. The latest
+line for an id is its current state.
+
+    ledger = cand_ledger.Ledger('/hdd/data/candidates/T3/ledger.jsonl')
+    ledger.record(c, 'done', fn_vol=v, products=dict(fil=fn_outfil, png=pngfile))
+    todo = cand_ledger.unprocessed_dumps('/hdd/data/voltages/', ledger)
+"""
+import os
+import glob
+import json
+import time
+import fcntl
+
+# status of a candidate that needs no more work
+DONE = 'done'
+
+
+def dump_candidate(fn_vol):
+    """ Candidate ID of a grex_dump-<id>.nc voltage file. """
+    return os.path.basename(fn_vol).split('.')[0].split('-')[-1]
+
+
+class Ledger:
+    """ Append-only JSONL ledger of candidate status.
+
+    Parameters
+    ----------
+    fn : str
+        The ledger file, created if needed
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self._offset = 0
+        self._entries = {}
+
+    def record(self, c, status, fn_vol=None, products=None, **extra):
+        """ Append the status of candidate c, e.g. 'queued',
+        'done', 'failed' or 'dropped'.
+        """
+        entry = dict(id=c, time=time.time(), status=status,
+                     fn_vol=fn_vol, products=products or {}, **extra)
+        line = json.dumps(entry) + '\n'
+        os.makedirs(os.path.dirname(os.path.abspath(self.fn)), exist_ok=True)
+        with open(self.fn, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line)
+            f.flush()
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    def entries(self):
+        """ Latest entry of every candidate, keyed by ID. Only
+        the lines added since the last call are read.
+        """
+        if not os.path.exists(self.fn):
+            return self._entries
+        with open(self.fn, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        end = chunk.rfind(b'\n') + 1
+        for line in chunk[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self._entries[entry['id']] = entry
+        self._offset += end
+        return self._entries
+
+    def status(self, c):
+        """ Current status of candidate c, None if never seen. """
+        entry = self.entries().get(c)
+        return None if entry is None else entry['status']
+
+    def is_done(self, c, products=None):
+        """ Whether c was processed and its products still exist.
+
+        Parameters
+        ----------
+        products : dict
+            Expected products of c. If the ledger has no entry
+            for c but these all exist, c counts as done, so
+            candidates processed before there was a ledger
+            aren't redone.
+        """
+        entry = self.entries().get(c)
+        if entry is None:
+            return bool(products) and all(os.path.exists(fn) for fn in products.values())
+        if entry['status'] != DONE:
+            return False
+        return all(os.path.exists(fn) for fn in entry['products'].values())
+
+
+def unprocessed_dumps(mon_dir, ledger, pattern='grex_dump-*.nc', min_age=0.,
+                      products=None):
+    """ Voltage dumps in mon_dir not yet done according to
+    the ledger, oldest first. Recent files may still be being
+    written, so should be waited for (file_ready.wait_for_file)
+    before reading; min_age leaves out those modified in the
+    last min_age seconds.
+
+    Parameters
+    ----------
+    products : callable
+        products(c) gives the expected products of candidate c,
+        see Ledger.is_done
+
+    Returns
+    -------
+    todo : list
+        (candidate ID, voltage file)
+    """
+    now = time.time()
+    files = []
+    for fn in glob.glob(os.path.join(mon_dir, pattern)):
+        try:
+            mtime = os.path.getmtime(fn)
+        except FileNotFoundError:
+            continue
+        if now - mtime >= min_age:
+            files.append((mtime, fn))
+
+    todo = []
+    for _, fn in sorted(files):
+        c = dump_candidate(fn)
+        if not ledger.is_done(c, None if products is None else products(c)):
+            todo.append((c, fn))
+    return todo
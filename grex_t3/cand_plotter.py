@@ -5,18 +5,19 @@
 import numpy as np
 import pandas as pd
 import sys
-from matplotlib import pyplot as plt
 import xarray as xr
 import json
 import os
 import logging
-from your.formats.filwriter import make_sigproc_object
-import clean_rfi
 
 T3_path = '/home/user/zghuai/GReX-T3/grex_t3/'
 sys.path.append(T3_path)
 import candproc_tools as ct
 import analysis_tools as at
+from grex_t3 import t2_store
+from grex_t3 import plot_templates
+from grex_t3 import product_cache
+from grex_t3 import stage_trace
 
 dir_mon  = "/hdd/data/voltages/"
 dir_plot = "/hdd/data/candidates/T3/candplots/"
@@ -51,70 +52,91 @@ def get_cand(JSON):
         return None  
     
 
-def gen_cand(fn_vol, fn_tempfil, fn_filout, JSON, v=False): # tab - json file
+def gen_cand(fn_vol, fn_filout, JSON, v=False, nbits=32, cache=None, trace=None): # tab - json file
     """
     ----------
     Inputs:
     fn_vol = input voltage filename
-    fn_tempfil = temporary filterbank filename, will be removed after generating a plot
     fn_filout = output .fil filename
     JSON = candidate .json filename (e.g. 240321aazm.json)
     v = True: log verbose information
+    nbits = 32 for float .fil output, or 8 / 16 for scaled integers 
+            with a .scales.npz sidecar (read back with ct.read_sigproc)
+    cache = True for the default product_cache, a ProductCache, or None (default).
+            On a hit (same voltage file, candidate and parameters, and 
+            fn_filout still on disk) the read and dedispersion are skipped.
+    trace = stage_trace.Trace to record the time of each stage in
     ----------
     Returns:
     cand = dedispersed, downsampled Candidate object usinng the YOUR package
     tab = .json table
     """
 
+    if trace is None:
+        trace = stage_trace.Trace(None)
     tab = get_cand(JSON)
+    # thresholds of the RFI cleaning done as Stokes I is formed
+    rfi_clean = dict(sigma_thresh_time=10., sigma_thresh_freq=10.)
+
+    cache = product_cache.resolve_cache(cache)
+    if cache is not None:
+        key = cache.key(fn_vol, dm=tab["dm"].values[0], ibox=tab["ibox"].values[0],
+                        ndm=32, freq_factor=16, fn_filout=fn_filout, nbits=nbits,
+                        rfi_clean=rfi_clean)
+        with trace.span('cache_load'):
+            products = cache.get(key) if os.path.exists(fn_filout) else None
+        if products is not None:
+            logging.info(f"Loaded {fn_vol} products from cache.")
+            cand = ct.ArrayCandidate(products['ft'], fch1=products['fch1'], 
+                                     foff=products['foff'], tsamp=products['tsamp'],
+                                     tstart=products['tstart'], dm=products['dm'])
+            cand.dedispersed = cand.data
+            cand.dmt = products['dmt']
+            return(cand, tab)
+
     # t0 = tab["mjds"].values[0] # ToA of the candidate
     ds_stokesi = 1
     dt = 8.192e-6 * ds_stokesi # s 
     Dt = 4.15 * tab["dm"].values[0] * (1/1.28**2 - 1/1.53**2) / 1e3 # delay in seconds given DM
     
-    (stokesi, T0, dur) = ct.read_voltage_data(fn_vol, 
-                                              timedownsample=None, 
-                                              freqdownsample=None, 
-                                              verbose=True, 
-                                              nbit='float32')
-    print('Done reading .nc and calc stokes I')
-
-    # choose the center of the 
-    mm = (stokesi.shape[0]//2) # assume the pulse is centered
+    # only read the dispersed window around the pulse, 
+    # assumed to be at the center of the dump
     window_width = int(Dt*2.5 / dt)
-    if window_width > stokesi.shape[0]:
-        window_width = stokesi.shape[0]
-    if v==True:
-        logging.info(f"index mm = {mm}, stokesi shape = {stokesi.shape}.")
-        print(f"index mm = {mm}, stokesi shape = {stokesi.shape}.")
 
     # dispersed candidate window in xarray dataarray format.
-    cand_disp = stokesi[(mm-window_width//2):(mm+window_width//2), :].copy()
-    # RFI clean
-    clean_rfi.clean_block(cand_disp.values, 10, 10)
-    # replace NaNs with the mean value, otherwise the Your library won't calculate dmtime for us (all NaNs in there)
-    cand_disp.values = cand_disp.fillna(np.nanmean(cand_disp))
-
-    # write the dispersed pulse to a temporary .fil file
-    # do not save intermediate file 
-    ct.write_sigproc(fn_tempfil, cand_disp, t_start=T0+(mm-window_width//2)*dt/86400) 
+    # (Stokes I and RFI cleaning are done chunk by chunk during the read)
+    with trace.span('read_clean'):
+        (cand_disp, T0, dur) = ct.read_voltage_data(fn_vol, 
+                                                    timedownsample=None, 
+                                                    freqdownsample=None, 
+                                                    verbose=True, 
+                                                    nbit='float32',
+                                                    half_width=window_width//2,
+                                                    rfi_clean=rfi_clean)
+    print('Done reading .nc, calc stokes I and RFI clean')
+
+    # the window is clipped to the length of the dump
+    window_width = cand_disp.shape[0]
+    if v==True:
+        logging.info(f"window width = {window_width}, cand_disp shape = {cand_disp.shape}.")
+        print(f"window width = {window_width}, cand_disp shape = {cand_disp.shape}.")
+
     if v==True:
-        logging.info(f"Done writing to a temporary .fil file.")
-        print(f"Done writing to a temporary .fil file.")
-
-    # Using Liam's candproc_tools.py to read the temporary .fil, dedisperse, and calculate DMtime
-    cand = ct.read_proc_fil(fnfil=fn_tempfil, 
-                            dm=tab["dm"].values[0], 
-                            tcand=2.0, 
-                            width=1, 
-                            device=0, 
-                            tstart=0,
-                            tstop=(cand_disp.time.max()-cand_disp.time.min()).values*86400, 
-                            zero_topbottom=False,
-                            ndm=32, 
-                            dmtime_transform=True)
+        logging.info(f"RFI flagged {cand_disp.rfi_mask.values.mean()*100:.1f}% of the window.")
+
+    # build the candidate from the dispersed pulse in memory, dedisperse, and calculate DMtime
+    with trace.span('dedisperse'):
+        cand = ct.proc_cand_array(cand_disp, 
+                                  dm=tab["dm"].values[0], 
+                                  tcand=2.0, 
+                                  width=1, 
+                                  device=0, 
+                                  t_start=T0,
+                                  zero_topbottom=False,
+                                  ndm=32, 
+                                  dmtime_transform=True)
     if v==True:
-        logging.info("Done reading the temporary .fil and dedispersing the candidate.")
+        logging.info("Done dedispersing the candidate.")
     print('Done dedispersing')
 
     # generate a smaller window containing the dedispersed pulse and save to .fil
@@ -130,58 +152,35 @@ def gen_cand(fn_vol, fn_tempfil, fn_filout, JSON, v=False): # tab - json file
     # select a smaller time window for the dedispersed pulse
     data_freqtime = cand.dedispersed[mm-window_time//2:mm+window_time//2, :] 
 
-    # write to .fil
-    nchans = cand.nchans
-    foff = cand.foff
-    fch1 = cand.fch1
-    tsamp = cand.tsamp 
-    sigproc_object = make_sigproc_object(
-                                    rawdatafile=fn_filout,
-                                    source_name="bar",
-                                    nchans=nchans,
-                                    foff=foff,  # MHz
-                                    fch1=fch1,  # MHz
-                                    tsamp=tsamp,  # seconds
-                                    tstart=cand.tstart+(mm-window_width//2)*dt/86400,  
-                                    src_raj=112233.44,  # HHMMSS.SS
-                                    src_dej=112233.44,  # DDMMSS.SS
-                                    machine_id=0,
-                                    nbeams=1,
-                                    ibeam=0,
-                                    nbits=32,
-                                    nifs=1,
-                                    barycentric=0,
-                                    pulsarcentric=0,
-                                    telescope_id=6,
-                                    data_type=0,
-                                    az_start=-1,
-                                    za_start=-1,)
-    
-    sigproc_object.write_header(fn_filout)
-    sigproc_object.append_spectra(data_freqtime, fn_filout)
+    # write to .fil, through a per-candidate temp path so concurrent
+    # workers never see each other's partial files
+    fn_part = f"{fn_filout}.{os.getpid()}.part"
+    with trace.span('write_fil'):
+        with ct.SigprocWriter(fn_part, fch1=cand.fch1, foff=cand.foff,
+                              nchans=cand.nchans, tsamp=cand.tsamp,
+                              tstart=cand.tstart+(mm-window_width//2)*dt/86400,
+                              nbits=nbits) as writer:
+            writer.write(data_freqtime)
+        if nbits < 32:
+            os.replace(ct.scales_path(fn_part), ct.scales_path(fn_filout))
+        os.replace(fn_part, fn_filout)
     logging.info(f"Done saving the dedispersed pulse into filterbank file {fn_filout}.")
 
-    # downsampling 
-    # frequency ds by 16
-    cand.decimate(key = 'ft', 
-                  decimate_factor = 16, 
-                  axis = 1) 
-    # time ds by ibox
-    cand.decimate(key = 'ft', 
-                  decimate_factor = tab['ibox'].values[0],
-                  axis = 0,
-                  pad = True) 
-    # time ds in DMtime domain
-    cand.decimate(key='dmt',
-                  decimate_factor = tab['ibox'].values[0],
-                  axis = 1,
-                  pad = True) 
-    # update downsampled time resolution in cand.
-    cand.tsamp = cand.tsamp * tab['ibox'].values[0]
+    # downsampling, frequency by 16 and time by ibox in both ft and DMtime,
+    # also updates the downsampled time resolution in cand.
+    with trace.span('decimate'):
+        ct.decimate_cand(cand, 
+                         freq_factor = 16, 
+                         time_factor = tab['ibox'].values[0])
     if v==True:
         logging.info(f"Done downsampling: cand.dedispersed.shape = {cand.dedispersed.shape}; cand.dmt.shape = {cand.dmt.shape}.")
         print(f"Done downsampling: cand.dedispersed.shape = {cand.dedispersed.shape}; cand.dmt.shape = {cand.dmt.shape}.")
 
+    if cache is not None:
+        cache.put(key, dict(ft=cand.dedispersed, dmt=cand.dmt, 
+                            fch1=cand.fch1, foff=cand.foff, tsamp=cand.tsamp, 
+                            tstart=cand.tstart, dm=cand.dm))
+
     return(cand, tab)
 
 
@@ -204,18 +203,20 @@ def plot_grex(cand, tab, JSON, v=False):
 
     # number of samples in the downsampled window
     window_time = 1024
-    if window_time > (cand.data.shape[0]/tab['ibox'].values[0]):
-        window_time = int(cand.data.shape[0]/tab['ibox'].values[0])
     ntime, nchans = cand.dedispersed.shape[0], cand.dedispersed.shape[1]
+    if window_time > ntime:
+        window_time = ntime
     # roughly from 1300MHz to 1500MHz, removing junks near the two edges. (in downsampled space)
     f_low = int(278/16) 
     f_high = nchans - int(164/16) 
     
-    cluster = pd.read_csv(cluster_output)
     # snr,if,specnum,mjds,ibox,idm,dm,ibeam,cl,cntc,cntb,trigger
     # candidates nearby within 60s
     cluster_time = 60./86400 # candidates within nearby 60 s
-    this_cand = np.where(np.abs(cluster['mjds']-tab["mjds"].values[0])<cluster_time)[0] 
+    store = t2_store.get_store(cluster_output)
+    store.update()
+    cluster = store.window(tab["mjds"].values[0], cluster_time*86400)
+    this_cand = np.arange(len(cluster))
     
     # find the index of the start of the pulse <- center of cand.data
     mm = int(ntime / 2)
@@ -250,77 +251,32 @@ def plot_grex(cand, tab, JSON, v=False):
     snr_tools = at.SNR_Tools()
     stds = snr_tools.calc_snr_presto(data_timestream, verbose=True)[1]
     
-    # Plot
+    # Plot, reusing the same figure for every candidate
     logging.info("Starting to plot!")
-    fig = plt.figure(figsize=(10,15))
-    grid = plt.GridSpec(9, 6)
-
-    # first row, collapse frequency -> time stream
-    plt.subplot(grid[0, :6])
-    plt.plot(times, (data_timestream-np.mean(data_timestream))/stds, lw=1., color='black')
-    plt.ylabel('SNR')
-    plt.xlim(times.min(), times.max())
-    plt.xticks([], [])
-
-    # the dedispersed pulse
-    plt.subplot(grid[1:3, :6])
+    extent = (times.min()-t_in_nc*1000, times.max()-t_in_nc*1000)
+    time_label = 'Time (ms)+ MJD {}'.format(cand.tstart+(mm*cand.tsamp)/86400)
     vmax = np.mean(data_freqtime) + 2*np.std(data_freqtime)
-    plt.imshow(data_freqtime, 
-               aspect='auto', 
-               vmax=vmax,
-               extent=(times.min()-t_in_nc*1000, times.max()-t_in_nc*1000, freqs.min(), freqs.max()),
-               interpolation='nearest')
     DM0_delays = tmin + cand.dm * 4.15E6 * (freqmin**-2 - freqs**-2) # zero DM sweep
-    plt.plot(DM0_delays, freqs, c='r', lw='2', alpha=0.35)
-    plt.xlabel('Time (ms)+ MJD {}'.format(cand.tstart+(mm*cand.tsamp)/86400), fontsize=12)
-    plt.ylabel('Frequency (MHz)', fontsize=12)
-    plt.xlim(tmin, tmax)
-
-    # DM vs. time
-    plt.subplot(grid[4:6, 0:6])
-    plt.imshow(data_dmt, 
-               aspect='auto', 
-               interpolation='nearest',
-               extent=(times.min()-t_in_nc*1000, times.max()-t_in_nc*1000, 0, 2*cand.dm))
-    plt.xlabel('Time (ms)+ MJD {}'.format(cand.tstart+(mm*cand.tsamp)/86400), fontsize=12)
-    plt.ylabel(r'DM ($pc\cdot cm^{-3}$)', fontsize=12)
-    
-    # DM vs. MJD in cluster_output.csv
-    plt.subplot(grid[7:9, 0:6])
-    plt.scatter((cluster["mjds"][this_cand].values - tab['mjds'].values[0])*86400, 
-                cluster["dm"][this_cand].values, 
-                s=cluster['snr'][this_cand].values / cluster['snr'][this_cand].values.max() * 100, # "normalize" marker size to 100
-                c=cluster['snr'][this_cand].values)
-    plt.xlim(-cluster_time*86400/2, cluster_time*86400/2)
-    plt.xlabel('Time (s) + MJD {}'.format(tab['mjds'].values[0]), fontsize=12)
-    plt.ylabel(r'DM ($pc\cdot cm^{-3}$)', fontsize=12)
-
-
-    # doesn't seem to work?
-    plt.subplots_adjust(left=0.1,
-                        bottom=0.1, 
-                        right=0.8, 
-                        top=0.8, 
-                        wspace=0.05, 
-                        hspace=0.01)
-
-    # Add some candidate description as the tile
-    fig.text(0.1, 0.875, 'DM = {} pc/cm^3'.format(tab["dm"].values[0]),
-             fontsize = 12,fontweight='semibold')
-    fig.text(0.1, 0.86, 'Arriving time = MJD {}'.format(tab['mjds'].values[0]),
-             fontsize = 12,fontweight='semibold')
-    fig.text(0.1, 0.845, 'SNR = {}'.format(tab['snr'].values[0]),
-             fontsize = 12,fontweight='semibold')
-    fig.text(0.1,0.83, 'Filename:'+JSON,
-             fontsize = 12,fontweight='semibold')
-    fig.text(0.1, 0.815, 'Ibox width = {}'.format(tab['ibox'].values[0]),
-             fontsize = 12, fontweight='semibold')
-    
-    plt.savefig(dir_plot + 'grex_cand{}.png'.format(JSON.split('.')[0]), bbox_inches='tight')
+
+    tpl = plot_templates.get_template(plot_templates.GrexCandPlot)
+    tpl.render(times, (data_timestream-np.mean(data_timestream))/stds,
+               data_freqtime, extent + (freqs.min(), freqs.max()), vmax,
+               DM0_delays, freqs,
+               data_dmt, extent + (0, 2*cand.dm), time_label,
+               (cluster["mjds"][this_cand].values - tab['mjds'].values[0])*86400,
+               cluster["dm"][this_cand].values,
+               cluster['snr'][this_cand].values,
+               (-cluster_time*86400/2, cluster_time*86400/2),
+               'Time (s) + MJD {}'.format(tab['mjds'].values[0]),
+               ['DM = {} pc/cm^3'.format(tab["dm"].values[0]),
+                'Arriving time = MJD {}'.format(tab['mjds'].values[0]),
+                'SNR = {}'.format(tab['snr'].values[0]),
+                'Filename:'+JSON,
+                'Ibox width = {}'.format(tab['ibox'].values[0])])
+
+    tpl.save(dir_plot + 'grex_cand{}.png'.format(JSON.split('.')[0]), bbox_inches='tight')
 
     logging.info("Done saving the plot.")
-    
-    plt.show()
 
     return()
 
@@ -328,13 +284,8 @@ def plot_grex(cand, tab, JSON, v=False):
 # if __name__ == '__main__':
 #     candname = js.split('.')[0] # candidate name 
 #     vol_fn = dir_mon + "grex_dump-"+candname+".nc" # corresponding voltage netcdf file
-#     fn_tempfil = dir_plot + "intermediate.fil" # output temporary filterbank file, removed afterwards
 #     fn_outfil = dir_fil + f"cand{candname}.fil" # output dedispersed candidate filterbank file 
 
-#     (cand, tab) = gen_cand(vol_fn, fn_tempfil, fn_outfil, candname+'.json')
+#     (cand, tab) = gen_cand(vol_fn, fn_outfil, candname+'.json')
 #     plot_grex(cand, tab, candname+".json") 
 
-#     cmd = "rm {}".format(fn_tempfil)
-#     print(cmd)
-#     os.system(cmd)
-
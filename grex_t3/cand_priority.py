@@ -0,0 +1,101 @@
+""" Order queued candidates so the interesting ones are
+processed first during a burst of dumps.
+
+Candidates are scored from their T2 S/N and DM and whether
+they are coincident with another station, and the highest
+score is handed out first. When the backlog is full the
+lowest-scored candidates are preempted: they are dropped
+from the queue and handed back to the caller to defer.
+
+    queue = cand_priority.CandidateQueue(max_backlog=32)
+    deferred = queue.push(c, cand_priority.candidate_score(snr, dm, coincident))
+    c = queue.pop()
+"""
+import os
+import heapq
+import itertools
+
+import pandas as pd
+
+# score = snr_weight * snr + dm_bonus if dm > dm_thresh + coincidence_bonus if coincident
+SCORE_WEIGHTS = dict(snr_weight=1., dm_thresh=50., dm_bonus=10.,
+                     coincidence_bonus=100.)
+
+_coincident = {}
+
+
+def candidate_score(snr, dm, coincident=False, snr_weight=1.,
+                    dm_thresh=50., dm_bonus=10., coincidence_bonus=100.):
+    """ Priority of a candidate, higher is processed first.
+    Low-DM events are mostly RFI, so a DM above dm_thresh adds
+    dm_bonus, and a coincidence with another station adds
+    coincidence_bonus, on top of the weighted T2 S/N.
+    """
+    score = snr_weight * float(snr)
+    if dm > dm_thresh:
+        score += dm_bonus
+    if coincident:
+        score += coincidence_bonus
+    return score
+
+def coincident_triggers(fn_coincidence):
+    """ Names of the T2 triggers in a coincidence CSV written
+    by coincidence.run_coincidencer, reread only when it changes.
+    """
+    if not os.path.exists(fn_coincidence):
+        return set()
+    mtime = os.stat(fn_coincidence).st_mtime_ns
+    if fn_coincidence not in _coincident or _coincident[fn_coincidence][0] != mtime:
+        triggers = pd.read_csv(fn_coincidence, usecols=['trigger'])['trigger']
+        _coincident[fn_coincidence] = (mtime, set(triggers.astype(str)))
+    return _coincident[fn_coincidence][1]
+
+
+class CandidateQueue:
+    """ Max-priority queue of candidates with a bounded backlog.
+
+    Parameters
+    ----------
+    max_backlog : int
+        Candidates held before the lowest-scored are preempted
+    """
+    def __init__(self, max_backlog=32):
+        self.max_backlog = max_backlog
+        # (-score, seq, item), so equal scores come out first in, first out
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item, score):
+        """ Queue item with score.
+
+        Returns
+        -------
+        preempted : list
+            (item, score) of anything dropped to keep the backlog
+            within max_backlog, possibly item itself
+        """
+        heapq.heappush(self._heap, (-score, next(self._seq), item))
+        preempted = []
+        if len(self._heap) > self.max_backlog:
+            # the lowest scores, latest first among equals
+            nshed = len(self._heap) - self.max_backlog
+            shed = heapq.nlargest(nshed, self._heap)
+            for entry in shed:
+                self._heap.remove(entry)
+                preempted.append((entry[2], -entry[0]))
+            heapq.heapify(self._heap)
+        return preempted
+
+    def pop(self):
+        """ The highest-scored item, raising IndexError if empty. """
+        return heapq.heappop(self._heap)[2]
+
+    def peek_score(self):
+        return -self._heap[0][0] if self._heap else float("-inf")
+
+    def items(self):
+        """ (item, score) in the order they would be popped. """
+        return [(item, -negscore) for negscore, _, item in sorted(self._heap)]
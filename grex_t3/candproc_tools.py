@@ -1,46 +1,120 @@
+import os
+import threading
+from types import SimpleNamespace
+
 import numpy as np
 import xarray
+import dask.array
 import matplotlib.pyplot as plt
 import pandas as pd
+from numba import njit
 
 from your.candidate import Candidate
 from your.formats.filwriter import make_sigproc_object
+from your.formats.pysigproc import SigprocFile
 
-def write_sigproc(fnfilout, stokesi_obj, t_start=59246):
-    """ Write a StokesI object to a .fil file 
-    using the YOUR library.
+from grex_t3 import dedisp_tools
+from grex_t3 import rfi_offline
+
+def time_axis_tsamp(times):
+    """ Sampling time in seconds of an MJD time axis.
+    Averaged over the whole axis, since the difference 
+    of two adjacent MJDs loses most of its precision.
+    """
+    if len(times) < 2:
+        return 0.
+    return (times[-1] - times[0]) / (len(times) - 1) * 86400.
+
+def scales_path(fnfil):
+    """ Sidecar holding the per-channel scale and 
+    offset of an 8 or 16-bit .fil file.
+    """
+    return fnfil + '.scales.npz'
+
+def channel_scales(data, nbits, nsigma=8.):
+    """ Per-channel scale and offset that map the range 
+    median +/- nsigma robust standard deviations (1.4826 MAD)
+    of data (time, freq) onto nbits unsigned integers.
+
+    Samples outside it are clipped by quantize_spectra, so 
+    one RFI spike doesn't squeeze the rest of its channel 
+    into a few levels. The range never extends past the 
+    data, and channels with a MAD of zero use their full 
+    min to max range.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    dmin, dmax = np.min(data, axis=0), np.max(data, axis=0)
+    med = np.median(data, axis=0)
+    sigma = np.float32(1.4826) * np.median(np.abs(data - med), axis=0)
+    lo = np.where(sigma > 0, np.maximum(med - nsigma * sigma, dmin), dmin)
+    hi = np.where(sigma > 0, np.minimum(med + nsigma * sigma, dmax), dmax)
+    scale = ((hi - lo) / np.float32(2**nbits - 1)).astype(np.float32)
+    scale[scale == 0] = 1.
+
+    return scale, lo.astype(np.float32)
+
+def quantize_spectra(data, scale, offset, nbits):
+    """ Scale float spectra (time, freq) to unsigned integers. """
+    q = np.rint((np.asarray(data, dtype=np.float32) - offset) / scale)
+    return np.clip(q, 0, 2**nbits - 1).astype(
+        {8: np.uint8, 16: np.uint16}[nbits])
+
+class SigprocWriter:
+    """ Write a SIGPROC filterbank a chunk at a time.
+    The header is written once on creation, and spectra
+    are placed by sample offset, so chunks can arrive in
+    any order, e.g. from dask.array.store.
 
     Parameters
     ----------
     fnfilout : str
-        The file name of the .fil file to write to.
-    stokesi_obj : xarray.DataArray
-        The Stokes I data object to write.
-    t_start: float
-        Start time in MJD of the output .fil file.
-
-    Returns
-    -------
-    None
+        The file name of the .fil file to write to
+    fch1 : float
+        Frequency of the first channel in MHz
+    foff : float
+        Channel width in MHz
+    nchans : int
+        Number of channels
+    tsamp : float
+        Sampling time in seconds
+    tstart : float
+        MJD of the first sample in the file
+    nbits : int
+        Bits per sample, 32 for float32. With 8 or 16 
+        the spectra are quantized per channel and the 
+        scale and offset saved to scales_path(fnfilout)
+    scale, offset : ndarray
+        Per-channel quantization for 8 or 16 bits,
+        taken from the first chunk written if None
     """
-    nchans = stokesi_obj.freq.shape[0]
-    foff = np.diff(stokesi_obj.freq)[0]
-    fch1 = stokesi_obj.freq.values[0]
-    tsamp = np.diff(stokesi_obj.time)[0] * 86400.
-    sigproc_object = make_sigproc_object(
+    def __init__(self, fnfilout, fch1, foff, nchans, tsamp, tstart,
+                 nbits=32, source_name="bar", scale=None, offset=None):
+        self.fnfilout = fnfilout
+        self.nchans = int(nchans)
+        self.tsamp = tsamp
+        self.tstart = tstart
+        self.nbits = nbits
+        self.dtype = np.dtype({8: np.uint8, 16: np.uint16, 32: np.float32}[nbits])
+        self.bytes_per_spectrum = self.nchans * self.dtype.itemsize
+        self.nsamples = 0
+        self.scale = scale
+        self.offset = offset
+        self._lock = threading.Lock()
+
+        self.sigproc_object = make_sigproc_object(
                                     rawdatafile=fnfilout,
-                                    source_name="bar",
-                                    nchans=nchans,
+                                    source_name=source_name,
+                                    nchans=self.nchans,
                                     foff=foff,  # MHz
                                     fch1=fch1,  # MHz
                                     tsamp=tsamp,  # seconds
-                                    tstart=t_start,  # MJD
+                                    tstart=tstart,  # MJD
                                     src_raj=112233.44,  # HHMMSS.SS
                                     src_dej=112233.44,  # DDMMSS.SS
                                     machine_id=0,
                                     nbeams=1,
                                     ibeam=0,
-                                    nbits=32,
+                                    nbits=nbits,
                                     nifs=1,
                                     barycentric=0,
                                     pulsarcentric=0,
@@ -48,12 +122,245 @@ def write_sigproc(fnfilout, stokesi_obj, t_start=59246):
                                     data_type=0,
                                     az_start=-1,
                                     za_start=-1,)
+        self.sigproc_object.write_header(fnfilout)
+        self.hdrbytes = os.path.getsize(fnfilout)
+        self._fd = os.open(fnfilout, os.O_WRONLY)
+
+    @classmethod
+    def from_stokesi(cls, fnfilout, stokesi_obj, t_start=59246, nbits=32):
+        """ Writer with the frequency and time axes of 
+        a (time, freq) Stokes I DataArray. For 8 or 16 bits
+        the scales span the whole array.
+        """
+        freq = stokesi_obj.freq.values
+        foff = np.diff(freq)[0] if len(freq) > 1 else 0.
+        scale, offset = None, None
+        if nbits < 32:
+            scale, offset = channel_scales(stokesi_obj.values, nbits)
+        return cls(fnfilout, fch1=freq[0], foff=foff, nchans=len(freq),
+                   tsamp=time_axis_tsamp(stokesi_obj.time.values),
+                   tstart=t_start, nbits=nbits, scale=scale, offset=offset)
+
+    @property
+    def tstop(self):
+        """ MJD just after the last sample written. """
+        return self.tstart + self.nsamples * self.tsamp / 86400.
+
+    def write(self, spectra, start=None):
+        """ Write (ntime, nchans) spectra starting at 
+        sample start, or after the last sample if None.
+        """
+        spectra = np.asarray(spectra).reshape(-1, self.nchans)
+        if self.nbits < 32:
+            with self._lock:
+                if self.scale is None:
+                    self.scale, self.offset = channel_scales(spectra, self.nbits)
+            spectra = quantize_spectra(spectra, self.scale, self.offset, self.nbits)
+        spectra = np.ascontiguousarray(spectra, dtype=self.dtype)
+        with self._lock:
+            if start is None:
+                start = self.nsamples
+            self.nsamples = max(self.nsamples, start + len(spectra))
+        os.pwrite(self._fd, spectra.tobytes(),
+                  self.hdrbytes + start * self.bytes_per_spectrum)
+
+    def __setitem__(self, key, spectra):
+        # dask.array.store hands over (time, freq) slices
+        if isinstance(key, tuple):
+            if key[1] != slice(None) and key[1] != slice(0, self.nchans):
+                raise ValueError("SigprocWriter needs every channel in a chunk")
+            key = key[0]
+        self.write(spectra, start=key.start or 0)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            if self.nbits < 32 and self.scale is not None:
+                np.savez(scales_path(self.fnfilout),
+                         scale=self.scale, offset=self.offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
-    sigproc_object.write_header(fnfilout)
-    sigproc_object.append_spectra(stokesi_obj.data, fnfilout)
+def write_sigproc(fnfilout, stokesi_obj, t_start=59246, nbits=32):
+    """ Write a StokesI object to a .fil file 
+    using the YOUR library.
+
+    Parameters
+    ----------
+    fnfilout : str
+        The file name of the .fil file to write to.
+    stokesi_obj : xarray.DataArray
+        The Stokes I data object to write.
+    t_start: float
+        Start time in MJD of the output .fil file.
+    nbits : int
+        32 for float32, or 8 / 16 for scaled integers
+        that read_sigproc converts back
+
+    Returns
+    -------
+    None
+    """
+    with SigprocWriter.from_stokesi(fnfilout, stokesi_obj, t_start,
+                                    nbits=nbits) as writer:
+        writer.write(stokesi_obj.values)
+
+def read_sigproc(fnfil, start=0, nsamp=None, unscaled=False):
+    """ Read spectra from a .fil file through a memory map,
+    applying the per-channel scales of 8 and 16-bit files 
+    written by SigprocWriter.
+
+    Parameters
+    ----------
+    fnfil : str
+        The .fil file
+    start : int
+        First sample to read
+    nsamp : int
+        Number of samples, to the end of the file if None
+    unscaled : bool
+        Return the integers of an 8 or 16-bit file as they 
+        are, for files with no .scales.npz sidecar that
+        were not written by SigprocWriter
+
+    Returns
+    -------
+    data : ndarray
+        float32 (time, freq)
+    header : dict
+        fch1, foff, nchans, nbits, tsamp, tstart
+    """
+    sig = SigprocFile(fnfil)
+    header = dict(fch1=sig.fch1, foff=sig.foff, nchans=sig.nchans,
+                  nbits=sig.nbits, tsamp=sig.tsamp, tstart=sig.tstart)
+    hdrbytes = sig.hdrbytes
+    sig._mmdata.close()
+    sig.fp.close()
+
+    dtype = {8: np.uint8, 16: np.uint16, 32: np.float32}[header['nbits']]
+    raw = np.memmap(fnfil, dtype=dtype, mode='r', offset=hdrbytes)
+    raw = raw[:raw.size // header['nchans'] * header['nchans']]
+    raw = raw.reshape(-1, header['nchans'])
+    stop = raw.shape[0] if nsamp is None else start + nsamp
+    raw = raw[start:stop]
+
+    if header['nbits'] < 32 and not unscaled:
+        if not os.path.exists(scales_path(fnfil)):
+            raise FileNotFoundError(f"No {scales_path(fnfil)} to rescale the "
+                                    f"{header['nbits']}-bit {fnfil}, pass unscaled=True "
+                                    "to read the raw integers")
+        with np.load(scales_path(fnfil)) as scales:
+            data = raw * scales['scale'] + scales['offset']
+    else:
+        data = np.array(raw, dtype=np.float32)
+
+    return data.astype(np.float32, copy=False), header
+
+def voltage_time_window(times, center_sample=None, center_mjd=None,
+                        half_width=None):
+    """ Get the slice of time samples within half_width
+    of a centre sample or MJD. If no centre is given,
+    the window is placed in the middle of the dump.
+
+    Parameters
+    ----------
+    times : ndarray
+        The time axis of the voltage dump in MJD
+    center_sample : int
+        Index of the central time sample
+    center_mjd : float
+        MJD of the central time sample
+    half_width : int
+        Half-width of the window in samples
+
+    Returns
+    -------
+    window : slice
+        The time samples to keep, clipped to the dump
+    """
+    ntime = len(times)
+
+    if half_width is None:
+        return slice(0, ntime)
+
+    if center_sample is None:
+        if center_mjd is not None:
+            center_sample = int(np.searchsorted(times, center_mjd))
+        else:
+            center_sample = ntime // 2
+
+    half_width = int(half_width)
+    start = max(0, center_sample - half_width)
+    stop = min(ntime, center_sample + half_width)
+
+    return slice(start, stop)
+
+@njit(nogil=True)
+def _stokesi_kernel(voltages, out):
+    """ Sum re**2 + im**2 over both polarizations,
+    straight from the integer voltages (time, freq, pol, reim)
+    into out (time, freq).
+    """
+    ntime, nfreq, npol, nreim = voltages.shape
+    for tt in range(ntime):
+        for ff in range(nfreq):
+            acc = np.float32(0.)
+            for pp in range(npol):
+                for rr in range(nreim):
+                    x = np.float32(voltages[tt, ff, pp, rr])
+                    acc += x * x
+            out[tt, ff] = acc
+
+def stokesi_from_voltages(voltages, out=None):
+    """ Compute Stokes I from raw voltages in a single 
+    pass, without building complex or float64 temporaries.
+
+    Parameters
+    ----------
+    voltages : ndarray
+        Integer voltages with shape (time, freq, pol, reim)
+    out : ndarray
+        Optional preallocated float32 array (time, freq)
+
+    Returns
+    -------
+    out : ndarray
+        Stokes I, float32 (time, freq)
+    """
+    if out is None:
+        out = np.empty(voltages.shape[:2], dtype=np.float32)
+    _stokesi_kernel(voltages, out)
+    return out
+
+def _stokesi_block(voltages, nbit='float32', timedownsample=1,
+                   freqdownsample=1, downsample=False, rfi_clean=None,
+                   with_mask=False):
+    """ Stokes I of one block of voltages (time, freq, pol, reim),
+    cast to nbit and, if downsample, averaged by the given factors.
+    If rfi_clean is a dict of rfi_offline.clean_chunk arguments, 
+    the block is cleaned, and with_mask stacks its flags behind
+    it as a last axis, (time, freq, [stokesi, mask]).
+    """
+    stokesi = stokesi_from_voltages(voltages).astype(nbit, copy=False)
+    if downsample:
+        ntime, nfreq = stokesi.shape
+        stokesi = stokesi.reshape(ntime // timedownsample, timedownsample,
+                                  nfreq // freqdownsample, freqdownsample).mean(axis=(1, 3))
+    if rfi_clean is not None:
+        chunk_mask = rfi_offline.clean_chunk(stokesi, **rfi_clean)
+        if with_mask:
+            return np.stack([stokesi, chunk_mask.astype(stokesi.dtype)], axis=-1)
+    return stokesi
 
 def read_voltage_data(file_name, timedownsample=None,
-                      freqdownsample=None, verbose=None, nbit='uint32'):
+                      freqdownsample=None, verbose=None, nbit='uint32',
+                      center_sample=None, center_mjd=None, half_width=None,
+                      fnfilout=None, rfi_clean=None):
     """ Read in the voltage data from a .nc file 
     and return it as StokesI.
 
@@ -65,37 +372,292 @@ def read_voltage_data(file_name, timedownsample=None,
         The factor to downsample in time
     freqdownsample : int
         The factor to downsample in frequency
+    center_sample : int
+        Central time sample of the window to read
+    center_mjd : float
+        MJD of the centre of the window to read, 
+        used if center_sample is None
+    half_width : int
+        Half-width of the window in samples. If None 
+        the whole dump is read. The window is selected 
+        lazily, so only those samples are decoded.
+
+    fnfilout : str
+        If given, stream Stokes I chunk by chunk into this 
+        32-bit .fil file instead of returning the array
+    rfi_clean : bool or dict
+        Clean each chunk with rfi_offline.clean_chunk as it 
+        is formed (after downsampling), passing a dict as its 
+        thresholds. The flags are returned as an rfi_mask 
+        (time, freq) coordinate of stokesi.
+
+    Downsampling happens chunk by chunk before the
+    result is gathered, so memory scales with the output.
     
     Returns
     -------
     stokesi : xarray.DataArray
-        The Stokes I data object
+        The Stokes I data object, or fnfilout if given
     """
     ds = xarray.open_dataset(file_name, chunks={"time": 2048})
+    window = voltage_time_window(ds.time.values, center_sample=center_sample,
+                                 center_mjd=center_mjd, half_width=half_width)
+    ds = ds.isel(time=window)
 
-    # Create complex numbers from Re/Im
-    voltages = ds["voltages"].sel(reim="real") + ds["voltages"].sel(reim="imaginary") * 1j
-    # Make Stokes I by converting to XX/YY and then creating XX**2 + YY**2
-    stokesi = np.square(np.abs(voltages)).astype(nbit)
-    stokesi = stokesi.sum(dim='pol').astype(nbit)  # Summing and then converting type if necessary
+    # trim to whole output samples, as coarsen(boundary='trim') does
+    downsample = timedownsample is not None or freqdownsample is not None
+    tds = int(timedownsample or 1)
+    fds = int(freqdownsample or 1)
+    ntime_out, nfreq_out = len(ds.time) // tds, len(ds.freq) // fds
+    times = ds.time.values[:ntime_out*tds].reshape(ntime_out, tds).mean(1)
+    freqs = ds.freq.values[:nfreq_out*fds].reshape(nfreq_out, fds).mean(1)
 
-    # Compute in parallel (if using Dask)
-    stokesi = stokesi.compute()
-    
-    if timedownsample is not None:
-        stokesi = stokesi.coarsen(time=int(timedownsample), boundary='trim').mean()
-    if freqdownsample is not None:
-        stokesi = stokesi.coarsen(freq=int(freqdownsample), boundary='trim').mean()
+    # Make Stokes I as XX**2 + YY**2 with the fused kernel, casting and 
+    # downsampling each chunk in the graph so only the output is held in memory
+    voltages = ds["voltages"].transpose("time", "freq", "pol", "reim")
+    voltages = voltages.data[:ntime_out*tds, :nfreq_out*fds]
+    voltages = voltages.rechunk({0: max(tds, 2048 // tds * tds), 1: -1, 2: -1, 3: -1})
+    out_dtype = np.dtype(nbit)
+    if downsample and out_dtype.kind != 'f':
+        # the mean of integers is float64, as with coarsen
+        out_dtype = np.dtype(np.float64)
+    if rfi_clean is True:
+        rfi_clean = {}
+    elif rfi_clean is False:
+        rfi_clean = None
+    # the flags come back through the graph alongside Stokes I
+    with_mask = rfi_clean is not None and fnfilout is None
+    chunks = (tuple(c // tds for c in voltages.chunks[0]), (nfreq_out,))
+    stokesi = voltages.map_blocks(_stokesi_block, nbit=nbit, timedownsample=tds,
+                                  freqdownsample=fds, downsample=downsample,
+                                  rfi_clean=rfi_clean, with_mask=with_mask,
+                                  drop_axis=[3] if with_mask else [2, 3],
+                                  dtype=out_dtype,
+                                  chunks=chunks + ((2,),) if with_mask else chunks)
+    if with_mask:
+        stokesi, mask = stokesi[..., 0], stokesi[..., 1] != 0
+
+    if fnfilout is not None:
+        # Each chunk goes straight to disk, nothing is gathered
+        writer = SigprocWriter(fnfilout, fch1=freqs[0],
+                               foff=np.diff(freqs)[0] if nfreq_out > 1 else 0.,
+                               nchans=nfreq_out, tsamp=time_axis_tsamp(times),
+                               tstart=ds.time.values[0])
+        with writer:
+            dask.array.store(stokesi, writer, lock=False)
+        stokesi = fnfilout
+    else:
+        # Compute in parallel and gather the results back here, which
+        # works on any scheduler, unlike storing into a local array
+        coords = {"time": times, "freq": freqs}
+        if with_mask:
+            data, mask_data = dask.compute(stokesi, mask)
+            coords["rfi_mask"] = (("time", "freq"), mask_data)
+        else:
+            data, = dask.compute(stokesi)
+        stokesi = xarray.DataArray(data, dims=("time", "freq"), coords=coords)
 
     if verbose==None:
         return stokesi
     else:
         return stokesi, ds.time.min().values, (ds.time.values.max() - ds.time.values.min())*86400
 
+class ArrayCandidate(Candidate):
+    """ A YOUR Candidate built from an in-memory 
+    (time, freq) Stokes I array rather than a 
+    filterbank file on disk.
+
+    Parameters
+    ----------
+    data : ndarray
+        Stokes I with shape (time, freq)
+    fch1 : float
+        Frequency of the first channel in MHz
+    foff : float
+        Channel width in MHz
+    tsamp : float
+        Sampling time in seconds
+    tstart : float
+        MJD of the first sample
+    """
+
+    def __init__(self, data, fch1, foff, tsamp, tstart=0.,
+                 dm=0, tcand=0, width=0, label=-1, snr=0,
+                 min_samp=256, device=0, source_name="bar"):
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        ntime, nchans = data.shape
+
+        self.your_file = None
+        self.source_name = source_name
+        self.fch1 = fch1
+        self.foff = foff
+        self.nchans = nchans
+        self.bw = nchans * foff
+        self.tsamp = tsamp
+        self.tstart = tstart
+        self.nspectra = ntime
+        self.nbits = 32
+        self.your_header = SimpleNamespace(
+            filename=None, filelist=[], source_name=source_name,
+            fch1=fch1, foff=foff, nchans=nchans, bw=self.bw,
+            tsamp=tsamp, native_tsamp=tsamp, tstart=tstart,
+            nspectra=ntime, nbits=32, dtype=data.dtype,
+            time_decimation_factor=1, frequency_decimation_factor=1)
+
+        self.dm = dm
+        self.tcand = tcand
+        self.width = width
+        self.label = label
+        self.snr = snr
+        self.id = f"cand_tstart_{self.tstart:.12f}_tcand_{self.tcand:.7f}_dm_{self.dm:.5f}_snr_{self.snr:.5f}"
+        self.data = data
+        self.dedispersed = None
+        self.dmt = None
+        self.device = device
+        self.min_samp = min_samp
+        self.dm_opt = -1
+        self.snr_opt = -1
+        self.kill_mask = np.array([False])
+        self.flag_rfi = False
+        self.rfi_mask = np.array([False])
+
+    @property
+    def native_tsamp(self):
+        return self.tsamp
+
+    @property
+    def native_foff(self):
+        return self.foff
+
+    @property
+    def native_nchans(self):
+        return self.nchans
+
+    @property
+    def native_nspectra(self):
+        return self.nspectra
+
+def proc_cand(cand, dm=0, zero_topbottom=True,
+              ndm=32, dmtime_transform=False, backend='cpu'):
+    """ Zero the band edges of a candidate holding data, 
+    dedisperse it, and optionally make its DM-time array.
+
+    backend is 'cpu' for the dedisp_tools engine, or 
+    'gpu' / 'your' for YOUR's GPU / CPU implementations.
+    """
+    if zero_topbottom:
+        print("Zeroing out <1300 MHz and >1490 MHz")
+        freq = np.linspace(cand.fch1, cand.fch1 + cand.bw, cand.nchans)
+        bandpass_mask = np.where((freq < 1300.) | (freq > 1490.))[0]
+        cand.data[:,bandpass_mask] = 0.
+
+    if backend == 'cpu':
+        if dm != 0:
+            plan = dedisp_tools.get_delay_plan(cand.fch1, cand.foff, cand.nchans,
+                                               cand.native_tsamp, dm)
+            cand.dedispersed = np.array(cand.data, dtype=np.float32)
+            plan.dedisperse(cand.dedispersed)
+        if dmtime_transform:
+            # same DM grid as YOUR, 0 to 2*dm
+            dms = cand.dm + np.linspace(-cand.dm, cand.dm, ndm)
+            plan = dedisp_tools.get_delay_plan(cand.fch1, cand.foff, cand.nchans,
+                                               cand.native_tsamp, dms)
+            cand.dmt = plan.dmtime(cand.data)
+    elif backend in ('gpu', 'your'):
+        target = 'GPU' if backend == 'gpu' else 'CPU'
+        if dm != 0:
+            cand.dedisperse(target=target)
+        if dmtime_transform:
+            cand.dmtime(ndm, target=target)
+    else:
+        raise ValueError(f"Unknown dedispersion backend {backend}")
+
+    return cand
+
+def decimate_cand(cand, freq_factor=1, time_factor=1, backend='cpu'):
+    """ Downsample the dedispersed (ft) data in frequency 
+    and time, and the DM-time data in time, padding 
+    time with zeros as YOUR does. Updates cand.tsamp.
+    """
+    if backend == 'cpu':
+        cand.dedispersed = dedisp_tools.decimate(cand.dedispersed,
+                                                 (time_factor, freq_factor))
+        if cand.dmt is not None:
+            cand.dmt = dedisp_tools.decimate(cand.dmt, (1, time_factor))
+    else:
+        cand.decimate(key='ft', decimate_factor=freq_factor, axis=1)
+        cand.decimate(key='ft', decimate_factor=time_factor, axis=0, pad=True)
+        if cand.dmt is not None:
+            cand.decimate(key='dmt', decimate_factor=time_factor, axis=1, pad=True)
+    cand.tsamp = cand.tsamp * time_factor
+
+    return cand
+
+def proc_cand_array(stokesi_obj, dm=0, tcand=2.0,
+                    width=1, device=0, t_start=None,
+                    zero_topbottom=True, ndm=32, 
+                    dmtime_transform=False, backend='cpu'):
+    """ Build a candidate directly from an in-memory 
+    Stokes I object, dedisperse it, and return the 
+    dedispersed object. Equivalent to write_sigproc 
+    followed by read_proc_fil, without the file.
+
+    Parameters
+    ----------
+    stokesi_obj : xarray.DataArray
+        Stokes I (time, freq), e.g. from read_voltage_data
+    dm : float
+        The dispersion measure to dedisperse to.
+    tcand : float
+        The time of the candidate.
+    width : float
+        The width of the candidate in samples
+    device : int
+        The GPU device to use.
+    t_start : float
+        MJD of the first sample. Defaults to the 
+        first value of the time axis.
+    ndm : int
+        The number of DMs to transform to
+    dmtime_transform : bool
+        Whether to transform to DM-time space
+    backend : str
+        'cpu', 'gpu' or 'your', see proc_cand
+
+    Returns
+    -------
+    cand : ArrayCandidate
+        The dedispersed candidate object, 
+        including the original data.
+    """
+    times = stokesi_obj.time.values
+    freqs = stokesi_obj.freq.values
+    if t_start is None:
+        t_start = times[0]
+
+    cand = ArrayCandidate(
+        stokesi_obj.values,
+        fch1=freqs[0],
+        foff=np.diff(freqs)[0],
+        tsamp=time_axis_tsamp(times),
+        tstart=t_start,
+        dm=dm,
+        tcand=tcand,
+        width=width,
+        label=-1,
+        snr=12,
+        device=device,
+    )
+
+    return proc_cand(cand, dm=dm, zero_topbottom=zero_topbottom,
+                     ndm=ndm, dmtime_transform=dmtime_transform,
+                     backend=backend)
+
 def read_proc_fil(fnfil, dm=0, tcand=2.0, 
                   width=1, device=0, tstart=0,
                   zero_topbottom=True,
-                  tstop=10, ndm=32, dmtime_transform=False):
+                  tstop=10, ndm=32, dmtime_transform=False,
+                  backend='cpu'):
     """ Read in a filterbank file with the 
     YOUR library, dedisperse it, and return the 
     dedispsered object.
@@ -120,6 +682,8 @@ def read_proc_fil(fnfil, dm=0, tcand=2.0,
         The number of DMs to transform to
     dmtime_transform : bool
         Whether to transform to DM-time space
+    backend : str
+        'cpu', 'gpu' or 'your', see proc_cand
 
     Returns
     -------
@@ -139,16 +703,6 @@ def read_proc_fil(fnfil, dm=0, tcand=2.0,
     
     cand.get_chunk(tstart, tstop)
 
-    if zero_topbottom:
-        print("Zeroing out <1300 MHz and >1490 MHz")
-        freq = np.linspace(cand.fch1, cand.fch1 + cand.bw, cand.nchans)
-        bandpass_mask = np.where((freq < 1300.) | (freq > 1490.))[0]
-        cand.data[:,bandpass_mask] = 0.
-
-    if dm != 0:
-        cand.dedisperse(target="GPU")
-
-    if dmtime_transform:
-        cand.dmtime(ndm, target='GPU')
-
-    return cand
+    return proc_cand(cand, dm=dm, zero_topbottom=zero_topbottom,
+                     ndm=ndm, dmtime_transform=dmtime_transform,
+                     backend=backend)
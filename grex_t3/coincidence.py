@@ -8,12 +8,14 @@ import glob
 import pandas as pd 
 
 from astropy.time import Time
-import paramiko
 import json
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 from grex_t3 import analysis_tools 
+from grex_t3 import t2_store
+from grex_t3 import coincidence_engine
+from grex_t3 import remote_feed
 
 fn_cluster_t2 = '/hdd/data/candidates/T2/cluster_output.csv'
 fn_out_coincidence = '/hdd/data/candidates/T3/coincidence/coincidence.csv'
@@ -49,7 +51,7 @@ class MyHandler(FileSystemEventHandler):
         # Name the new column
         datadf.rename(columns={'index': 'trigger'}, inplace=True)
         coincidence_array = coincidence_grex_stare(offset_utc_hours=7, t_thresh_sec=1.0, 
-                           ncand_query=250, dm_diff_thresh=50.0, total_rows=0,
+                           ncand_query=250, dm_diff_thresh=50.0,
                            cands_grex=datadf)[0]
         
         if len(coincidence_array):
@@ -77,80 +79,28 @@ def fetch_external_cands(hostname='158.154.14.10', port=22,
                         password='None', 
                         file_path='/home/user/cand_times_sync/heimdall_3.cand',
                         ncand=10):
-    """Fetch the last N lines of a Heimdall candidate file on a remote server"""
-
-    try:
-        client.close()
-    except:
-        pass
-    
-    # Initialize the SSH client
-    client = paramiko.SSHClient()
-    
-    # Add the server's SSH key automatically if it's missing
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
-    try:
-        # Connect to the SSH server
-        client.connect(hostname, port=port, username=username, password=password)
-        
-        # Command to fetch the last 10 lines of the file
-        command = f"tail -n {ncand} {file_path}"
-        
-        # Execute the command
-        stdin, stdout, stderr = client.exec_command(command)
-        
-        # Read the output from stdout
-        lines = stdout.read()
-        
-        data_strings = lines.decode('utf-8').split('\n')
-        # Split each string into a list of values
-        data = [line.split() for line in data_strings if line.strip()]
-
-        # Convert the list of lists into a DataFrame
-        df = pd.DataFrame(data, index=None).astype(float)
-
-        # Optionally, specify column names if known
-        df.columns = ['snr','cand','time_sec',
-                    'log2width','unknown2','dm',
-                    'unknown3','mjdx','mjd_day',
-                    'mjd_hr','mjd_min','mjd_sec']
-
-        return df
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        # Close the connection
-        client.close()
+    """Fetch the last N lines of a Heimdall candidate file on a remote server.
+    The connection is kept open between calls and only lines added 
+    since the last call are transferred, see remote_feed.
+    """
+    feed = remote_feed.get_feed(hostname, port=port, username=username,
+                                password=password, file_path=file_path)
+    return feed.update(ncand=ncand)
 
 def coincidence_grex_stare(offset_utc_hours=7, t_thresh_sec=1.0, 
-                           ncand_query=250, dm_diff_thresh=25., total_rows=0,
+                           ncand_query=250, dm_diff_thresh=25.,
                            cands_grex=None):
-    """Find coincidences between GREX and STARE candidates"""
-    cands_stare = fetch_external_cands(hostname='158.154.14.10', port=22, 
-                                        username='user', 
-                                        password='None', 
-                                        file_path='/home/user/cand_times_sync/heimdall_3.cand',
-                                        ncand=ncand_query,
-                                        )
-    
+    """Find coincidences between GREX and STARE candidates.
+    If cands_grex is None, use the triggered T2 candidates 
+    written since the last call.
+    """
     if cands_grex is None:
-        # Step 1: Determine the number of rows in the file
-        with open(fn_cluster_t2, 'r') as file:
-            total_rows_now = sum(1 for row in file)
-
-        if total_rows_now - total_rows < 10:
-            print("Too few new candidates...")
-            #return [], total_rows
-        else:
-            read_last_N = total_rows_now - total_rows
-
-        # Step 2: Skip the first N-100 rows
-        skip = max(1, total_rows_now - read_last_N)
-
-        # Skip the first 1000 rows, but keep the Header
-        cands_grex = pd.read_csv(fn_cluster_t2, skiprows=lambda x: x < skip and x != 0)
-        cands_grex = cands_grex.iloc[np.where(cands_grex['trigger']!='0')[0]]
+        # Only the rows appended to the T2 CSV since last time
+        tail = t2_store.get_tail(fn_cluster_t2)
+        cands_grex = tail.read()
+        total_rows_now = tail.nrows
+        trigger = cands_grex['trigger']
+        cands_grex = cands_grex[(trigger.notna() & (trigger.astype(str)!='0')).values]
 
         if cands_grex.empty:
             print("No triggered candidates in GREX T2 data")
@@ -159,6 +109,13 @@ def coincidence_grex_stare(offset_utc_hours=7, t_thresh_sec=1.0,
         # If sending a single source from .json, assume total rows is 0
         total_rows_now = 0
 
+    cands_stare = fetch_external_cands(hostname='158.154.14.10', port=22, 
+                                        username='user', 
+                                        password='None', 
+                                        file_path='/home/user/cand_times_sync/heimdall_3.cand',
+                                        ncand=ncand_query,
+                                        )
+
     mjd_stare = analysis_tools.get_mjd_cand_pd(cands_stare, 
                                                offset_utc_hours=offset_utc_hours).values
     dms_stare = cands_stare['dm'].values
@@ -181,54 +138,65 @@ def run_coincidencer(fn_out_coincidence='/hdd/data/candidates/T3/coincidence/coi
                      t_thresh_sec=0.50,
                      offset_utc_hours=7.0,
                      dm_diff_thresh=25.0,):
-    total_rows = 0
-
+    """ Every 5 s, look for STARE coincidences with the T2
+    triggers added since the last check and append them to 
+    fn_out_coincidence.
+    """
     while True:
         coincidence_array, total_rows = coincidence_grex_stare(t_thresh_sec=t_thresh_sec,
                                                    offset_utc_hours=offset_utc_hours,
-                                                   dm_diff_thresh=dm_diff_thresh, 
-                                                   total_rows=total_rows)
+                                                   dm_diff_thresh=dm_diff_thresh)
                 
         if len(coincidence_array):
             file_exists = os.path.isfile(fn_out_coincidence)
             coincidence_array.to_csv(fn_out_coincidence, mode='a' if file_exists else 'w', \
                                      header=not file_exists, index=False)
 
-            time.sleep(5.0)
-        else:
-            time.sleep(5.0)
-            continue
+        time.sleep(5.0)
 
 def coincidence_grex_dumps(cands_grex, mjd_stare, dms_stare, candname_stare,
                            snr_stare,
                            t_thresh_sec=0.50, dm_diff_thresh=25.0):
     """ Find coincidences between GREX and STARE candidates.
-    Step through each GREX trigger and find the STARE candidates 
-    that are within t_thresh_sec and dm_diff_thresh of the GREX trigger.
+    Keep the GREX triggers with STARE candidates within 
+    t_thresh_sec and dm_diff_thresh, adding the highest-S/N
+    STARE match as STAREMJD, STAREDM, STARECAND and STARESNR.
     """
-    mjd_grex = cands_grex['mjds']
-    dms_grex = cands_grex['dm']
-    delete_index = []
-
-    for ii in range(len(mjd_grex)):
-        locii = cands_grex.index[ii]
-        delta_t_sec = np.abs(mjd_grex.iloc[ii]-mjd_stare)*86400
-        delta_dm = np.abs(dms_grex.iloc[ii]-dms_stare)
+    mjd_stare = np.asarray(mjd_stare)
+    dms_stare = np.asarray(dms_stare)
+    candname_stare = np.asarray(candname_stare)
+    snr_stare = np.asarray(snr_stare)
+
+    ia, ib = coincidence_engine.match_pairs(cands_grex['mjds'].values, mjd_stare,
+                                            t_thresh_sec,
+                                            cands_grex['dm'].values, dms_stare,
+                                            dm_thresh=dm_diff_thresh)
+    ia, ib = coincidence_engine.best_match(ia, ib, snr_stare)
+
+    cands_grex_coincident = cands_grex.iloc[ia].copy()
+    cands_grex_coincident['STAREMJD'] = mjd_stare[ib]
+    cands_grex_coincident['STAREDM'] = dms_stare[ib]
+    cands_grex_coincident['STARECAND'] = candname_stare[ib]
+    cands_grex_coincident['STARESNR'] = snr_stare[ib]
 
-        ind_coince = np.where((delta_t_sec<t_thresh_sec) & (delta_dm<dm_diff_thresh))[0]
-        
-        if len(ind_coince):
-            jj = np.argmax(snr_stare[ind_coince])
-            cands_grex.loc[locii, 'STAREMJD'] = mjd_stare[ind_coince[jj]]
-            cands_grex.loc[locii, 'STAREDM'] = dms_stare[ind_coince[jj]]
-            cands_grex.loc[locii, 'STARECAND'] = candname_stare[ind_coince[jj]]
-            cands_grex.loc[locii, 'STARESNR'] = snr_stare[ind_coince[jj]]
-        else:
-            delete_index.append(locii)
+    return cands_grex_coincident
 
-    cands_grex_coincident = cands_grex.drop(delete_index)
+def coincidence_2pt(mjd_arr_1, mjd_arr_2, t_thresh_sec=0.25,
+                    dm_arr_1=None, dm_arr_2=None, 
+                    dm_diff_thresh=None, dm_frac_thresh=None):
+    """ All pairs of candidates from two stations within 
+    t_thresh_sec, and within the DM tolerances if given.
 
-    return cands_grex_coincident
+    Returns
+    -------
+    coincidence_arr : ndarray
+        (npair, 2) indices into mjd_arr_1 and mjd_arr_2
+    """
+    ind_1, ind_2 = coincidence_engine.match_pairs(mjd_arr_1, mjd_arr_2, t_thresh_sec,
+                                                  dm_arr_1, dm_arr_2,
+                                                  dm_thresh=dm_diff_thresh,
+                                                  dm_frac=dm_frac_thresh)
+    return np.stack([ind_1, ind_2], axis=1)
 
 def get_coincidence_3stations(fncand1, fncand2, fncand3, 
                               t_thresh_sec=0.25, 
@@ -390,6 +358,74 @@ def get_coincidence_3stations(fncand1, fncand2, fncand3,
 
     return data_tup, coince_tup_3x, coince_tup_2x, first_MJD, last_MJD
 
+def get_coincidence_nstations(fncands, t_thresh_sec=0.25,
+                              nday_lookback=1.,
+                              dm_diff_thresh=5.0,
+                              dm_frac_thresh=0.07,
+                              min_stations=2):
+    """ Read in .cand files from any number of stations and 
+    group the candidates from the past nday_lookback days into
+    clusters linked by coincidences in time and DM between 
+    stations (see coincidence_engine.cluster_stations).
+
+    Returns
+    -------
+    data_tup : tuple
+        Each station's candidates in the lookback window
+    members : pandas.DataFrame
+        cluster, station and index into data_tup of every
+        candidate in a cluster of at least min_stations
+    first_MJD, last_MJD : float
+        Range of the candidates searched
+    """
+    mjd_now = Time.now().mjd
+    data_tup, mjds = [], []
+    for fncand in fncands:
+        data = analysis_tools.read_heim_pandas(fncand, skiprows=0)
+        mjd = analysis_tools.get_mjd_cand_pd(data).values
+        ind = np.where((mjd > mjd_now - nday_lookback) & (mjd < mjd_now))[0]
+        data_tup.append(data.iloc[ind].reset_index(drop=True))
+        mjds.append(mjd[ind])
+
+    mjd_all = np.concatenate(mjds)
+    if len(mjd_all) == 0:
+        print("No candidates in past %d days" % nday_lookback)
+        first_MJD = last_MJD = mjd_now
+    else:
+        first_MJD, last_MJD = mjd_all.min(), mjd_all.max()
+    print("\nSearching for coincidences between %0.5f and %0.5f\n" % (first_MJD, last_MJD))
+
+    members = coincidence_engine.cluster_stations(mjds, t_thresh_sec,
+                                                  [data['dm'].values for data in data_tup],
+                                                  dm_thresh=dm_diff_thresh,
+                                                  dm_frac=dm_frac_thresh,
+                                                  min_stations=min_stations)
+    nstat = members.groupby('cluster')['nstation'].first()
+    for nn, count in nstat.value_counts().sort_index().items():
+        print("Found %d coincidences across %d stations" % (count, nn))
+
+    return tuple(data_tup), members, first_MJD, last_MJD
+
+def write_clusters(data_tup, members, fnout):
+    """ Write the candidates of each cluster to fnout, with 
+    their cluster number and station (numbered from 1).
+    """
+    frames = []
+    for ii, data in enumerate(data_tup):
+        mm = members[members['station'] == ii]
+        rows = data.iloc[mm['index'].values].drop(columns=['station', 'cluster'],
+                                                    errors='ignore')
+        rows.insert(0, 'station', ii + 1)
+        rows.insert(0, 'cluster', mm['cluster'].values)
+        rows['mjd'] = mm['mjd'].values
+        frames.append(rows)
+
+    data_out = pd.concat(frames).sort_values(['cluster', 'mjd'], kind='stable',
+                                             ignore_index=True)
+    data_out.to_csv(fnout)
+    print("Saved to %s"%fnout)
+    return data_out
+
 def get_single_row(fncand, ind):
     data_ii = np.genfromtxt(fncand, skip_header=ind, max_rows=1)
     return data_ii
@@ -460,16 +496,14 @@ def write_coincidences(data_tup, coince_tup_3x, coince_tup_2x, fnout):
 def main(nday_lookback):
 #    start_time = Time.now()
     rsync_heimdall_cand()
-    fncand1 = '/home/user/cand_times_sync/heimdall.cand'
-    fncand2 = '/home/user/cand_times_sync_od/heimdall_2.cand'
-    fncand3 = '/home/user/cand_times_sync/heimdall_3.cand'
+    fncands = ['/home/user/cand_times_sync/heimdall.cand',
+               '/home/user/cand_times_sync_od/heimdall_2.cand',
+               '/home/user/cand_times_sync/heimdall_3.cand']
 
-    data_tup,coince_tup_3x,coince_tup_2x,first_MJD,last_MJD = get_coincidence_3stations(
-                                                                    fncand1, 
-                                                                    fncand2, 
-                                                                    fncand3, 
-                                                                    t_thresh_sec=0.2, 
-                                                                    nday_lookback=nday_lookback)
+    data_tup,members,first_MJD,last_MJD = get_coincidence_nstations(
+                                                fncands, 
+                                                t_thresh_sec=0.2, 
+                                                nday_lookback=nday_lookback)
 
     x = Time(first_MJD, format='mjd')
     x = x.to_datetime()
@@ -480,14 +514,13 @@ def main(nday_lookback):
     else:
         os.system('mkdir %s' % outdir)
 
-    if not len(coince_tup_3x)+len(coince_tup_2x):
+    if not len(members):
         print("\nNo coincidences, exiting now.")
         os.system('touch %s/LastMJD%0.7f'%(outdir, last_MJD))
         exit()
 
     fnout = outdir + '/coincidence_3stations.csv'
-    data_out = write_coincidences(data_tup, coince_tup_3x, 
-                                  coince_tup_2x, fnout)
+    data_out = write_clusters(data_tup, members, fnout)
 
     os.system('touch %s/LastMJD%0.7f'%(outdir, last_MJD))
 
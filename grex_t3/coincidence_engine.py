@@ -0,0 +1,218 @@
+""" Match candidates between two lists in time and DM.
+
+One list is sorted by MJD and the time window around every
+candidate of the other is found with searchsorted, so the
+cost is O((N + M) log M + pairs) rather than comparing every
+candidate with every other.
+
+    ia, ib = coincidence_engine.match_pairs(mjd_a, mjd_b, 0.5,
+                                            dm_a, dm_b, dm_thresh=25.)
+    ia, ib = coincidence_engine.best_match(ia, ib, snr_b)
+
+Pairs satisfy |mjd_a - mjd_b| < t_thresh_sec and, when DMs
+are given, |dm_a - dm_b| < dm_thresh or a fractional DM
+difference (relative to the pair's mean DM) < dm_frac.
+
+For any number of stations, cluster_stations links every
+pair of candidates from different stations that match this
+way and returns the connected groups:
+
+    members = coincidence_engine.cluster_stations([mjd_1, mjd_2, mjd_3], 0.25,
+                                                  [dm_1, dm_2, dm_3], dm_thresh=5.)
+"""
+import numpy as np
+import pandas as pd
+from numba import njit
+
+
+def time_windows(mjd_a, mjd_b_sorted, t_thresh_sec):
+    """ Index range [lo, hi) of the candidates in sorted
+    mjd_b_sorted strictly within t_thresh_sec of each mjd_a.
+    """
+    dt = t_thresh_sec / 86400.
+    lo = np.searchsorted(mjd_b_sorted, mjd_a - dt, 'right')
+    hi = np.searchsorted(mjd_b_sorted, mjd_a + dt, 'left')
+    return lo, np.maximum(hi, lo)
+
+def expand_windows(lo, hi):
+    """ Every (i, j) with lo[i] <= j < hi[i], as two arrays. """
+    counts = hi - lo
+    npair = int(counts.sum())
+    ia = np.repeat(np.arange(len(lo)), counts)
+    # position within each window, plus the window's start
+    starts = np.cumsum(counts) - counts
+    jj = np.arange(npair) - np.repeat(starts - lo, counts)
+    return ia, jj
+
+def dm_match(dm_a, dm_b, dm_thresh=None, dm_frac=None):
+    """ Whether each pair of DMs is within dm_thresh, or
+    within dm_frac of their mean.
+    """
+    abs_diff = np.abs(dm_a - dm_b)
+    keep = np.zeros(len(abs_diff), dtype=bool)
+    if dm_thresh is not None:
+        keep |= abs_diff < dm_thresh
+    if dm_frac is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            keep |= abs_diff / (0.5 * (dm_a + dm_b)) < dm_frac
+    return keep
+
+def match_pairs(mjd_a, mjd_b, t_thresh_sec, dm_a=None, dm_b=None,
+                dm_thresh=None, dm_frac=None):
+    """ All pairs of candidates coincident in time, and in DM
+    if dm_thresh or dm_frac is given.
+
+    Parameters
+    ----------
+    mjd_a, mjd_b : array_like
+        Candidate MJDs, in any order
+    t_thresh_sec : float
+        Largest time difference in seconds
+    dm_a, dm_b : array_like
+        Candidate DMs, needed for the DM cut
+    dm_thresh : float
+        Largest absolute DM difference
+    dm_frac : float
+        Largest DM difference as a fraction of the mean DM.
+        A pair passes if it meets either DM tolerance.
+
+    Returns
+    -------
+    ia, ib : ndarray
+        Indices into a and b of each pair, ordered by ia
+        then by mjd_b
+    """
+    mjd_a = np.asarray(mjd_a, dtype=np.float64)
+    mjd_b = np.asarray(mjd_b, dtype=np.float64)
+
+    order_b = np.argsort(mjd_b, kind='stable')
+    lo, hi = time_windows(mjd_a, mjd_b[order_b], t_thresh_sec)
+    ia, jj = expand_windows(lo, hi)
+    ib = order_b[jj]
+
+    if dm_thresh is None and dm_frac is None:
+        return ia, ib
+
+    keep = dm_match(np.asarray(dm_a, dtype=np.float64)[ia],
+                    np.asarray(dm_b, dtype=np.float64)[ib], dm_thresh, dm_frac)
+    return ia[keep], ib[keep]
+
+def best_match(ia, ib, score_b):
+    """ Keep one pair per candidate in a, the one whose b has
+    the highest score (e.g. S/N), taking the lowest b index
+    among equal scores.
+
+    Returns
+    -------
+    ia, ib : ndarray
+        Sorted by ia, each ia appearing once
+    """
+    if len(ia) == 0:
+        return ia, ib
+    score = np.asarray(score_b, dtype=np.float64)[ib]
+    order = np.lexsort((ib, -score, ia))
+    ia, ib = ia[order], ib[order]
+    first = np.concatenate([[True], ia[1:] != ia[:-1]])
+    return ia[first], ib[first]
+
+
+@njit(nogil=True)
+def _find(parent, ii):
+    """ Root of ii, halving the path on the way. """
+    while parent[ii] != ii:
+        parent[ii] = parent[parent[ii]]
+        ii = parent[ii]
+    return ii
+
+@njit(nogil=True)
+def _union_edges(parent, ia, ib):
+    """ Merge the sets of every edge (ia[k], ib[k]), then
+    point every element straight at its root.
+    """
+    for kk in range(len(ia)):
+        ra = _find(parent, ia[kk])
+        rb = _find(parent, ib[kk])
+        if ra != rb:
+            # the lower index is the root, so roots are deterministic
+            if ra < rb:
+                parent[rb] = ra
+            else:
+                parent[ra] = rb
+    for ii in range(len(parent)):
+        parent[ii] = _find(parent, ii)
+
+def cluster_stations(mjds, t_thresh_sec, dms=None, dm_thresh=None,
+                     dm_frac=None, min_stations=2):
+    """ Group candidates from any number of stations into
+    multi-station events.
+
+    All candidates are swept in time order, and each is linked
+    to the later candidates from other stations within 
+    t_thresh_sec (and the DM tolerances, see match_pairs).
+    Linked candidates are merged with union-find, so a cluster
+    is everything connected by a chain of such links.
+
+    Parameters
+    ----------
+    mjds : list of array_like
+        Candidate MJDs of each station
+    t_thresh_sec : float
+        Largest time difference of a link in seconds
+    dms : list of array_like
+        Candidate DMs of each station, needed for the DM cut
+    dm_thresh, dm_frac : float
+        Absolute and fractional DM tolerances
+    min_stations : int
+        Only keep clusters seen by at least this many stations
+
+    Returns
+    -------
+    members : pandas.DataFrame
+        One row per candidate in a kept cluster, with its 
+        cluster number, station (position in mjds), index into
+        that station's arrays, mjd, dm and the cluster's 
+        nstation, sorted by cluster then mjd
+    """
+    nstation = len(mjds)
+    station = np.concatenate([np.full(len(m), ii, dtype=np.int64)
+                              for ii, m in enumerate(mjds)])
+    index = np.concatenate([np.arange(len(m), dtype=np.int64) for m in mjds])
+    mjd = np.concatenate([np.asarray(m, dtype=np.float64) for m in mjds])
+    if dms is not None:
+        dm = np.concatenate([np.asarray(d, dtype=np.float64) for d in dms])
+    else:
+        dm = np.full(len(mjd), np.nan)
+
+    order = np.argsort(mjd, kind='stable')
+    station, index, mjd, dm = station[order], index[order], mjd[order], dm[order]
+
+    # each candidate against the later ones in its window
+    lo = np.arange(len(mjd)) + 1
+    hi = np.maximum(np.searchsorted(mjd, mjd + t_thresh_sec / 86400., 'left'), lo)
+    ia, ib = expand_windows(lo, hi)
+    keep = station[ia] != station[ib]
+    if dm_thresh is not None or dm_frac is not None:
+        keep &= dm_match(dm[ia], dm[ib], dm_thresh, dm_frac)
+    ia, ib = ia[keep], ib[keep]
+
+    parent = np.arange(len(mjd), dtype=np.int64)
+    _union_edges(parent, ia, ib)
+
+    # distinct stations in each cluster, counted at its root
+    root_station = np.sort(parent * nstation + station)
+    first = np.concatenate([[True], root_station[1:] != root_station[:-1]])
+    nstat = np.bincount(root_station[first] // nstation, minlength=len(mjd))
+
+    # roots are each cluster's first candidate in time, so
+    # numbering the kept roots in order numbers the clusters
+    kept_root = nstat >= max(min_stations, 1)
+    rank = np.cumsum(kept_root) - 1
+    sel = np.where(kept_root[parent])[0]
+    cluster = rank[parent[sel]]
+    nstat_all = nstat[parent]
+
+    members = pd.DataFrame(dict(cluster=cluster, station=station[sel],
+                                index=index[sel], mjd=mjd[sel], dm=dm[sel],
+                                nstation=nstat_all[sel]))
+    return members.sort_values(['cluster', 'mjd'], kind='stable',
+                               ignore_index=True)
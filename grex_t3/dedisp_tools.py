@@ -0,0 +1,448 @@
+""" CPU dedispersion, DM-time and decimation kernels
+built on precomputed integer shift tables.
+
+Conventions follow the YOUR library: delays are
+relative to the first channel and the data are
+rolled around, so out[t] = data[(t + shift) % ntime].
+"""
+from functools import lru_cache
+
+import numpy as np
+from numba import njit, prange
+
+# dispersion constant in s MHz^2 / (pc cm^-3)
+K_DM = 4148.808
+# number of delay plans kept by get_delay_plan
+DELAY_PLAN_CACHE_SIZE = 64
+
+
+def dispersion_shifts(chan_freqs, tsamp, dms, ref_freq=None):
+    """ Integer dispersion shift table in samples.
+
+    Parameters
+    ----------
+    chan_freqs : ndarray
+        Channel frequencies in MHz
+    tsamp : float
+        Sampling time in seconds
+    dms : float or ndarray
+        Dispersion measure(s)
+    ref_freq : float
+        Reference frequency in MHz, defaults to the first channel
+
+    Returns
+    -------
+    shifts : ndarray
+        int64 array (ndm, nchans)
+    """
+    chan_freqs = np.asarray(chan_freqs, dtype=np.float64)
+    dms = np.atleast_1d(np.asarray(dms, dtype=np.float64))
+    if ref_freq is None:
+        ref_freq = chan_freqs[0]
+    delays = K_DM * dms[:, None] * (chan_freqs[None]**-2 - ref_freq**-2)
+
+    return np.round(delays / tsamp).astype(np.int64)
+
+@njit(parallel=True, nogil=True)
+def _dedisperse_tf_kernel(data, shifts, block):
+    """ Roll each channel of data (ntime, nchans)
+    in place by its shift, a block of channels at a 
+    time to keep memory access contiguous.
+    """
+    ntime, nchans = data.shape
+    nblock = (nchans + block - 1) // block
+    for bb in prange(nblock):
+        c0 = bb * block
+        c1 = min(c0 + block, nchans)
+        buf = data[:, c0:c1].copy()
+        for tt in range(ntime):
+            for cc in range(c0, c1):
+                data[tt, cc] = buf[(tt + shifts[cc]) % ntime, cc - c0]
+
+@njit(parallel=True, nogil=True)
+def _transpose_kernel(data, out, tile):
+    """ Tiled transpose of data into out. """
+    n0, n1 = data.shape
+    ntile = (n0 + tile - 1) // tile
+    for bb in prange(ntile):
+        i0 = bb * tile
+        i1 = min(i0 + tile, n0)
+        for j0 in range(0, n1, tile):
+            j1 = min(j0 + tile, n1)
+            for ii in range(i0, i1):
+                for jj in range(j0, j1):
+                    out[jj, ii] = data[ii, jj]
+
+@njit(parallel=True, nogil=True)
+def _dedisperse_kernel(data, shifts):
+    """ Roll each channel of data (nchans, ntime)
+    in place by its shift.
+    """
+    nchans, ntime = data.shape
+    for cc in prange(nchans):
+        ss = shifts[cc] % ntime
+        if ss == 0:
+            continue
+        buf = data[cc].copy()
+        for tt in range(ntime - ss):
+            data[cc, tt] = buf[tt + ss]
+        for tt in range(ntime - ss, ntime):
+            data[cc, tt] = buf[tt + ss - ntime]
+
+@njit(parallel=True, nogil=True)
+def _dmtime_kernel(data, shifts, out):
+    """ Sum over channels of data (nchans, ntime)
+    dedispersed with each row of shifts (ndm, nchans)
+    into out (ndm, ntime).
+    """
+    nchans, ntime = data.shape
+    ndm = shifts.shape[0]
+    for kk in prange(ndm):
+        for tt in range(ntime):
+            out[kk, tt] = 0.
+        for cc in range(nchans):
+            ss = shifts[kk, cc] % ntime
+            for tt in range(ntime - ss):
+                out[kk, tt] += data[cc, tt + ss]
+            for tt in range(ntime - ss, ntime):
+                out[kk, tt] += data[cc, tt + ss - ntime]
+
+def dedisperse(data, shifts, time_axis=0):
+    """ Dedisperse float32 data in place.
+
+    Parameters
+    ----------
+    data : ndarray
+        float32 (ntime, nchans) if time_axis is 0,
+        or (nchans, ntime) if time_axis is 1
+    shifts : ndarray
+        Per-channel integer shifts (nchans,)
+    time_axis : int
+        Axis of data that is time
+
+    Returns
+    -------
+    data : ndarray
+        The same array, dedispersed
+    """
+    shifts = np.ascontiguousarray(shifts, dtype=np.int64).reshape(-1)
+    if time_axis == 0:
+        _dedisperse_tf_kernel(data, shifts, 32)
+    else:
+        _dedisperse_kernel(data, shifts)
+
+    return data
+
+def dmtime(data, shifts, time_axis=0, out=None):
+    """ DM-time transform for a table of shifts,
+    summing over frequency at each trial DM.
+
+    Parameters
+    ----------
+    data : ndarray
+        (ntime, nchans) if time_axis is 0,
+        or (nchans, ntime) if time_axis is 1
+    shifts : ndarray
+        Integer shifts (ndm, nchans)
+    out : ndarray
+        Optional float32 output (ndm, ntime)
+
+    Returns
+    -------
+    out : ndarray
+        float32 (ndm, ntime)
+    """
+    # channel-major, contiguous in time
+    data = np.asarray(data, dtype=np.float32)
+    if time_axis == 0:
+        data_ft = np.empty(data.shape[::-1], dtype=np.float32)
+        _transpose_kernel(np.ascontiguousarray(data), data_ft, 32)
+        data = data_ft
+    else:
+        data = np.ascontiguousarray(data)
+    shifts = np.ascontiguousarray(shifts, dtype=np.int64)
+    if out is None:
+        out = np.empty((shifts.shape[0], data.shape[1]), dtype=np.float32)
+    _dmtime_kernel(data, shifts, out)
+
+    return out
+
+class DelayPlan:
+    """ Integer shift tables for one channelisation,
+    sampling time and DM grid. Build these with 
+    get_delay_plan so that they are shared.
+
+    Parameters
+    ----------
+    fch1 : float
+        Frequency of the first channel in MHz
+    foff : float
+        Channel width in MHz
+    nchans : int
+        Number of channels
+    tsamp : float
+        Sampling time in seconds
+    dms : float or tuple
+        DM grid
+    """
+    def __init__(self, fch1, foff, nchans, tsamp, dms):
+        self.fch1 = fch1
+        self.foff = foff
+        self.nchans = nchans
+        self.tsamp = tsamp
+        self.dms = np.atleast_1d(np.asarray(dms, dtype=np.float64))
+        self.chan_freqs = fch1 + foff * np.arange(nchans)
+        self.shifts = dispersion_shifts(self.chan_freqs, tsamp, self.dms)
+        # shared between callers, so read-only
+        self.shifts.flags.writeable = False
+        self.dms.flags.writeable = False
+
+    def __repr__(self):
+        return "DelayPlan(fch1=%s, foff=%s, nchans=%d, tsamp=%s, ndm=%d)" % (
+            self.fch1, self.foff, self.nchans, self.tsamp, len(self.dms))
+
+    def dedisperse(self, data, idm=0, time_axis=0):
+        """ Dedisperse data in place at the idm-th DM. """
+        return dedisperse(data, self.shifts[idm], time_axis=time_axis)
+
+    def dmtime(self, data, time_axis=0, out=None):
+        """ DM-time transform over the whole DM grid. """
+        return dmtime(data, self.shifts, time_axis=time_axis, out=out)
+
+@lru_cache(maxsize=DELAY_PLAN_CACHE_SIZE)
+def _cached_delay_plan(fch1, foff, nchans, tsamp, dms):
+    return DelayPlan(fch1, foff, nchans, tsamp, dms)
+
+def get_delay_plan(fch1, foff, nchans, tsamp, dms):
+    """ Return the DelayPlan for this setup, reusing 
+    a cached one if it has been built recently.
+
+    Parameters
+    ----------
+    fch1, foff : float
+        First channel frequency and channel width in MHz
+    nchans : int
+        Number of channels
+    tsamp : float
+        Sampling time in seconds
+    dms : float or ndarray
+        DM grid
+
+    Returns
+    -------
+    plan : DelayPlan
+    """
+    dms = tuple(float(dm) for dm in np.atleast_1d(dms))
+    return _cached_delay_plan(float(fch1), float(foff), int(nchans),
+                              float(tsamp), dms)
+
+def block_delay_plan(block, dms):
+    """ DelayPlan for a sigpyproc FilterbankBlock 
+    (nchans, ntime) from its header.
+    """
+    header = block.header
+    return get_delay_plan(header['fch1'], header['foff'], block.shape[0],
+                          header['tsamp'], dms)
+
+def dedisperse_block(block, dm):
+    """ Cached-plan replacement for FilterbankBlock.dedisperse.
+
+    Parameters
+    ----------
+    block : FilterbankBlock
+        float32 (nchans, ntime) block with a header
+    dm : float
+        Dispersion measure
+
+    Returns
+    -------
+    out : FilterbankBlock
+        A dedispersed copy of block
+    """
+    plan = block_delay_plan(block, dm)
+    out = block.copy()
+    plan.dedisperse(out.view(np.ndarray), time_axis=1)
+    out.dm = dm
+
+    return out
+
+def decimate(data, factors, pad=True):
+    """ Average data by an integer factor along
+    each axis in a single reshape. Axes that are
+    not a multiple of their factor are zero-padded
+    at the end, as in YOUR's decimate(pad=True).
+
+    Parameters
+    ----------
+    data : ndarray
+        2D array
+    factors : tuple
+        Decimation factor for each axis
+
+    Returns
+    -------
+    ndarray
+        The decimated array
+    """
+    factors = [int(f) for f in factors]
+    pad_width = [(0, -n % f) for n, f in zip(data.shape, factors)]
+    if any(p[1] for p in pad_width):
+        if not pad:
+            raise AttributeError(
+                "Axis length should be a multiple of decimate_factor. Use pad=True to force decimation")
+        data = np.pad(data, pad_width)
+
+    (n0, n1), (f0, f1) = data.shape, factors
+    return data.reshape(n0//f0, f0, n1//f1, f1).mean(axis=(1, 3))
+
+def _fdmt_ndelay(maxdt, f_min, f_max, f_lo, f_hi):
+    """ Number of delays spanned by the sub-band f_lo to f_hi
+    when maxdt - 1 samples span the full band.
+    """
+    return int(np.ceil((maxdt - 1) * (f_lo**-2 - f_hi**-2) / (f_min**-2 - f_max**-2)))
+
+def _fdmt_init(data, maxdt, f_min, f_max):
+    """ First FDMT stage, cumulative sums within each channel.
+    data is (nchans, ntime) with the lowest frequency first.
+    """
+    nchans, ntime = data.shape
+    df = (f_max - f_min) / nchans
+    ndelay = _fdmt_ndelay(maxdt, f_min, f_max, f_min, f_min + df)
+    state = np.zeros((nchans, ndelay + 1, ntime), dtype=np.float32)
+    state[:, 0] = data
+    for dd in range(1, ndelay + 1):
+        state[:, dd, dd:] = state[:, dd - 1, dd:] + data[:, :-dd]
+
+    return state
+
+@njit(nogil=True)
+def _fdmt_iteration(state, out, maxdt, nchans, f_min, f_max, iteration):
+    """ Merge pairs of adjacent sub-bands of state into out. """
+    nsub, _, ntime = out.shape
+    df = (f_max - f_min) / nchans
+    correction = df / 2.
+    norm = f_min**-2 - f_max**-2
+    for ii in range(nsub):
+        f_start = (f_max - f_min) / nsub * ii + f_min
+        f_end = (f_max - f_min) / nsub * (ii + 1) + f_min
+        f_middle = (f_end - f_start) / 2. + f_start - correction
+        f_middle_larger = (f_end - f_start) / 2. + f_start + correction
+        ndelay = int(np.ceil((maxdt - 1) * (f_start**-2 - f_end**-2) / norm))
+        for dd in range(ndelay + 1):
+            frac = (f_start**-2 - f_end**-2)
+            dd_middle = int(round(dd * (f_start**-2 - f_middle**-2) / frac))
+            dd_middle_larger = int(round(dd * (f_start**-2 - f_middle_larger**-2) / frac))
+            dd_rest = dd - dd_middle_larger
+            for tt in range(min(dd_middle_larger, ntime)):
+                out[ii, dd, tt] = state[2*ii, dd_middle, tt]
+            for tt in range(dd_middle_larger, ntime):
+                out[ii, dd, tt] = (state[2*ii, dd_middle, tt]
+                                   + state[2*ii + 1, dd_rest, tt - dd_middle_larger])
+
+def fdmt(data, f_min, f_max, maxdt):
+    """ Fast Dispersion Measure Transform (Zackay & Ofek 2017).
+
+    Parameters
+    ----------
+    data : ndarray
+        (nchans, ntime) with the lowest frequency first,
+        nchans must be a power of two
+    f_min, f_max : float
+        Lower and upper edges of the band in MHz
+    maxdt : int
+        Number of delays to compute, 0 to maxdt-1 samples
+        across the band
+
+    Returns
+    -------
+    dmt : ndarray
+        float32 (maxdt, ntime), the sum over frequency along 
+        each delay track, referenced to arrival at f_min
+    """
+    nchans, ntime = data.shape
+    niter = int(np.log2(nchans))
+    if 2**niter != nchans:
+        raise ValueError("FDMT needs a power of two number of channels")
+
+    state = _fdmt_init(np.asarray(data, dtype=np.float32), maxdt, f_min, f_max)
+    for iteration in range(1, niter + 1):
+        nsub = state.shape[0] // 2
+        df = 2**iteration * (f_max - f_min) / nchans
+        ndelay = _fdmt_ndelay(maxdt, f_min, f_max, f_min, f_min + df)
+        out = np.zeros((nsub, ndelay + 1, ntime), dtype=np.float32)
+        _fdmt_iteration(state, out, maxdt, nchans, f_min, f_max, iteration)
+        state = out
+
+    return state[0, :maxdt]
+
+def _fdmt_rows(data, f_min, f_max, rows, offsets):
+    """ FDMT rows at non-negative integer delays, each shifted
+    by offsets samples so that time is the arrival in the top
+    channel, as for dedisperse.
+    """
+    ntime = data.shape[1]
+    dmt = fdmt(data, f_min, f_max, int(rows.max()) + 1)
+    out = np.zeros((len(rows), ntime), dtype=np.float32)
+    for kk, (dd, ss) in enumerate(zip(rows, offsets)):
+        out[kk, :ntime - ss] = dmt[dd, ss:]
+
+    return out
+
+def fdmt_dmtime(data, chan_freqs, tsamp, dms, time_axis=1):
+    """ DM-time array at each of dms from one FDMT,
+    summing over frequency like dmtime. Negative DMs 
+    are handled by transforming the time-reversed data.
+
+    Unlike dmtime the data are not rolled around, so 
+    samples near the ends of the array differ.
+
+    Parameters
+    ----------
+    data : ndarray
+        (nchans, ntime) if time_axis is 1, 
+        or (ntime, nchans) if time_axis is 0
+    chan_freqs : ndarray
+        Channel centre frequencies in MHz, either order
+    tsamp : float
+        Sampling time in seconds
+    dms : ndarray
+        Trial DMs
+
+    Returns
+    -------
+    out : ndarray
+        float32 (ndm, ntime)
+    """
+    data = np.asarray(data, dtype=np.float32)
+    if time_axis == 0:
+        data = data.T
+    chan_freqs = np.asarray(chan_freqs, dtype=np.float64)
+    dms = np.atleast_1d(np.asarray(dms, dtype=np.float64))
+    nchans, ntime = data.shape
+
+    # lowest frequency first, padded to a power of two channels
+    if chan_freqs[0] > chan_freqs[-1]:
+        data, chan_freqs = data[::-1], chan_freqs[::-1]
+    df = np.abs(np.diff(chan_freqs)).mean() if nchans > 1 else 1.
+    npad = 2**int(np.ceil(np.log2(nchans))) - nchans
+    if npad:
+        data = np.concatenate([data, np.zeros((npad, ntime), dtype=np.float32)])
+    f_min = chan_freqs[0] - df/2.
+    f_max = chan_freqs[-1] + df/2. + npad*df
+
+    # FDMT delays span the band edges, output times are
+    # moved from the bottom edge to the top channel centre
+    delay = K_DM * np.abs(dms) / tsamp
+    rows = np.round(delay * (f_min**-2 - f_max**-2)).astype(np.int64)
+    offsets = np.round(delay * (f_min**-2 - chan_freqs[-1]**-2)).astype(np.int64)
+    offsets = np.minimum(offsets, ntime - 1)
+    out = np.zeros((len(dms), ntime), dtype=np.float32)
+
+    pos = dms >= 0
+    if pos.any():
+        out[pos] = _fdmt_rows(data, f_min, f_max, rows[pos], offsets[pos])
+    if (~pos).any():
+        out[~pos] = _fdmt_rows(data[:, ::-1], f_min, f_max,
+                               rows[~pos], offsets[~pos])[:, ::-1]
+
+    return out
@@ -0,0 +1,107 @@
+""" Tell when a file being written by another process is
+complete, instead of sleeping a fixed time after it appears.
+
+A file is ready once inotify reports IN_CLOSE_WRITE (written
+in place) or IN_MOVED_TO (renamed into place) for it. Where
+inotify isn't available, the file's directory doesn't exist
+yet, or the file was finished before we started watching, it is ready once its size and mtime have
+not changed for stable_time seconds, which a file last
+modified longer ago than that already is.
+
+    fn = file_ready.wait_for_file('/hdd/data/voltages/grex_dump-240321aazm.nc', 60.)
+    if fn is None:
+        ...  # timed out
+"""
+import os
+import time
+
+try:
+    import inotify.adapters as ia
+    import inotify.constants as ic
+except ImportError:
+    ia = None
+
+READY_EVENTS = ('IN_CLOSE_WRITE', 'IN_MOVED_TO')
+
+
+def is_ready_event(type_names):
+    """ Whether an inotify event's type_names mean a
+    file has just been completed.
+    """
+    return any(t in READY_EVENTS for t in type_names)
+
+
+class _Stability:
+    """ Size-stability check, one call per poll. """
+    def __init__(self, fn, stable_time):
+        self.fn = fn
+        self.stable_time = stable_time
+        self.last = None
+        self.since = None
+
+    def __call__(self):
+        try:
+            st = os.stat(self.fn)
+        except FileNotFoundError:
+            self.last = None
+            return False
+        state = (st.st_size, st.st_mtime_ns)
+        now = time.time()
+        if self.last is None and now - st.st_mtime >= self.stable_time:
+            # already unchanged for long enough when first seen
+            return True
+        if state != self.last:
+            self.last, self.since = state, now
+            return False
+        return now - self.since >= self.stable_time
+
+
+def wait_for_file(fn, timeout=60., stable_time=2., poll=0.5):
+    """ Wait for fn to be completely written.
+
+    Parameters
+    ----------
+    fn : str
+        File to wait for, which need not exist yet
+    timeout : float
+        Give up after this many seconds
+    stable_time : float
+        Seconds without a change in size or mtime after
+        which the file is taken to be complete, if no
+        inotify event says so first
+    poll : float
+        Seconds between stability checks
+
+    Returns
+    -------
+    fn : str
+        fn if it is ready, or None on timeout
+    """
+    t_end = time.time() + timeout
+    stable = _Stability(fn, stable_time)
+    dirname, basename = os.path.split(os.path.abspath(fn))
+
+    # without inotify, or until the directory is made (as 
+    # FILPATH/<trigname>/ is by the writer), poll the size 
+    while ia is None or not os.path.isdir(dirname):
+        if stable():
+            return fn
+        if time.time() >= t_end:
+            return None
+        time.sleep(poll)
+
+    watcher = ia.Inotify(block_duration_s=poll)
+    watcher.add_watch(dirname, ic.IN_CLOSE_WRITE | ic.IN_MOVED_TO)
+    try:
+        # yields None every poll seconds when there are no events
+        for event in watcher.event_gen(yield_nones=True):
+            if event is not None:
+                (_, type_names, _, filename) = event
+                if filename == basename and is_ready_event(type_names):
+                    return fn
+            if stable():
+                return fn
+            if time.time() >= t_end:
+                return None
+    finally:
+        watcher.remove_watch(dirname)
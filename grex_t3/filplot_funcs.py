@@ -13,7 +13,6 @@ import matplotlib as mpl
 mpl.rcdefaults()
 mpl.use('Agg') # hack
 import matplotlib.pyplot as plt 
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 import json
 import glob
 import optparse
@@ -21,11 +20,17 @@ import pandas
 import h5py
 
 from sigpyproc.Readers import FilReader
-import slack_sdk as slack
+from sigpyproc.Header import Header
+from sigpyproc.Filterbank import FilterbankBlock
 import astropy.units as u
 from astropy.time import Time
 import dsautils.coordinates
 import dsautils.dsa_store as ds
+from grex_t3 import dedisp_tools
+from grex_t3 import t2_store
+from grex_t3 import plot_templates
+from grex_t3 import product_cache
+from grex_t3 import slack_uploader
 
 MLMODELPATH='/home/ubuntu/connor/MLmodel/20190501freq_time.hdf5' # Keras neural network model for Freq/Time array
 webPLOTDIR='/dataz/dsa110/operations/T3/'
@@ -34,21 +39,6 @@ T2dir = '/dataz/dsa110/operations/T2/cluster_output'
 
 d = ds.DsaStore()
 
-# set up slack client
-slack_file = '{0}/.config/slack_api'.format(
-    os.path.expanduser("~")
-)
-if not os.path.exists(slack_file):
-    raise RuntimeError(
-        "Could not find file with slack api token at {0}".format(
-            slack_file
-        )
-    )
-with open(slack_file) as sf_handler:
-    slack_token = sf_handler.read()
-    slack_client = slack.WebClient(token=slack_token)
-
-
 plt.rcParams.update({
                     'font.size': 12,
                     'font.family': 'serif',
@@ -134,108 +124,56 @@ def plotfour(dataft, datats, datadmt,
     freqmin = freqmax + dataft.header['nchans']*dataft.header['foff']
     freqs = np.linspace(freqmin, freqmax, nfreq)
     tarr = np.linspace(tmin, tmax, ntime)
-    fig, axs = plt.subplots(3, 2, figsize=(8,10), constrained_layout=True)
-
-    if fake:
-        fig.patch.set_facecolor('red')
-        fig.patch.set_alpha(0.5)
+    tpl = plot_templates.get_template(plot_templates.FilplotTemplate)
 
     extentft=[tmin,tmax,freqmin,freqmax]
-    axs[0][0].imshow(dataft, aspect='auto',extent=extentft, interpolation='nearest')
-    DM0_delays = xminplot + dm * 4.15E6 * (freqmin**-2 - freqs**-2)
-    axs[0][0].plot(DM0_delays, freqs, c='r', lw='2', alpha=0.35)
-    axs[0][0].set_xlim(xminplot,xmaxplot)
-    axs[0][0].set_xlabel('Time (ms)')
-    axs[0][0].set_ylabel('Freq (MHz)')
+    tpl.render_ft(dataft, extentft, dm, freqs, (xminplot, xmaxplot),
+                  prob=prob, ibox=ibox)
     if prob!=-1:
-        axs[0][0].text(xminplot+50*ibox/16.,0.5*(freqmax+freqmin),
-                       "Prob=%0.2f" % prob, color='white', fontweight='bold')
         classification_dict['prob'] = prob
 
-#    plt.subplot(322)
     extentdm=[tmin, tmax, dm_min, dm_max]
-    axs[0][1].imshow(datadmt[::-1], aspect='auto',extent=extentdm)
-    axs[0][1].set_xlim(xminplot,xmaxplot)
-    axs[0][1].set_xlabel('Time (ms)')
-    axs[0][1].set_ylabel(r'DM (pc cm$^{-3}$)')
-
-#    plt.subplot(323)
-    axs[1][0].plot(tarr, datats)
-    axs[1][0].grid('on', alpha=0.25)
-    axs[1][0].set_xlabel('Time (ms)')
-    axs[1][0].set_ylabel(r'Power ($\sigma$)')
-    axs[1][0].set_xlim(xminplot,xmaxplot)
-    axs[1][0].text(0.51*(xminplot+xmaxplot), 0.5*(max(datats)+np.median(datats)), 
-            'Heimdall S/N : %0.1f\nHeimdall DM : %d\
-            \nHeimdall ibox : %d\nibeam : %d' % (heimsnr,dm,ibox,ibeam), 
-            fontsize=8, verticalalignment='center')
-    
-#    parent_axes=fig.add_subplot(324)
-    parent_axes = axs[1][1]
+    tpl.render_dmt(datadmt[::-1], extentdm, (xminplot, xmaxplot))
+
+    tpl.render_ts(tarr, datats, (xminplot, xmaxplot),
+                  'Heimdall S/N : %0.1f\nHeimdall DM : %d\
+            \nHeimdall ibox : %d\nibeam : %d' % (heimsnr,dm,ibox,ibeam))
+
     if beam_time_arr is None:
-        plt.xticks([])
-        plt.yticks([])
-        plt.text(0.20, 0.55, 'Multibeam info\n not available',
-                fontweight='bold')
+        tpl.render_beam(None, None, ibeam, (xminplot, xmaxplot))
     else:
-        parent_axes.imshow(beam_time_arr[::-1], aspect='auto', extent=[tmin, tmax, 0, beam_time_arr.shape[0]], 
-                  interpolation='nearest')
-        parent_axes.axvline(540, ymin=0, ymax=6, color='r', linestyle='--', alpha=0.55)
-        parent_axes.axvline(460, ymin=0, ymax=6, color='r', linestyle='--', alpha=0.55)
-        parent_axes.axhline(max(0,ibeam-1), xmin=0, xmax=100, color='r', linestyle='--', alpha=0.55)
-        parent_axes.axhline(ibeam+3, xmin=0, xmax=100, color='r', linestyle='--', alpha=0.55)
-        parent_axes.set_xlim(xminplot,xmaxplot)
-        parent_axes.set_xlabel('Time (ms)')
-        parent_axes.set_ylabel('Beam', fontsize=15)
-        small_axes = inset_axes(parent_axes,
-                                width="25%", # width = 30% of parent_bbox
-                                height="25%", # height : 1 inch
-                                loc=4)
-        small_axes.imshow(beam_time_arr[::-1][ibeam-4:ibeam+4],
-                          aspect='auto',
-                          extent=[tmin, tmax, ibeam-4, ibeam+4],
-                          interpolation='nearest', cmap='afmhot')
-        small_axes.set_xlim(400., 600.)
+        tpl.render_beam(beam_time_arr, [tmin, tmax, 0, beam_time_arr.shape[0]],
+                        ibeam, (xminplot, xmaxplot))
 
     if datadm0 is not None:
-#        plt.subplot(325)
         datadm0 -= np.median(datadm0.mean(0))
         datadm0_sigmas = datadm0.mean(0)/np.std(datadm0.mean(0)[-500:])
         snr_dm0ts_iBeam = np.max(datadm0_sigmas)
-        axs[2][0].plot(np.linspace(0, tmax, len(datadm0[0])), datadm0_sigmas, c='k')
         classification_dict['snr_dm0_ibeam'] = snr_dm0ts_iBeam
+        t_dm0 = np.linspace(0, tmax, len(datadm0[0]))
         
         if multibeam_dm0ts is not None:
-#        if False:
             multibeam_dm0ts -= np.median(multibeam_dm0ts)            
-#            multibeam_dm0ts = multibeam_dm0ts/np.std(multibeam_dm0ts[multibeam_dm0ts!=multibeam_dm0ts.max()])
             multibeam_dm0ts = multibeam_dm0ts/np.std(multibeam_dm0ts[-500:])
             snr_dm0ts_allbeams = np.max(multibeam_dm0ts)
-            axs[2][0].plot(np.linspace(0, tmax, len(multibeam_dm0ts)), multibeam_dm0ts, color='C1', alpha=0.75)
-            axs[2][0].legend(['iBeam=%d'%ibeam, 'All beams'], loc=1, fontsize=10)
-            axs[2][0].set_ylabel(r'Power ($\sigma$)')
+            tpl.render_dm0(t_dm0, datadm0_sigmas,
+                           np.linspace(0, tmax, len(multibeam_dm0ts)),
+                           multibeam_dm0ts, ibeam=ibeam)
             classification_dict['snr_dm0_allbeam'] = snr_dm0ts_allbeams
         else:
-            axs[2][0].legend(['DM=0 Timestream'], loc=2, fontsize=10)
-        axs[2][0].set_xlabel('Time (ms)')
+            tpl.render_dm0(t_dm0, datadm0_sigmas)
+    else:
+        tpl.render_dm0(None, None)
                 
-        if fnT2clust is not None:
-            T2object = pandas.read_csv(fnT2clust)
-            ind = np.where(np.abs(86400*(imjd-T2object.mjds[:]))<30.0)[0]
-            ttsec = (T2object.mjds.values-imjd)*86400
-            mappable = axs[2][1].scatter(ttsec[ind],
-                                         T2object.ibeam[ind],
-                                         c=T2object.dm[ind],
-                                         s=2*T2object.snr[ind],
-                                         cmap='RdBu_r',
-                                         vmin=0,vmax=1200)
-            fig.colorbar(mappable, label=r'DM (pc cm$^{-3}$)', ax=axs[2][1])
-            axs[2][1].scatter(0, ibeam, s=100, marker='s',
-                        facecolor='none', edgecolor='black')
-            axs[2][1].set_xlim(-10,10.)
-            axs[2][1].set_ylim(0,256)
-            axs[2][1].set_xlabel('Time (s)')
-            axs[2][1].set_ylabel('ibeam')
+    if fnT2clust is not None:
+        store = t2_store.get_store(fnT2clust)
+        store.update()
+        T2object = store.window(imjd, 30.0)
+        ttsec = (T2object.mjds.values-imjd)*86400
+        tpl.render_t2(ttsec, T2object.ibeam.values, T2object.dm.values,
+                      T2object.snr.values, ibeam=ibeam)
+    else:
+        tpl.render_t2(None)
 
     not_real = False
 
@@ -254,25 +192,25 @@ def plotfour(dataft, datats, datadmt,
     if not_real==True:
         suptitle += ' (Probably not real)'
 
-    fig.suptitle(suptitle, color='C1')
-    if fake:
-        fig.suptitle('INJECTION')
+    tpl.render_title(suptitle, fake=fake)
 
     if figname is not None:
-        fig.savefig(figname)
+        tpl.save(figname)
     if showplot:
-        fig.show()
-    else:
-        plt.close(fig)
+        tpl.show()
 
     return not_real
         
 
 def dm_transform(data, dm_max=20,
                  dm_min=0, dm0=None, ndm=64, 
-                 freq_ref=None, downsample=16):
-    """ Transform freq/time data to dm/time data.                                                                                                """
+                 freq_ref=None, downsample=16, method='brute'):
+    """ Transform freq/time data to dm/time data.
 
+    method is 'brute' to dedisperse at each trial DM, 
+    or 'fdmt' to compute all trial DMs from one Fast 
+    Dispersion Measure Transform.
+    """
     ntime = data.shape[1]
 
     dms = np.linspace(dm_min, dm_max, ndm, endpoint=True)
@@ -283,10 +221,19 @@ def dm_transform(data, dm_max=20,
 
     data_full = np.zeros([ndm, ntime//downsample])
 
-    for ii, dm in enumerate(dms):
-        dd = data.dedisperse(dm)
-        _dts = np.mean(dd,axis=0)
-        data_full[ii] = _dts[:ntime//downsample*downsample].reshape(ntime//downsample, downsample).mean(1)
+    if method == 'fdmt':
+        header = data.header
+        chan_freqs = header['fch1'] + header['foff'] * np.arange(data.shape[0])
+        dmt = dedisp_tools.fdmt_dmtime(data, chan_freqs, header['tsamp'], dms)
+        dmt /= data.shape[0]
+        data_full[:] = dmt[:, :ntime//downsample*downsample].reshape(ndm, ntime//downsample, downsample).mean(-1)
+    elif method == 'brute':
+        plan = dedisp_tools.block_delay_plan(data, dms)
+        dmt = plan.dmtime(data.view(np.ndarray), time_axis=1)
+        dmt /= data.shape[0]
+        data_full[:] = dmt[:, :ntime//downsample*downsample].reshape(ndm, ntime//downsample, downsample).mean(-1)
+    else:
+        raise ValueError("Unknown DM transform method %s" % method)
 
     return data_full, dms
 
@@ -295,7 +242,8 @@ def proc_cand_fil(fnfil, dm, ibox, snrheim=-1,
                   pre_rebin=1, nfreq_plot=64,
                   heim_raw_tres=1, 
                   rficlean=False, ndm=64,
-                  norm=True, freq_ref=None):
+                  norm=True, freq_ref=None, dm_method='brute',
+                  cache=None):
     """ Take filterbank file path, preprocess, and 
     plot trigger
 
@@ -315,7 +263,31 @@ def proc_cand_fil(fnfil, dm, ibox, snrheim=-1,
     nfreq_plot : int 
         number of frequency channels in output
     heim_raw_tres : 32  
+    dm_method : str
+        'brute' or 'fdmt', passed to dm_transform
+    cache : ProductCache
+        If given (or True for the default), products are 
+        loaded from / saved to this product_cache. A hit 
+        returns the same products, shapes and headers as 
+        computing them.
     """
+    cache = product_cache.resolve_cache(cache)
+    if cache is not None:
+        key = cache.key(fnfil, dm=dm, ibox=ibox, pre_rebin=pre_rebin, 
+                        nfreq_plot=nfreq_plot, heim_raw_tres=heim_raw_tres,
+                        rficlean=rficlean, ndm=ndm, norm=norm, 
+                        freq_ref=freq_ref, dm_method=dm_method,
+                        # products before 2 held only the mean of datadm0
+                        products=2)
+        products = cache.get(key)
+        if products is not None:
+            header = Header(product_cache.unpack_header(products))
+            data = FilterbankBlock(products['ft'], header)
+            header_dm0 = Header(product_cache.unpack_header(products, 'dm0header_'))
+            datadm0 = FilterbankBlock(products['datadm0'], header_dm0)
+            return (data, products['dmt'], products['tsdm0'], 
+                    products['dms'], datadm0)
+
     header = read_fil_data_dsa(fnfil, 0, 1)[-1]
     # read in 4 seconds of data
     nsamp = int(4.0/header['tsamp'])
@@ -341,8 +313,9 @@ def proc_cand_fil(fnfil, dm, ibox, snrheim=-1,
     datadm, dms = dm_transform(data, dm_max=dm+dm_err,
                                dm_min=dm-dm_err, dm0=dm, ndm=ndm, 
                                freq_ref=freq_ref, 
-                               downsample=heim_raw_tres*ibox//pre_rebin)
-    data = data.dedisperse(dm)
+                               downsample=heim_raw_tres*ibox//pre_rebin,
+                               method=dm_method)
+    data = dedisp_tools.dedisperse_block(data, dm)
     data = data.downsample(heim_raw_tres*ibox//pre_rebin)
     data = data.reshape(nfreq_plot, data.shape[0]//nfreq_plot, 
                         data.shape[1]).mean(1)
@@ -351,6 +324,12 @@ def proc_cand_fil(fnfil, dm, ibox, snrheim=-1,
         data = data-np.median(data,axis=1,keepdims=True)
         data /= np.std(data)
 
+    if cache is not None:
+        cache.put(key, dict(ft=np.asarray(data), dmt=datadm, tsdm0=tsdm0, 
+                            dms=dms, datadm0=np.asarray(datadm0),
+                            **product_cache.pack_header(dict(data.header)),
+                            **product_cache.pack_header(dict(datadm0.header), 'dm0header_')))
+
     return data, datadm, tsdm0, dms, datadm0
 
 
@@ -491,7 +470,7 @@ def generate_beam_time_arr(fl, ibeam=0, pre_rebin=1,
         multibeam_dm0ts += data.mean(0) 
         # Rebin in frequency by 8x
         data = data.downsample(pre_rebin)
-        data = data.dedisperse(dm)
+        data = dedisp_tools.dedisperse_block(data, dm)
         data = data.downsample(heim_raw_tres*ibox//pre_rebin)
         datats = np.mean(data, axis=0)
 
@@ -549,11 +528,12 @@ def filplot(fn, dm, ibox, multibeam=None, figname=None,
              ibeam=-1, rficlean=True, nfreq_plot=32, 
              classify=False, heim_raw_tres=1, 
              showplot=True, save_data=True, candname=None,
-             fnT2clust=None, imjd=0, fake=False):
+             fnT2clust=None, imjd=0, fake=False, cache=None):
     """ Vizualize FRB candidates on DSA-110
     fn is filterbnak file name.
     dm is dispersion measure as float.
     ibox is timecar box width as integer.
+    cache is passed to proc_cand_fil.
     """
 
     if type(multibeam)==list:
@@ -570,7 +550,8 @@ def filplot(fn, dm, ibox, multibeam=None, figname=None,
     dataft, datadm, tsdm0, dms, datadm0 = proc_cand_fil(fn, dm, ibox, snrheim=-1, 
                                                pre_rebin=1, nfreq_plot=nfreq_plot,
                                                ndm=ndm, rficlean=rficlean,
-                                               heim_raw_tres=heim_raw_tres)
+                                               heim_raw_tres=heim_raw_tres,
+                                               cache=cache)
 
     if classify:
         prob = classify_freqtime(MLMODELPATH, dataft)
@@ -710,7 +691,8 @@ def filplot_entry(trigger_dict, toslack=True, classify=True,
     if toslack:
         if not_real==False:
             print("Sending to slack")
-            slack_client.files_upload(channels='candidates', file=figname, initial_comment=figname)
+            slack_uploader.get_uploader().upload(figname, channels='candidates', 
+                                                 initial_comment=figname)
         else:
             print("Not real. Not sending to slack")
 
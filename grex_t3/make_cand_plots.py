@@ -9,6 +9,8 @@ import glob
 import time
 
 import candproc_tools
+import dedisp_tools
+import plot_templates
 
 def plotfour_grex(cand):
     """ Plot the four plots for a candidate.
@@ -146,73 +148,26 @@ def plotfour(dataft, datadmt, cand_heim,
     freqs = np.linspace(freqmin, freqmax, nfreq)
     tarr = np.linspace(tmin, tmax, ntime)
     tarr_HR = np.linspace(tmin, tmax, dataft_HR.shape[1])
-    fig = plt.figure(figsize=(8,10))
-
-    plt.subplot(221)
     extentft=[tmin,tmax,freqmin,freqmax]
-    plt.imshow(dataft, 
-               aspect='auto',
-               extent=extentft, 
-               interpolation='nearest')
-    DM0_delays = xminplot + dm * 4.15E6 * (freqmin**-2 - freqs**-2)
-    plt.plot(DM0_delays, freqs, c='r', lw='2', alpha=0.35)
-    plt.xlim(xminplot,xmaxplot)
-    plt.xlabel('Time (ms)')
-    plt.ylabel('Freq (MHz)')
+    extentdm=[tmin, tmax, dm_min, dm_max]
     if prob!=-1:
-        plt.text(xminplot+50*ibox/16.,0.5*(freqmax+freqmin),
-                 "Prob=%0.2f" % prob, color='white', fontweight='bold')
         classification_dict['prob'] = prob
 
-    plt.subplot(222)
-    extentdm=[tmin, tmax, dm_min, dm_max]
-    plt.imshow(datadmt[::-1], aspect='auto',extent=extentdm)
-    plt.xlim(xminplot,xmaxplot)
-    plt.xlabel('Time (ms)')
-    plt.ylabel(r'DM (pc cm$^{-3}$)')
-
-    plt.subplot(223)
-    plt.plot(tarr_HR, datats_HR)
-    plt.plot(tarr, datats)
-
-    plt.grid('on', alpha=0.25)
-    plt.xlabel('Time (ms)')
-    plt.ylabel(r'Power ($\sigma$)')
-    plt.xlim(xminplot,xmaxplot)
-    plt.text(0.51*(xminplot+xmaxplot), 
-            0.5*(max(datats)+np.median(datats)), 
-            'Heimdall S/N : %0.1f\nHeimdall DM : %d\
-            \nHeimdall ibox : %d\nibeam : %d' % (heimsnr,dm,ibox,ibeam), 
-            fontsize=8, verticalalignment='center')
-    
-        
-#        plt.subplot(326)
-#        plt.plot(np.linspace(freqmax,freqmin,datadm0.shape[0]), np.mean(datadm0,axis=-1), color='k')
-
-#        plt.semilogy()
-#        plt.legend(['spectrum'], loc=2)
-#        plt.xlabel('freq [MHz]')
+    tpl = plot_templates.get_template(plot_templates.FourPanelTemplate)
+    tpl.render(dataft, extentft, dm, freqs, datadmt[::-1], extentdm,
+               tarr_HR, datats_HR, tarr, datats, (xminplot, xmaxplot),
+               'Heimdall S/N : %0.1f\nHeimdall DM : %d\
+            \nHeimdall ibox : %d\nibeam : %d' % (heimsnr,dm,ibox,ibeam),
+               prob=prob, ibox=ibox)
 
-    plt.subplot(224)
-    # plt.scatter(cand_heim['time_sec'], cand_heim['dm'], 3, 
-    #             c=cand_heim['snr'], 
-    #             cmap='RdBu', vmax=15., vmin=6.0)
-    # plt.colorbar(label=r'SNR')
-    # plt.scatter(time_sec_ii, dm,
-    #             s=100, marker='s',
-    #             facecolor='none', edgecolor='black')
-    # plt.xlabel('Time (s)')
-    # plt.ylabel('DM')
-
-    # plt.tight_layout()
     if figname_out is not None:
         try:
-            plt.savefig(figname_out)
+            tpl.save(figname_out)
         except:
             print("\n ERR: COULD NOT SAVE FIGURE")
     if showplot:
         try:
-            plt.show()
+            tpl.show()
         except:
             print("\n ERR: COULD NOT SHOW FIG")
 
@@ -220,8 +175,12 @@ def plotfour(dataft, datadmt, cand_heim,
         
 def dm_transform(data, dm_max=20,
                  dm_min=0, dm0=None, ndm=64, 
-                 freq_ref=None, downsample=16):
-    """ Transform freq/time data to dm/time data.                                                                                                                                           
+                 freq_ref=None, downsample=16, method='brute'):
+    """ Transform freq/time data to dm/time data.
+
+    method is 'brute' to dedisperse at each trial DM, 
+    or 'fdmt' to compute all trial DMs from one Fast 
+    Dispersion Measure Transform.
     """
     ntime = data.shape[1]
 
@@ -233,16 +192,25 @@ def dm_transform(data, dm_max=20,
 
     data_full = np.zeros([ndm, ntime//downsample])
 
-    for ii, dm in enumerate(dms):
-        dd = data.dedisperse(dm)
-        _dts = np.mean(dd,axis=0)
-        data_full[ii] = _dts[:ntime//downsample*downsample].reshape(ntime//downsample, downsample).mean(1)
+    if method == 'fdmt':
+        header = data.header
+        chan_freqs = header['fch1'] + header['foff'] * np.arange(data.shape[0])
+        dmt = dedisp_tools.fdmt_dmtime(data, chan_freqs, header['tsamp'], dms)
+        dmt /= data.shape[0]
+        data_full[:] = dmt[:, :ntime//downsample*downsample].reshape(ndm, ntime//downsample, downsample).mean(-1)
+    elif method == 'brute':
+        plan = dedisp_tools.block_delay_plan(data, dms)
+        dmt = plan.dmtime(data.view(np.ndarray), time_axis=1)
+        dmt /= data.shape[0]
+        data_full[:] = dmt[:, :ntime//downsample*downsample].reshape(ndm, ntime//downsample, downsample).mean(-1)
+    else:
+        raise ValueError("Unknown DM transform method %s" % method)
 
     return data_full, dms
 
 def proc_candidate(fncand='/home/user/cand_times_sync/heimdall.cand', 
                    mkplot=True, ndm=32, dmtrans=True, target_DM=None, 
-                   target_RA=None, showplot=False):
+                   target_RA=None, showplot=False, dm_method='brute'):
     if type(fncand)==str:
         cand_heim = staretools.read_heim_pandas(fncand, skiprows=0)
         mjd = staretools.get_mjd_cand_pd(cand_heim)
@@ -333,11 +301,12 @@ def proc_candidate(fncand='/home/user/cand_times_sync/heimdall.cand',
                                        dm_min=dm_ii-dm_err, dm0=dm_ii, 
                                        ndm=ndm, 
                                        freq_ref=np.mean(freq),
-                                       downsample=max(4,ibox))
+                                       downsample=max(4,ibox),
+                                       method=dm_method)
         else:
             datadm = None
 
-        data = data.dedisperse(dm_ii)
+        data = dedisp_tools.dedisperse_block(data, dm_ii)
         data = data - np.mean(data, axis=-1, keepdims=True)
         data = data.reshape(nf//16, 16, -1).mean(1)
 
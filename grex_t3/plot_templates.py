@@ -0,0 +1,444 @@
+""" Candidate plot layouts that are built once and then
+updated in place for each candidate, instead of making
+a new figure, GridSpec and colorbar every time.
+
+Each template owns a single pyplot figure. get_template
+shares one instance of each layout per thread, so a 
+long-running T3_monitor holds a fixed number of figures
+however many candidates it plots, and dask worker threads
+under T3_manager never draw into each other's figure.
+
+    tpl = plot_templates.get_template(plot_templates.GrexCandPlot)
+    tpl.render(...)
+    tpl.save('cand.png')
+"""
+import abc
+import threading
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.ticker as mticker
+from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+
+# (thread ident, class) -> template
+_templates = {}
+# pyplot's figure registry is shared by all threads
+_lock = threading.RLock()
+
+# zero-DM sweep in ms for frequencies in MHz
+K_DM_MS = 4.15E6
+
+
+def _empty_offsets():
+    return np.zeros((0, 2))
+
+def _update_image(im, data, extent, vmin=None, vmax=None):
+    """ New data and extent for an AxesImage, with the
+    colour scale recomputed as a fresh imshow would.
+    """
+    im.set_data(data)
+    im.set_extent(extent)
+    finite = np.isfinite(data)
+    if vmin is None:
+        vmin = data[finite].min() if finite.any() else 0.
+    if vmax is None:
+        vmax = data[finite].max() if finite.any() else 1.
+    im.set_clim(vmin, vmax)
+
+def _update_line(line, x, y):
+    line.set_data(x, y)
+    line.axes.relim()
+    line.axes.autoscale_view()
+
+def _update_scatter(sc, x, y, sizes=None, colors=None, autoscale=True):
+    offsets = np.column_stack([x, y]) if len(x) else _empty_offsets()
+    sc.set_offsets(offsets)
+    if sizes is not None:
+        sc.set_sizes(np.atleast_1d(sizes))
+    if colors is not None:
+        sc.set_array(np.asarray(colors))
+        if autoscale and len(colors):
+            sc.set_clim(np.min(colors), np.max(colors))
+
+
+class CandidatePlot(abc.ABC):
+    """ One reusable pyplot figure. Subclasses lay out
+    the axes and artists in _build and update them in render.
+
+    Parameters
+    ----------
+    num : str
+        pyplot figure label, the class name by default
+    """
+    figsize = (8, 10)
+    layout = None
+
+    def __init__(self, num=None):
+        self.num = num or self.__class__.__name__
+        with _lock:
+            self.fig = plt.figure(num=self.num, figsize=self.figsize,
+                                  layout=self.layout)
+        self.fig.clf()
+        self._build()
+
+    @abc.abstractmethod
+    def _build(self):
+        """ Lay out the axes and artists on self.fig. """
+
+    @property
+    def closed(self):
+        return self.fig is None
+
+    def save(self, fn, **kwargs):
+        self.fig.savefig(fn, **kwargs)
+
+    def show(self):
+        self.fig.show()
+
+    def close(self):
+        if self.fig is not None:
+            with _lock:
+                plt.close(self.fig)
+            self.fig = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def get_template(cls, **kwargs):
+    """ The calling thread's instance of a CandidatePlot
+    subclass, built on first use or after it was closed.
+    """
+    key = (threading.get_ident(), cls)
+    with _lock:
+        tpl = _templates.get(key)
+        if tpl is None or tpl.closed:
+            # a figure label of its own, or pyplot hands back another thread's
+            kwargs.setdefault('num', f"{cls.__name__}-{key[0]}")
+            tpl = cls(**kwargs)
+            _templates[key] = tpl
+    return tpl
+
+def close_templates():
+    """ Close every shared template figure, of all threads. """
+    with _lock:
+        for tpl in _templates.values():
+            tpl.close()
+        _templates.clear()
+
+
+class GrexCandPlot(CandidatePlot):
+    """ Layout of cand_plotter.plot_grex: S/N timestream,
+    dedispersed dynamic spectrum, DM-time, and nearby
+    T2 candidates, with the candidate description on top.
+    """
+    figsize = (10, 15)
+
+    def _build(self):
+        fig = self.fig
+        grid = fig.add_gridspec(9, 6)
+        z = np.zeros((2, 2))
+
+        self.ax_ts = fig.add_subplot(grid[0, :6])
+        self.line_ts, = self.ax_ts.plot([], [], lw=1., color='black')
+        self.ax_ts.set_ylabel('SNR')
+        self.ax_ts.set_xticks([], [])
+
+        self.ax_ft = fig.add_subplot(grid[1:3, :6])
+        self.im_ft = self.ax_ft.imshow(z, aspect='auto', interpolation='nearest')
+        self.line_sweep, = self.ax_ft.plot([], [], c='r', lw='2', alpha=0.35)
+        self.ax_ft.set_ylabel('Frequency (MHz)', fontsize=12)
+
+        self.ax_dmt = fig.add_subplot(grid[4:6, 0:6])
+        self.im_dmt = self.ax_dmt.imshow(z, aspect='auto', interpolation='nearest')
+        self.ax_dmt.set_ylabel(r'DM ($pc\cdot cm^{-3}$)', fontsize=12)
+
+        self.ax_cl = fig.add_subplot(grid[7:9, 0:6])
+        self.sc_cl = self.ax_cl.scatter([], [], s=[], c=[])
+        self.ax_cl.set_ylabel(r'DM ($pc\cdot cm^{-3}$)', fontsize=12)
+
+        fig.subplots_adjust(left=0.1, bottom=0.1, right=0.8, top=0.8,
+                            wspace=0.05, hspace=0.01)
+
+        self.texts = [fig.text(0.1, y, '', fontsize=12, fontweight='semibold')
+                      for y in (0.875, 0.86, 0.845, 0.83, 0.815)]
+
+    def render(self, times, snr_timestream, data_freqtime, extent_ft, vmax,
+               sweep_times, freqs, data_dmt, extent_dmt, time_label,
+               cluster_dt, cluster_dm, cluster_snr, cluster_xlim,
+               cluster_label, header_lines):
+        """ Update every panel for one candidate.
+
+        Parameters
+        ----------
+        times : ndarray
+            Time axis of the timestream in ms
+        snr_timestream : ndarray
+            Timestream in units of S/N
+        data_freqtime : ndarray
+            (nfreq, ntime) dedispersed dynamic spectrum
+        extent_ft, extent_dmt : tuple
+            imshow extents of the two images
+        vmax : float
+            Upper colour limit of the dynamic spectrum
+        sweep_times, freqs : ndarray
+            Dispersion sweep drawn over the dynamic spectrum
+        data_dmt : ndarray
+            (ndm, ntime) DM-time array
+        time_label : str
+            x label of the two images
+        cluster_dt, cluster_dm, cluster_snr : ndarray
+            Nearby T2 candidates, time offset in s, DM and S/N
+        cluster_xlim : tuple
+            Time range of the T2 panel in s
+        cluster_label : str
+            x label of the T2 panel
+        header_lines : list
+            Up to five lines of candidate description
+        """
+        _update_line(self.line_ts, times, snr_timestream)
+        self.ax_ts.set_xlim(times.min(), times.max())
+
+        _update_image(self.im_ft, data_freqtime, extent_ft, vmax=vmax)
+        self.line_sweep.set_data(sweep_times, freqs)
+        self.ax_ft.set_xlim(extent_ft[0], extent_ft[1])
+        self.ax_ft.set_ylim(extent_ft[2], extent_ft[3])
+        self.ax_ft.set_xlabel(time_label, fontsize=12)
+
+        _update_image(self.im_dmt, data_dmt, extent_dmt)
+        self.ax_dmt.set_xlim(extent_dmt[0], extent_dmt[1])
+        self.ax_dmt.set_ylim(extent_dmt[2], extent_dmt[3])
+        self.ax_dmt.set_xlabel(time_label, fontsize=12)
+
+        cluster_snr = np.asarray(cluster_snr)
+        sizes = cluster_snr / cluster_snr.max() * 100 if len(cluster_snr) else []
+        _update_scatter(self.sc_cl, cluster_dt, cluster_dm,
+                        sizes=sizes, colors=cluster_snr)
+        self.ax_cl.set_xlim(*cluster_xlim)
+        if len(cluster_dm):
+            pad = 0.05 * (np.max(cluster_dm) - np.min(cluster_dm)) + 1.
+            self.ax_cl.set_ylim(np.min(cluster_dm) - pad, np.max(cluster_dm) + pad)
+        self.ax_cl.set_xlabel(cluster_label, fontsize=12)
+
+        for text, line in zip(self.texts, list(header_lines) + ['']*5):
+            text.set_text(line)
+
+
+class FilplotTemplate(CandidatePlot):
+    """ 3x2 layout of filplot_funcs.plotfour: dynamic spectrum,
+    DM-time, timestream, multibeam, zero-DM and T2 panels.
+    """
+    figsize = (8, 10)
+    layout = 'constrained'
+
+    def _build(self):
+        fig = self.fig
+        axs = fig.subplots(3, 2)
+        self.axs = axs
+        z = np.zeros((2, 2))
+
+        self.im_ft = axs[0][0].imshow(z, aspect='auto', interpolation='nearest')
+        self.line_sweep, = axs[0][0].plot([], [], c='r', lw='2', alpha=0.35)
+        self.text_prob = axs[0][0].text(0, 0, '', color='white', fontweight='bold')
+        axs[0][0].set_xlabel('Time (ms)')
+        axs[0][0].set_ylabel('Freq (MHz)')
+
+        self.im_dmt = axs[0][1].imshow(z, aspect='auto')
+        axs[0][1].set_xlabel('Time (ms)')
+        axs[0][1].set_ylabel(r'DM (pc cm$^{-3}$)')
+
+        self.line_ts, = axs[1][0].plot([], [])
+        axs[1][0].grid('on', alpha=0.25)
+        axs[1][0].set_xlabel('Time (ms)')
+        axs[1][0].set_ylabel(r'Power ($\sigma$)')
+        self.text_ts = axs[1][0].text(0, 0, '', fontsize=8,
+                                      verticalalignment='center')
+
+        ax = axs[1][1]
+        self.im_beam = ax.imshow(z, aspect='auto', interpolation='nearest')
+        self.beam_lines = [ax.axvline(540, ymin=0, ymax=6, color='r', linestyle='--', alpha=0.55),
+                           ax.axvline(460, ymin=0, ymax=6, color='r', linestyle='--', alpha=0.55),
+                           ax.axhline(0, xmin=0, xmax=100, color='r', linestyle='--', alpha=0.55),
+                           ax.axhline(0, xmin=0, xmax=100, color='r', linestyle='--', alpha=0.55)]
+        self.ax_beam_inset = inset_axes(ax, width="25%", height="25%", loc=4)
+        self.im_beam_inset = self.ax_beam_inset.imshow(z, aspect='auto',
+                                                       interpolation='nearest',
+                                                       cmap='afmhot')
+        self.text_nobeam = ax.text(0.20, 0.55, 'Multibeam info\n not available',
+                                   fontweight='bold', transform=ax.transAxes)
+
+        self.line_dm0, = axs[2][0].plot([], [], c='k')
+        self.line_dm0_all, = axs[2][0].plot([], [], color='C1', alpha=0.75)
+
+        ax = axs[2][1]
+        self.sc_t2 = ax.scatter([], [], c=[], s=[], cmap='RdBu_r', vmin=0, vmax=1200)
+        self.cbar_t2 = fig.colorbar(self.sc_t2, label=r'DM (pc cm$^{-3}$)', ax=ax)
+        self.sc_t2_ibeam = ax.scatter([0], [0], s=100, marker='s',
+                                      facecolor='none', edgecolor='black')
+        ax.set_xlim(-10, 10.)
+        ax.set_ylim(0, 256)
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel('ibeam')
+
+        self.suptitle = fig.suptitle('', color='C1')
+
+    def render_ft(self, dataft, extentft, dm, freqs, xlim, prob=-1, ibox=1):
+        ax = self.axs[0][0]
+        _update_image(self.im_ft, dataft, extentft)
+        freqmin, freqmax = extentft[2], extentft[3]
+        self.line_sweep.set_data(xlim[0] + dm * K_DM_MS * (freqmin**-2 - freqs**-2), freqs)
+        ax.set_xlim(*xlim)
+        ax.set_ylim(freqmin, freqmax)
+        self.text_prob.set_visible(prob != -1)
+        if prob != -1:
+            self.text_prob.set_position((xlim[0]+50*ibox/16., 0.5*(freqmax+freqmin)))
+            self.text_prob.set_text("Prob=%0.2f" % prob)
+
+    def render_dmt(self, datadmt, extentdm, xlim):
+        ax = self.axs[0][1]
+        _update_image(self.im_dmt, datadmt, extentdm)
+        ax.set_xlim(*xlim)
+        ax.set_ylim(extentdm[2], extentdm[3])
+
+    def render_ts(self, tarr, datats, xlim, text):
+        ax = self.axs[1][0]
+        _update_line(self.line_ts, tarr, datats)
+        ax.set_xlim(*xlim)
+        self.text_ts.set_position((0.51*(xlim[0]+xlim[1]),
+                                   0.5*(max(datats)+np.median(datats))))
+        self.text_ts.set_text(text)
+
+    def render_beam(self, beam_time_arr, extent, ibeam, xlim):
+        ax = self.axs[1][1]
+        show = beam_time_arr is not None
+        for artist in [self.im_beam] + self.beam_lines:
+            artist.set_visible(show)
+        self.ax_beam_inset.set_visible(show)
+        self.text_nobeam.set_visible(not show)
+        if not show:
+            ax.set_xticks([])
+            ax.set_yticks([])
+            ax.set_xlabel('')
+            ax.set_ylabel('')
+            return
+
+        _update_image(self.im_beam, beam_time_arr[::-1], extent)
+        self.beam_lines[2].set_ydata([max(0, ibeam-1)]*2)
+        self.beam_lines[3].set_ydata([ibeam+3]*2)
+        # ticks may have been removed for a candidate without beams
+        ax.xaxis.set_major_locator(mticker.AutoLocator())
+        ax.yaxis.set_major_locator(mticker.AutoLocator())
+        ax.set_xlim(*xlim)
+        ax.set_ylim(extent[2], extent[3])
+        ax.set_xlabel('Time (ms)')
+        ax.set_ylabel('Beam', fontsize=15)
+
+        inset_extent = [extent[0], extent[1], ibeam-4, ibeam+4]
+        _update_image(self.im_beam_inset, beam_time_arr[::-1][ibeam-4:ibeam+4],
+                      inset_extent)
+        self.ax_beam_inset.set_xlim(400., 600.)
+        self.ax_beam_inset.set_ylim(ibeam-4, ibeam+4)
+
+    def render_dm0(self, t_ibeam, dm0_ibeam, t_all=None, dm0_all=None, ibeam=-1):
+        ax = self.axs[2][0]
+        show = t_ibeam is not None
+        self.line_dm0.set_visible(show)
+        self.line_dm0_all.set_visible(show and t_all is not None)
+        if ax.get_legend() is not None:
+            ax.get_legend().remove()
+        if not show:
+            ax.set_xlabel('')
+            ax.set_ylabel('')
+            return
+
+        _update_line(self.line_dm0, t_ibeam, dm0_ibeam)
+        if t_all is not None:
+            _update_line(self.line_dm0_all, t_all, dm0_all)
+            ax.legend([self.line_dm0, self.line_dm0_all],
+                      ['iBeam=%d'%ibeam, 'All beams'], loc=1, fontsize=10)
+            ax.set_ylabel(r'Power ($\sigma$)')
+        else:
+            ax.legend([self.line_dm0], ['DM=0 Timestream'], loc=2, fontsize=10)
+            ax.set_ylabel('')
+        ax.set_xlabel('Time (ms)')
+
+    def render_t2(self, ttsec=None, ibeams=None, dms=None, snrs=None, ibeam=-1):
+        show = ttsec is not None
+        for artist in (self.sc_t2, self.sc_t2_ibeam):
+            artist.set_visible(show)
+        if not show:
+            return
+        _update_scatter(self.sc_t2, ttsec, ibeams, sizes=2*np.asarray(snrs),
+                        colors=dms, autoscale=False)
+        self.sc_t2_ibeam.set_offsets([[0, ibeam]])
+
+    def render_title(self, suptitle, fake=False):
+        if fake:
+            self.fig.patch.set_facecolor('red')
+            self.fig.patch.set_alpha(0.5)
+            suptitle = 'INJECTION'
+        else:
+            self.fig.patch.set_facecolor('white')
+            self.fig.patch.set_alpha(1.)
+        self.suptitle.set_text(suptitle)
+
+
+class FourPanelTemplate(CandidatePlot):
+    """ 2x2 layout of make_cand_plots.plotfour: dynamic
+    spectrum, DM-time, and full and boxcar timestreams.
+    """
+    figsize = (8, 10)
+
+    def _build(self):
+        fig = self.fig
+        z = np.zeros((2, 2))
+
+        self.ax_ft = fig.add_subplot(221)
+        self.im_ft = self.ax_ft.imshow(z, aspect='auto', interpolation='nearest')
+        self.line_sweep, = self.ax_ft.plot([], [], c='r', lw='2', alpha=0.35)
+        self.text_prob = self.ax_ft.text(0, 0, '', color='white', fontweight='bold')
+        self.ax_ft.set_xlabel('Time (ms)')
+        self.ax_ft.set_ylabel('Freq (MHz)')
+
+        self.ax_dmt = fig.add_subplot(222)
+        self.im_dmt = self.ax_dmt.imshow(z, aspect='auto')
+        self.ax_dmt.set_xlabel('Time (ms)')
+        self.ax_dmt.set_ylabel(r'DM (pc cm$^{-3}$)')
+
+        self.ax_ts = fig.add_subplot(223)
+        self.line_ts_hr, = self.ax_ts.plot([], [])
+        self.line_ts, = self.ax_ts.plot([], [])
+        self.ax_ts.grid('on', alpha=0.25)
+        self.ax_ts.set_xlabel('Time (ms)')
+        self.ax_ts.set_ylabel(r'Power ($\sigma$)')
+        self.text_ts = self.ax_ts.text(0, 0, '', fontsize=8,
+                                       verticalalignment='center')
+
+        self.ax_extra = fig.add_subplot(224)
+
+    def render(self, dataft, extentft, dm, freqs, datadmt, extentdm,
+               tarr_hr, datats_hr, tarr, datats, xlim, text,
+               prob=-1, ibox=1):
+        """ Update the panels for one candidate. """
+        _update_image(self.im_ft, dataft, extentft)
+        freqmin, freqmax = extentft[2], extentft[3]
+        self.line_sweep.set_data(xlim[0] + dm * K_DM_MS * (freqmin**-2 - freqs**-2), freqs)
+        self.ax_ft.set_xlim(*xlim)
+        self.ax_ft.set_ylim(freqmin, freqmax)
+        self.text_prob.set_visible(prob != -1)
+        if prob != -1:
+            self.text_prob.set_position((xlim[0]+50*ibox/16., 0.5*(freqmax+freqmin)))
+            self.text_prob.set_text("Prob=%0.2f" % prob)
+
+        _update_image(self.im_dmt, datadmt, extentdm)
+        self.ax_dmt.set_xlim(*xlim)
+        self.ax_dmt.set_ylim(extentdm[2], extentdm[3])
+
+        _update_line(self.line_ts_hr, tarr_hr, datats_hr)
+        _update_line(self.line_ts, tarr, datats)
+        self.ax_ts.set_xlim(*xlim)
+        self.text_ts.set_position((0.51*(xlim[0]+xlim[1]),
+                                   0.5*(max(datats)+np.median(datats))))
+        self.text_ts.set_text(text)
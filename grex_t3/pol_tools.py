@@ -0,0 +1,134 @@
+""" Full-Stokes (IQUV) products built directly from
+GReX voltage dumps, for the polarization stage of T3.
+"""
+import numpy as np
+import xarray
+import h5py
+from numba import njit
+
+STOKES = 'IQUV'
+
+
+@njit(nogil=True)
+def _stokes_iquv_kernel(voltages, out):
+    """ Form I, Q, U, V from the integer voltages
+    (time, freq, pol, reim) into out (time, 4, freq).
+    pol index 0 is X and 1 is Y.
+    """
+    ntime, nfreq = voltages.shape[0], voltages.shape[1]
+    for tt in range(ntime):
+        for ff in range(nfreq):
+            xr = np.float32(voltages[tt, ff, 0, 0])
+            xi = np.float32(voltages[tt, ff, 0, 1])
+            yr = np.float32(voltages[tt, ff, 1, 0])
+            yi = np.float32(voltages[tt, ff, 1, 1])
+            xx = xr * xr + xi * xi
+            yy = yr * yr + yi * yi
+            out[tt, 0, ff] = xx + yy
+            out[tt, 1, ff] = xx - yy
+            # 2 Re(X Y*) and 2 Im(X* Y)
+            out[tt, 2, ff] = 2 * (xr * yr + xi * yi)
+            out[tt, 3, ff] = 2 * (xr * yi - xi * yr)
+
+def stokes_from_voltages(voltages, out=None):
+    """ Compute all four Stokes parameters from
+    raw voltages in a single pass.
+
+    Parameters
+    ----------
+    voltages : ndarray
+        Integer voltages with shape (time, freq, pol, reim),
+        with reim ordered (real, imaginary)
+    out : ndarray
+        Optional preallocated float32 array (time, 4, freq)
+
+    Returns
+    -------
+    out : ndarray
+        IQUV, float32 (time, 4, freq)
+    """
+    if out is None:
+        out = np.empty((voltages.shape[0], 4, voltages.shape[1]),
+                       dtype=np.float32)
+    _stokes_iquv_kernel(voltages, out)
+    return out
+
+def write_stokes_product(fn_vol, fnout, timedownsample=1,
+                         freqdownsample=1, chunksize=2048):
+    """ Read a .nc voltage dump once, chunk by chunk,
+    and write a downsampled IQUV product to HDF5.
+
+    Parameters
+    ----------
+    fn_vol : str
+        The file name of the .nc file with voltages
+    fnout : str
+        The output HDF5 file name
+    timedownsample : int
+        The factor to downsample in time
+    freqdownsample : int
+        The factor to downsample in frequency
+    chunksize : int
+        Number of time samples read per chunk
+
+    Returns
+    -------
+    fnout : str
+        The output HDF5 file name
+    """
+    tds, fds = int(timedownsample), int(freqdownsample)
+    ds = xarray.open_dataset(fn_vol)
+    voltages = ds["voltages"].transpose("time", "freq", "pol", "reim")
+    voltages = voltages.sel(reim=["real", "imaginary"])
+
+    times = ds.time.values
+    freqs = ds.freq.values
+    ntime_out = len(times) // tds
+    nfreq_out = len(freqs) // fds
+    freqs = freqs[:nfreq_out*fds].reshape(nfreq_out, fds).mean(1)
+
+    # each chunk must hold a whole number of output samples
+    chunksize = max(tds, chunksize // tds * tds)
+    stokes = np.empty((chunksize, 4, len(ds.freq)), dtype=np.float32)
+
+    with h5py.File(fnout, 'w') as f:
+        dset = f.create_dataset('data_stokes', (ntime_out, 4, nfreq_out),
+                                dtype=np.float32)
+        f.create_dataset('freq', data=freqs)
+        f.attrs['stokes'] = STOKES
+        f.attrs['fch1'] = freqs[0]
+        f.attrs['foff'] = np.diff(freqs)[0] if nfreq_out > 1 else 0.
+        f.attrs['nchans'] = nfreq_out
+        # average over the dump, single MJD differences lose precision
+        f.attrs['tsamp'] = (times[-1] - times[0]) / (len(times) - 1) * 86400. * tds
+        f.attrs['tstart'] = times[0]
+        f.attrs['source_file'] = str(fn_vol)
+
+        for start in range(0, ntime_out*tds, chunksize):
+            stop = min(start + chunksize, ntime_out*tds)
+            nsamp = stop - start
+            chunk = voltages.isel(time=slice(start, stop)).values
+            iquv = stokes_from_voltages(chunk, out=stokes[:nsamp])
+            iquv = iquv[..., :nfreq_out*fds]
+            iquv = iquv.reshape(nsamp//tds, tds, 4, nfreq_out, fds).mean(axis=(1, 4))
+            dset[start//tds:stop//tds] = iquv
+
+    ds.close()
+
+    return fnout
+
+def read_stokes_product(fn):
+    """ Read an IQUV product written by write_stokes_product.
+
+    Returns
+    -------
+    data : ndarray
+        float32 (time, 4, freq)
+    header : dict
+        fch1, foff, nchans, tsamp, tstart, stokes
+    """
+    with h5py.File(fn, 'r') as f:
+        data = f['data_stokes'][:]
+        header = dict(f.attrs)
+
+    return data, header
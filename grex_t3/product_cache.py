@@ -0,0 +1,209 @@
+""" A content-addressed on-disk cache of candidate data
+products (dedispersed ft, DM-time, timestreams, DMs).
+
+Entries are keyed by the identity of the input files
+(path, size, mtime) plus the processing parameters, so
+re-plotting a candidate with the same inputs skips the
+voltage read, cleaning and dedispersion entirely, while
+a rewritten input or a changed parameter is a miss.
+
+    cache = product_cache.get_cache()
+    key = cache.key(fn_vol, dm=dm, ibox=ibox)
+    products = cache.get(key)
+    if products is None:
+        products = dict(ft=ft, dmt=dmt, dms=dms)
+        cache.put(key, products)
+
+The cache is only an optimisation, so get and put log a
+warning and carry on (as a miss, or without storing) if
+the cache directory can't be used.
+"""
+import os
+import json
+import time
+import logging
+import hashlib
+
+import numpy as np
+
+CACHE_DIR = '/hdd/data/candidates/T3/product_cache/'
+MAX_BYTES = 20e9
+MAX_AGE = 14 * 86400.
+
+_caches = {}
+
+
+def file_identity(fn):
+    """ (absolute path, size, mtime in ns) of a file. """
+    st = os.stat(fn)
+    return [os.path.abspath(fn), st.st_size, st.st_mtime_ns]
+
+
+class ProductCache:
+    """ Candidate products as one .npz per key, evicted
+    least-recently-used first once the cache is larger
+    than max_bytes, or once unused for max_age seconds.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory holding the entries
+    max_bytes : float
+        Size limit of the whole cache
+    max_age : float
+        Entries not read or written for this many
+        seconds are removed
+    """
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES,
+                 max_age=MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def key(self, files, **params):
+        """ Hex digest of the input file identities and the
+        processing parameters.
+
+        Parameters
+        ----------
+        files : str or list
+            Input file(s) the products are computed from
+        **params
+            Anything else that changes the products,
+            e.g. dm, ibox, ndm
+        """
+        if isinstance(files, str):
+            files = [files]
+        ident = dict(files=[file_identity(fn) for fn in files],
+                     params=params)
+        blob = json.dumps(ident, sort_keys=True, default=str)
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, key):
+        """ The products stored under key, or None on a miss.
+        0-d entries come back as numpy scalars.
+        """
+        fn = self._path(key)
+        if not os.path.exists(fn):
+            return None
+        try:
+            with np.load(fn) as f:
+                products = {k: f[k][()] if f[k].ndim == 0 else f[k]
+                            for k in f.files}
+            # mark as recently used for eviction
+            os.utime(fn)
+        except Exception as e:
+            logging.warning(f"Could not read product cache entry {fn}: {e}")
+            return None
+        return products
+
+    def put(self, key, products):
+        """ Store a dict of arrays and scalars under key,
+        then evict anything over the limits. Returns whether
+        the entry was stored.
+        """
+        fn = self._path(key)
+        tmp = f"{fn}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                np.savez(f, **products)
+            os.replace(tmp, fn)
+            self.evict()
+        except Exception as e:
+            logging.warning(f"Could not write product cache entry {fn}: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def entries(self):
+        """ (mtime, size, path) of every entry, oldest first. """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        out = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith('.npz'):
+                continue
+            fn = os.path.join(self.cache_dir, fn)
+            try:
+                st = os.stat(fn)
+            except FileNotFoundError:
+                continue
+            out.append((st.st_mtime, st.st_size, fn))
+        return sorted(out)
+
+    def nbytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """ Remove entries older than max_age, then the least
+        recently used until the cache fits in max_bytes.
+
+        Returns
+        -------
+        removed : int
+            Number of entries removed
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        removed = 0
+        for mtime, size, fn in entries:
+            if now - mtime < self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        return removed
+
+    def clear(self):
+        for _, _, fn in self.entries():
+            os.remove(fn)
+
+
+def pack_header(header, prefix='header_'):
+    """ A header dict as cache products, one 0-d entry per
+    key so numbers keep their type. None values are listed
+    under prefix + 'none'.
+    """
+    products = {prefix + k: v for k, v in header.items() if v is not None}
+    products[prefix + 'none'] = np.array([k for k, v in header.items() if v is None],
+                                         dtype=str)
+    return products
+
+def unpack_header(products, prefix='header_'):
+    """ The header dict stored with pack_header, with plain
+    Python values.
+    """
+    header = {k[len(prefix):]: v.item() if hasattr(v, 'item') else v
+              for k, v in products.items()
+              if k.startswith(prefix) and k != prefix + 'none'}
+    for k in products.get(prefix + 'none', []):
+        header[str(k)] = None
+    return header
+
+def get_cache(cache_dir=CACHE_DIR):
+    """ The ProductCache for cache_dir, shared within a process. """
+    if cache_dir not in _caches:
+        _caches[cache_dir] = ProductCache(cache_dir)
+    return _caches[cache_dir]
+
+def resolve_cache(cache):
+    """ Cache argument of the processing functions: True for
+    the default cache, None/False for none, or a ProductCache.
+    """
+    if cache is True:
+        return get_cache()
+    if cache is False:
+        return None
+    return cache
@@ -0,0 +1,239 @@
+""" Follow a Heimdall .cand file on another station over one
+persistent SSH/SFTP connection.
+
+Instead of a new connection and a `tail -n` for every query,
+the feed remembers how far into the file it has read and only
+fetches the bytes appended since, parsing them into a rolling
+buffer of the most recent candidates. A dropped connection is
+re-opened on the next update, and a truncated or replaced file
+is picked up from its end again.
+
+    feed = remote_feed.get_feed('158.154.14.10', username='user',
+                                file_path='/home/user/cand_times_sync/heimdall_3.cand')
+    cands = feed.update(ncand=250)
+
+For testing without SSH, pass client_factory=LocalSSHClient,
+which serves the local filesystem.
+"""
+import io
+import os
+import logging
+import threading
+from functools import partial
+
+import pandas as pd
+
+HEIM_COLUMNS = ['snr', 'cand', 'time_sec',
+                'log2width', 'unknown2', 'dm',
+                'unknown3', 'mjdx', 'mjd_day',
+                'mjd_hr', 'mjd_min', 'mjd_sec']
+
+# bytes before the read offset compared on each update, to
+# tell a file replaced by a longer one from one appended to
+CHECK_BYTES = 64
+
+_feeds = {}
+
+
+def ssh_connect(hostname, port=22, username='user', password=None,
+                timeout=10., keepalive=30):
+    """ A connected paramiko SSHClient. """
+    import paramiko
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(hostname, port=port, username=username,
+                   password=password, timeout=timeout)
+    client.get_transport().set_keepalive(keepalive)
+    return client
+
+
+class LocalSFTP:
+    """ The part of paramiko's SFTPClient the feed uses,
+    on the local filesystem.
+    """
+    def __init__(self, owner):
+        self.owner = owner
+
+    def _check(self):
+        if self.owner.closed:
+            raise OSError("Socket is closed")
+
+    def stat(self, path):
+        self._check()
+        return os.stat(path)
+
+    def open(self, path, mode='r'):
+        self._check()
+        return open(path, mode if 'b' in mode else mode + 'b')
+
+    def close(self):
+        pass
+
+class LocalSSHClient:
+    """ Stand-in for a connected paramiko.SSHClient whose
+    SFTP sessions read local files. drop() breaks the
+    connection, as a network outage would.
+    """
+    nconnect = 0
+
+    def __init__(self, *args, **kwargs):
+        LocalSSHClient.nconnect += 1
+        self.closed = False
+
+    def open_sftp(self):
+        return LocalSFTP(self)
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return not self.closed
+
+    def drop(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class RemoteCandFeed:
+    """ Incremental reader of a remote Heimdall .cand file.
+
+    Parameters
+    ----------
+    hostname, port, username, password :
+        SSH login
+    file_path : str
+        Candidate file on the remote host
+    maxlen : int
+        Most recent candidates kept in the buffer
+    tail_bytes : int
+        How far back from the end of the file to start
+        reading on the first update, or after a truncation
+    client_factory : callable
+        Returns a connected SSHClient, by default ssh_connect
+        with the login above
+    """
+    def __init__(self, hostname='158.154.14.10', port=22, username='user',
+                 password=None, file_path='/home/user/cand_times_sync/heimdall_3.cand',
+                 maxlen=10000, tail_bytes=2**18, client_factory=None):
+        self.file_path = file_path
+        self.maxlen = maxlen
+        self.tail_bytes = tail_bytes
+        if client_factory is None:
+            client_factory = partial(ssh_connect, hostname, port=port,
+                                     username=username, password=password)
+        self.client_factory = client_factory
+        self.client = None
+        self.sftp = None
+        # offset is the end of the last complete line read
+        self.offset = None
+        self._check = b''
+        self.buffer = pd.DataFrame(columns=HEIM_COLUMNS, dtype=float)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.client is not None:
+            transport = self.client.get_transport()
+            if transport is not None and transport.is_active():
+                return
+            self.close()
+        self.client = self.client_factory()
+        self.sftp = self.client.open_sftp()
+
+    def close(self):
+        for conn in (self.sftp, self.client):
+            try:
+                if conn is not None:
+                    conn.close()
+            except Exception:
+                pass
+        self.client, self.sftp = None, None
+
+    def _read(self):
+        """ Bytes of complete lines appended since the last read. """
+        size = self.sftp.stat(self.file_path).st_size
+        with self.sftp.open(self.file_path, 'rb') as f:
+            if self.offset is not None and self.offset <= size:
+                start = max(0, self.offset - len(self._check))
+                f.seek(start)
+                chunk = f.read(size - start)
+                if chunk[:self.offset - start] == self._check:
+                    chunk = chunk[self.offset - start:]
+                else:
+                    logging.warning(f"{self.file_path} was replaced, reading from its end")
+                    self.offset = None
+            elif self.offset is not None:
+                logging.warning(f"{self.file_path} was truncated, reading from its end")
+                self.offset = None
+
+            if self.offset is None:
+                start = max(0, size - self.tail_bytes)
+                f.seek(start)
+                chunk = f.read(size - start)
+                # the first line may be cut
+                skip = chunk.find(b'\n') + 1 if start > 0 else 0
+                self.offset, chunk = start + skip, chunk[skip:]
+                self._check = b''
+
+        end = chunk.rfind(b'\n') + 1
+        chunk = chunk[:end]
+        self.offset += end
+        self._check = (self._check + chunk)[-CHECK_BYTES:]
+        return chunk
+
+    def update(self, ncand=None):
+        """ Fetch newly appended candidates into the buffer.
+        A broken connection is re-opened once straight away;
+        if the host still can't be reached the buffer is 
+        returned as it was, and tried again next time.
+
+        Returns
+        -------
+        cands : pandas.DataFrame
+            The last ncand candidates in the buffer, all of
+            them if ncand is None
+        """
+        with self._lock:
+            chunk = b''
+            for attempt in range(2):
+                try:
+                    self._connect()
+                    chunk = self._read()
+                    break
+                except FileNotFoundError:
+                    logging.warning(f"{self.file_path} does not exist yet")
+                    break
+                except Exception as e:
+                    logging.warning(f"Could not read {self.file_path}: {e}")
+                    self.close()
+
+            if chunk.strip():
+                new = parse_cands(chunk)
+                if len(self.buffer):
+                    new = pd.concat([self.buffer, new], ignore_index=True)
+                self.buffer = new.iloc[-self.maxlen:].reset_index(drop=True)
+            return self.tail(ncand)
+
+    def tail(self, ncand=None):
+        """ The last ncand candidates in the buffer. """
+        if ncand is None:
+            return self.buffer.copy()
+        start = max(0, len(self.buffer) - ncand)
+        return self.buffer.iloc[start:].reset_index(drop=True)
+
+def parse_cands(chunk):
+    """ Whitespace-separated Heimdall candidate lines as a
+    float DataFrame with HEIM_COLUMNS.
+    """
+    return pd.read_csv(io.BytesIO(chunk), sep=r'\s+', header=None,
+                       usecols=range(len(HEIM_COLUMNS)),
+                       names=HEIM_COLUMNS).astype(float)
+
+def get_feed(hostname='158.154.14.10', port=22, username='user', password=None,
+             file_path='/home/user/cand_times_sync/heimdall_3.cand'):
+    """ The RemoteCandFeed for a host and file, shared within a process. """
+    key = (hostname, port, username, file_path)
+    if key not in _feeds:
+        _feeds[key] = RemoteCandFeed(hostname, port, username, password, file_path)
+    return _feeds[key]
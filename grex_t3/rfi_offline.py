@@ -4,7 +4,7 @@ import numpy as np
 import numpy.ma as ma
 import pandas as pd
 
-import analysis_tools
+from grex_t3 import analysis_tools
 
 class RFI:
     """
@@ -178,6 +178,57 @@ def apply_rfi_filters_grex(data, sigma_thresh_chan=3.,
     
     return R.data 
 
+def clean_chunk(data, sigma_thresh_time=10., sigma_thresh_freq=10.,
+                dumb_mask=[]):
+    """ Clean one (time, freq) chunk of Stokes I in place, 
+    as it is formed in candproc_tools.read_voltage_data.
+
+    Channels with outlier variance (variancecut_freq) and 
+    samples with outlier DM=0 power (dm_zero_filter) are 
+    flagged and replaced by the mean of the unflagged data 
+    in their channel, or of the whole chunk for channels 
+    that are flagged outright, so no NaNs are left behind.
+
+    Parameters:
+    ----------
+    data: ndarray
+        (ntime, nfreq) float, modified in place
+    sigma_thresh_time : float
+        threshold sigma in DM=0 timeseries
+    sigma_thresh_freq : float
+        threshold sigma on the channel standard deviations
+    dumb_mask : list
+        list of channels to ignore
+
+    Returns:
+    -------
+    mask : ndarray
+        (ntime, nfreq) bool, True where data was replaced
+    """
+    ntime, nfreq = data.shape
+    mask = np.zeros((nfreq, ntime), dtype=bool)
+    if data.size == 0:
+        return mask.T
+
+    # the filters work on (nfreq, ntime), so use transposed views
+    R = RFI(ma.masked_array(data.T, mask=mask, copy=False), 
+            dumb_mask=dumb_mask)
+    R.apply_dumb_mask()
+    R.variancecut_freq(axis=1, sigma_thresh=sigma_thresh_freq)
+    R.dm_zero_filter(sigma_thresh_time)
+    mask = ma.getmaskarray(R.data).T
+
+    if mask.any():
+        good = ~mask
+        ngood = good.sum(0)
+        chan_mean = np.where(good, data, 0).sum(0) / np.maximum(ngood, 1)
+        chunk_mean = chan_mean[ngood > 0].mean() if ngood.any() else 0.
+        chan_mean[ngood == 0] = chunk_mean
+        np.copyto(data, np.broadcast_to(chan_mean.astype(data.dtype), data.shape),
+                  where=mask)
+
+    return mask
+
 if __name__=='__main__':
     fn_fil = sys.argv[1]
     fn_out_fil = sys.argv[2]
@@ -0,0 +1,264 @@
+""" Post candidate plots and messages to Slack from a
+background thread, so Slack latency or an outage never
+holds up candidate processing.
+
+    uploader = slack_uploader.get_uploader()
+    uploader.upload('/hdd/data/candidates/T3/candplots/grex_cand240321aazm.png',
+                    initial_comment='New candidate plot generated!')
+
+Jobs that fail are retried with exponential backoff, or
+after Slack's Retry-After when rate limited. One WebClient
+is kept for the life of the process. For testing without
+Slack, pass client=LocalSlackClient(outdir), which records
+each call in outdir/slack.jsonl instead.
+"""
+import os
+import json
+import time
+import heapq
+import atexit
+import shutil
+import logging
+import itertools
+import threading
+
+SLACK_FILE = '{0}/.config/slack_api'.format(os.path.expanduser("~"))
+
+_uploaders = {}
+# get_uploader is called from threaded dask workers
+_uploaders_lock = threading.Lock()
+
+
+def load_token(slack_file=SLACK_FILE):
+    """ Slack API token from slack_file. """
+    if not os.path.exists(slack_file):
+        raise RuntimeError(
+            "Could not find file with slack api token at {0}".format(
+                slack_file
+            )
+        )
+    with open(slack_file) as sf_handler:
+        return sf_handler.read().strip()
+
+def make_client(slack_file=SLACK_FILE):
+    """ A slack_sdk WebClient with the token in slack_file. """
+    import slack_sdk as slk
+    return slk.WebClient(token=load_token(slack_file))
+
+
+class LocalResponse(dict):
+    """ Enough of a slack_sdk SlackResponse for the uploader. """
+    def __init__(self, data, status_code=200, headers=None):
+        dict.__init__(self, data)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class LocalSlackError(Exception):
+    """ Raised by LocalSlackClient, with a response
+    like slack_sdk's SlackApiError.
+    """
+    def __init__(self, message, response):
+        Exception.__init__(self, message)
+        self.response = response
+
+class LocalSlackClient:
+    """ Stand-in for slack_sdk.WebClient that appends each call
+    to outdir/slack.jsonl and copies uploaded files to outdir.
+
+    Parameters
+    ----------
+    outdir : str
+        Where calls and files are recorded
+    fail : int
+        Number of calls to fail with a 500 first
+    ratelimit : int
+        Number of calls, after those, to fail with a 429
+    retry_after : float
+        Retry-After of the 429 responses in seconds
+    """
+    def __init__(self, outdir, fail=0, ratelimit=0, retry_after=1.):
+        self.outdir = outdir
+        os.makedirs(outdir, exist_ok=True)
+        self.fail = fail
+        self.ratelimit = ratelimit
+        self.retry_after = retry_after
+        self.ncall = 0
+
+    def _call(self, method, **kwargs):
+        self.ncall += 1
+        if self.fail > 0:
+            self.fail -= 1
+            raise LocalSlackError("internal_error", LocalResponse({'ok': False}, 500))
+        if self.ratelimit > 0:
+            self.ratelimit -= 1
+            raise LocalSlackError("ratelimited", LocalResponse(
+                {'ok': False}, 429, {'Retry-After': str(self.retry_after)}))
+
+        record = dict(method=method, time=time.time(), **kwargs)
+        if 'file' in kwargs:
+            dest = os.path.join(self.outdir, os.path.basename(kwargs['file']))
+            shutil.copyfile(kwargs['file'], dest)
+            record['file'] = dest
+        with open(os.path.join(self.outdir, 'slack.jsonl'), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+        return LocalResponse({'ok': True, 'file': {'permalink': record.get('file')}})
+
+    def files_upload(self, **kwargs):
+        return self._call('files_upload', **kwargs)
+
+    def chat_postMessage(self, **kwargs):
+        return self._call('chat_postMessage', **kwargs)
+
+
+class SlackUploader:
+    """ Queue of Slack calls run by one background thread.
+
+    Parameters
+    ----------
+    client : WebClient
+        Client to use, by default made from slack_file
+        on the first job
+    slack_file : str
+        File holding the API token
+    max_retries : int
+        Attempts after the first before a job is dropped
+    backoff : float
+        Delay before the first retry, doubled each time
+    max_backoff : float
+        Longest delay between retries
+    min_interval : float
+        Shortest time between calls, to stay under
+        Slack's rate limits
+    """
+    def __init__(self, client=None, slack_file=SLACK_FILE, max_retries=6,
+                 backoff=2., max_backoff=300., min_interval=1.):
+        self.client = client
+        self.slack_file = slack_file
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.min_interval = min_interval
+
+        # (time due, seq, method, kwargs, attempt, time queued, callback)
+        self._jobs = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self.nsent = 0
+        self.nfailed = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _put(self, method, kwargs, attempt=0, due=None, t_queued=None,
+             callback=None):
+        now = time.time()
+        with self._cond:
+            heapq.heappush(self._jobs, (due or now, next(self._seq), method, kwargs,
+                                        attempt, t_queued or now, callback))
+            self._cond.notify()
+
+    def upload(self, file, channels="candidates", initial_comment=None,
+               callback=None):
+        """ Queue a file upload, returning straight away. 
+        callback(ok, seconds since queued, attempts) is called 
+        from the uploader thread once it has succeeded or failed.
+        """
+        self._put('files_upload', dict(channels=channels, file=file,
+                                       initial_comment=initial_comment),
+                  callback=callback)
+
+    def post(self, text, channel="candidates", callback=None):
+        """ Queue a message, returning straight away. """
+        self._put('chat_postMessage', dict(channel=channel, text=text),
+                  callback=callback)
+
+    @property
+    def pending(self):
+        with self._cond:
+            return len(self._jobs) + self._busy
+
+    def _retry_delay(self, err, attempt):
+        response = getattr(err, 'response', None)
+        if getattr(response, 'status_code', None) == 429:
+            try:
+                return float(response.headers.get('Retry-After', 1))
+            except (TypeError, ValueError):
+                pass
+        return min(self.backoff * 2**attempt, self.max_backoff)
+
+    def _run(self):
+        last = 0.
+        while True:
+            with self._cond:
+                while not self._closed and (len(self._jobs) == 0 or
+                                            self._jobs[0][0] > time.time()):
+                    wait = self._jobs[0][0] - time.time() if self._jobs else None
+                    self._cond.wait(wait)
+                if self._closed:
+                    return
+                due, _, method, kwargs, attempt, t_queued, callback = heapq.heappop(self._jobs)
+                self._busy = True
+
+            time.sleep(max(0., last + self.min_interval - time.time()))
+            last = time.time()
+            try:
+                if self.client is None:
+                    self.client = make_client(self.slack_file)
+                getattr(self.client, method)(**kwargs)
+                self.nsent += 1
+                logging.info(f"Slack {method} done: {kwargs.get('file') or kwargs.get('text')}")
+                ok = True
+            except Exception as err:
+                if attempt < self.max_retries and self.client is not None:
+                    delay = self._retry_delay(err, attempt)
+                    logging.warning(f"Slack {method} failed ({err}), retrying in {delay:.0f} s")
+                    self._put(method, kwargs, attempt + 1, time.time() + delay,
+                              t_queued, callback)
+                    ok = None
+                else:
+                    self.nfailed += 1
+                    logging.error(f"Slack {method} failed, giving up: {err}")
+                    ok = False
+
+            if ok is not None and callback is not None:
+                try:
+                    callback(ok, time.time() - t_queued, attempt + 1)
+                except Exception as err:
+                    logging.error(f"Slack callback failed: {err}")
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """ Wait until the queue is empty, including retries.
+        Returns whether it emptied within timeout.
+        """
+        t_end = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._jobs or self._busy:
+                wait = None if t_end is None else t_end - time.time()
+                if wait is not None and wait <= 0:
+                    return False
+                self._cond.wait(wait if wait is None else min(wait, 0.1))
+        return True
+
+    def close(self, timeout=None):
+        """ Flush, then stop the thread. """
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+def get_uploader(slack_file=SLACK_FILE):
+    """ The SlackUploader for slack_file, shared within a process. """
+    with _uploaders_lock:
+        if slack_file not in _uploaders:
+            _uploaders[slack_file] = SlackUploader(slack_file=slack_file)
+            # give queued posts a chance to go out before exiting
+            atexit.register(_uploaders[slack_file].close, 30.)
+        return _uploaders[slack_file]
@@ -0,0 +1,157 @@
+""" Per-candidate timing of each processing stage, written as
+one JSON line per stage so latency can be broken down later.
+
+    trace = stage_trace.Trace('/hdd/data/candidates/T3/trace.jsonl', c)
+    with trace.span('read'):
+        ...
+
+Each line has the candidate, stage, start time, duration,
+bytes read by the process during the stage, how far the
+stage raised the process's peak RSS (rss_growth, 0 if it
+stayed under an earlier peak) and its RSS at the end.
+Summarise with
+
+    poetry run grex-trace-summary /hdd/data/candidates/T3/trace.jsonl --hours 24
+
+which prints p50/p95/p99 durations per stage.
+"""
+import os
+import json
+import time
+import fcntl
+import argparse
+import resource
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+def bytes_read():
+    """ Bytes read by this process so far, or None
+    where /proc/self/io isn't available.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def max_rss():
+    """ Peak resident set size of this process so far in bytes. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def current_rss():
+    """ Resident set size of this process now in bytes, or
+    None where /proc/self/statm isn't available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return None
+
+
+class Trace:
+    """ Stage timings of one candidate.
+
+    Parameters
+    ----------
+    fn : str
+        JSONL trace file, shared by all processes. If None
+        nothing is written, so code can always take a trace.
+    cand : str
+        Candidate ID
+    """
+    def __init__(self, fn, cand=None):
+        self.fn = fn
+        self.cand = cand
+
+    def record(self, stage, seconds, t_start=None, **fields):
+        """ Write one stage's timing, with any extra fields. """
+        if self.fn is None:
+            return
+        entry = dict(cand=self.cand, stage=stage,
+                     time=time.time() - seconds if t_start is None else t_start,
+                     seconds=seconds, pid=os.getpid(), **fields)
+        with open(self.fn, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def span(self, stage, **fields):
+        """ Time the enclosed block as stage. """
+        t0 = time.time()
+        nbytes0 = bytes_read()
+        maxrss0 = max_rss()
+        try:
+            yield
+        finally:
+            nbytes1 = bytes_read()
+            self.record(stage, time.time() - t0, t_start=t0,
+                        bytes_read=None if nbytes0 is None else nbytes1 - nbytes0,
+                        rss_growth=max_rss() - maxrss0, rss=current_rss(), **fields)
+
+
+def read_trace(fn, start=None, end=None):
+    """ Trace lines as a DataFrame, optionally only the
+    stages started between unix times start and end.
+    """
+    with open(fn) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    df = pd.DataFrame(rows, columns=None if rows else ['cand', 'stage', 'time', 'seconds'])
+    if start is not None:
+        df = df[df['time'] >= start]
+    if end is not None:
+        df = df[df['time'] < end]
+    return df
+
+def summarize(df, quantiles=(0.5, 0.95, 0.99)):
+    """ Count and duration quantiles of each stage, plus mean
+    bytes read, and the largest RSS growth and RSS, where recorded.
+    """
+    out = {}
+    for stage, group in df.groupby('stage', sort=False):
+        seconds = group['seconds'].values
+        row = dict(n=len(group))
+        for q in quantiles:
+            row[f'p{q*100:g}'] = np.quantile(seconds, q)
+        if 'bytes_read' in group:
+            row['MB_read'] = group['bytes_read'].mean() / 1e6
+        if 'rss_growth' in group:
+            row['rss_growth_MB'] = group['rss_growth'].max() / 1e6
+        if 'rss' in group:
+            row['rss_MB'] = group['rss'].max() / 1e6
+        out[stage] = row
+    return pd.DataFrame.from_dict(out, orient='index')
+
+def _unix_time(s):
+    return pd.Timestamp(s).timestamp() if s is not None else None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="p50/p95/p99 of each T3 stage from a timing trace")
+    parser.add_argument('fn', help='Trace .jsonl file')
+    parser.add_argument('--start', help='Earliest stage start, e.g. 2024-05-28T00:00')
+    parser.add_argument('--end', help='Latest stage start')
+    parser.add_argument('--hours', type=float,
+                        help='Only the last this many hours, instead of --start')
+    args = parser.parse_args(argv)
+
+    start = _unix_time(args.start)
+    if args.hours is not None:
+        start = time.time() - args.hours * 3600
+    df = read_trace(args.fn, start=start, end=_unix_time(args.end))
+    print(f"{df['cand'].nunique()} candidates")
+    summary = summarize(df)
+    print(summary.to_string(float_format=lambda x: f"{x:.3f}"))
+
+    return summary
+
+if __name__ == '__main__':
+    main()
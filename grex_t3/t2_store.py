@@ -0,0 +1,427 @@
+""" A time-indexed store of the T2 cluster_output.csv.
+
+The CSV is tailed by byte offset into one columnar .npz
+file per MJD day, each sorted by mjds, so looking up the
+candidates around a trigger only touches a day or two of
+data however large the CSV has grown.
+
+    store = t2_store.get_store('/hdd/data/candidates/T2/cluster_output.csv')
+    store.update()
+    nearby = store.window(mjd, 60., dm_min=50.)
+
+Polling loops that only need the new rows each time, like
+coincidence.run_coincidencer, can use the lighter T2Tail,
+which keeps nothing on disk:
+
+    tail = t2_store.T2Tail('/hdd/data/candidates/T2/cluster_output.csv')
+    new = tail.read()
+"""
+import os
+import io
+import json
+import fcntl
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# types of the cluster_output.csv columns, nullable
+# integers so an empty field doesn't fail the read
+T2_DTYPES = {'snr': float, 'if': 'Int64', 'specnum': 'Int64', 'mjds': float,
+             'ibox': 'Int64', 'idm': 'Int64', 'dm': float, 'ibeam': 'Int64',
+             'cl': 'Int64', 'cntc': 'Int64', 'cntb': 'Int64', 'trigger': str}
+
+_stores = {}
+_tails = {}
+
+
+def _restart_reason(st, inode, offset):
+    """ Why a file being tailed must be read again from the
+    start, 'replaced' or 'truncated', or None.
+    """
+    if inode is not None and st.st_ino != inode:
+        return 'replaced'
+    if offset is not None and st.st_size < offset:
+        return 'truncated'
+    return None
+
+class T2Store:
+    """ Day-partitioned columnar copy of a T2 cluster_output.csv.
+
+    Each update writes the new rows of a day to a small delta
+    file next to the day's partition, rather than rewriting
+    the whole day, and once a day has max_deltas of them they
+    are merged back into its partition.
+
+    Parameters
+    ----------
+    fn_csv : str
+        The T2 cluster_output.csv
+    store_dir : str
+        Where partitions are kept, by default a cluster_store
+        directory next to the CSV
+    cache_days : int
+        Number of day partitions held in memory
+    max_deltas : int
+        Delta files a day may have before they are merged
+    """
+    def __init__(self, fn_csv, store_dir=None, cache_days=8, max_deltas=32):
+        self.fn_csv = fn_csv
+        if store_dir is None:
+            store_dir = os.path.join(os.path.dirname(os.path.abspath(fn_csv)),
+                                     'cluster_store')
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.cache_days = cache_days
+        self.max_deltas = max_deltas
+        self._days = OrderedDict()
+        self.state = self._load_state()
+
+    @property
+    def nrows(self):
+        """ Number of CSV rows ingested so far. """
+        return self.state['nrows']
+
+    @property
+    def columns(self):
+        return self.state['columns']
+
+    def _state_path(self):
+        return os.path.join(self.store_dir, 'state.json')
+
+    def _day_path(self, day):
+        return os.path.join(self.store_dir, f'mjd_{day:d}.npz')
+
+    def _delta_path(self, day, seq):
+        return os.path.join(self.store_dir, f'mjd_{day:d}.d{seq:04d}.npz')
+
+    def _load_state(self):
+        if os.path.exists(self._state_path()):
+            with open(self._state_path()) as f:
+                return json.load(f)
+        return dict(offset=0, nrows=0, columns=None, inode=None)
+
+    def _save_state(self):
+        tmp = self._state_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self._state_path())
+
+    def _empty(self):
+        return pd.DataFrame(columns=(self.columns or []) + ['row'])
+
+    def _files(self):
+        """ Partition and delta file names of each day. """
+        files = {}
+        for fn in sorted(os.listdir(self.store_dir)):
+            if fn.startswith('mjd_') and fn.endswith('.npz'):
+                day = int(fn[4:].split('.')[0])
+                files.setdefault(day, []).append(os.path.join(self.store_dir, fn))
+        return files
+
+    def days(self):
+        """ Sorted MJD days with a partition. """
+        return sorted(self._files())
+
+    def _load_day(self, day, files=None):
+        """ A day's partition and deltas, each a DataFrame
+        sorted by mjds. Files that have not changed since
+        they were last read come from memory.
+        """
+        if files is None:
+            files = self._files().get(day, [])
+        cached = self._days.pop(day, {})
+        parts = {}
+        for fn in files:
+            try:
+                mtime = os.stat(fn).st_mtime_ns
+                if fn in cached and cached[fn][0] == mtime:
+                    parts[fn] = cached[fn]
+                    continue
+                with np.load(fn) as cols:
+                    parts[fn] = (mtime, pd.DataFrame({col: cols[col] for col in cols.files}))
+            except FileNotFoundError:
+                # deltas merged away since the listing, the
+                # partition holds their rows
+                continue
+
+        self._days[day] = parts
+        while len(self._days) > self.cache_days:
+            self._days.popitem(last=False)
+
+        return [df for mtime, df in parts.values()]
+
+    def _save(self, fn, df):
+        cols = {}
+        for col in df.columns:
+            arr = df[col].to_numpy()
+            if arr.dtype == object:
+                arr = arr.astype(str)
+            cols[col] = arr
+        tmp = fn + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **cols)
+        os.replace(tmp, fn)
+
+    def _merge(self, day, files):
+        """ Fold a day's deltas into its partition. """
+        part = pd.concat(self._load_day(day, files), ignore_index=True)
+        part = part.drop_duplicates('row', ignore_index=True)
+        self._save(self._day_path(day), part.sort_values('mjds', kind='stable',
+                                                         ignore_index=True))
+        for fn in files:
+            if fn != self._day_path(day):
+                os.remove(fn)
+        self._days.pop(day, None)
+
+    def _append(self, new):
+        files = self._files()
+        days = np.floor(new['mjds'].values).astype(int)
+        for day in np.unique(days):
+            part = new.iloc[np.where(days == day)[0]]
+            part = part.sort_values('mjds', kind='stable', ignore_index=True)
+            day_files = files.get(day, [])
+            if len(day_files) == 0:
+                fn = self._day_path(day)
+            else:
+                deltas = [fn for fn in day_files if fn != self._day_path(day)]
+                seq = int(os.path.basename(deltas[-1]).split('.d')[1][:-4]) + 1 if deltas else 0
+                fn = self._delta_path(day, seq)
+            self._save(fn, part)
+            day_files = sorted(day_files + [fn])
+            if len(day_files) > self.max_deltas:
+                self._merge(day, day_files)
+
+    def update(self):
+        """ Ingest the rows appended to the CSV since the
+        last update. Only complete lines are read, so a row
+        being written by T2 is picked up next time. If the CSV
+        was replaced or truncated it is read again from its
+        header, numbering its rows on from those before.
+
+        Returns
+        -------
+        new : pandas.DataFrame
+            The new rows, with their CSV row number in 'row'
+        """
+        with open(os.path.join(self.store_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # another process may have moved the store on
+            self.state = self._load_state()
+            try:
+                st = os.stat(self.fn_csv)
+            except FileNotFoundError:
+                return self._empty()
+
+            reason = _restart_reason(st, self.state.get('inode'), self.state['offset'])
+            if reason is not None:
+                logging.warning(f"{self.fn_csv} was {reason}, reading it from the start")
+                self.state['offset'] = 0
+                self.state['columns'] = None
+            self.state['inode'] = st.st_ino
+
+            with open(self.fn_csv, 'rb') as f:
+                f.seek(self.state['offset'])
+                chunk = f.read()
+            end = chunk.rfind(b'\n') + 1
+            if end == 0:
+                self._save_state()
+                return self._empty()
+            chunk = chunk[:end]
+
+            if self.state['columns'] is None:
+                header, chunk = chunk.split(b'\n', 1)
+                self.state['columns'] = header.decode().strip().split(',')
+
+            if chunk.strip():
+                new = pd.read_csv(io.BytesIO(chunk), header=None,
+                                  names=self.columns)
+                new['row'] = self.nrows + np.arange(len(new))
+                self._append(new)
+            else:
+                new = self._empty()
+
+            self.state['offset'] += end
+            self.state['nrows'] += len(new)
+            self._save_state()
+
+        return new
+
+    def query(self, mjd_min=None, mjd_max=None, dm_min=None,
+              dm_max=None, beam=None):
+        """ Candidates within an MJD window, DM range and beam(s).
+        Any limit left as None is not applied.
+
+        Returns
+        -------
+        cands : pandas.DataFrame
+            Sorted by mjds
+        """
+        files = self._files()
+        days = sorted(files)
+        if mjd_min is not None:
+            days = [day for day in days if day >= np.floor(mjd_min)]
+        if mjd_max is not None:
+            days = [day for day in days if day <= np.floor(mjd_max)]
+
+        frames = []
+        for day in days:
+            for df in self._load_day(day, files[day]):
+                mjds = df['mjds'].values
+                i0 = 0 if mjd_min is None else np.searchsorted(mjds, mjd_min, 'left')
+                i1 = len(df) if mjd_max is None else np.searchsorted(mjds, mjd_max, 'right')
+                df = df.iloc[i0:i1]
+                mask = np.ones(len(df), dtype=bool)
+                if dm_min is not None:
+                    mask &= df['dm'].values >= dm_min
+                if dm_max is not None:
+                    mask &= df['dm'].values <= dm_max
+                if beam is not None:
+                    mask &= np.isin(df['ibeam'].values, beam)
+                frames.append(df[mask])
+
+        if len(frames) == 0:
+            return self._empty()
+
+        # a merge in another process can briefly show rows
+        # in both a partition and its deltas
+        cands = pd.concat(frames, ignore_index=True).drop_duplicates('row')
+        return cands.sort_values('mjds', kind='stable', ignore_index=True)
+
+    def window(self, mjd, seconds, **kwargs):
+        """ Candidates within seconds of mjd, see query. """
+        return self.query(mjd_min=mjd - seconds/86400.,
+                          mjd_max=mjd + seconds/86400., **kwargs)
+
+    def rows_since(self, nrow):
+        """ Candidates from CSV row nrow onwards, looking back
+        through the most recent days only.
+        """
+        files = self._files()
+        frames = []
+        for day in sorted(files)[::-1]:
+            parts = self._load_day(day, files[day])
+            frames += [df[df['row'].values >= nrow] for df in parts]
+            if all(len(df) == 0 for df in parts) or \
+               min(df['row'].values.min() for df in parts if len(df)) < nrow:
+                break
+
+        if len(frames) == 0:
+            return self._empty()
+
+        since = pd.concat(frames).drop_duplicates('row')
+        return since.sort_values('row', ignore_index=True)
+
+class T2Tail:
+    """ Reader of the rows appended to a T2 cluster_output.csv
+    since the last read, held in memory only.
+
+    The read offset and any incomplete last line are kept
+    between reads, so each byte is read once. If the CSV is
+    replaced (a new inode) or truncated, it is read again 
+    from its header.
+
+    Parameters
+    ----------
+    fn_csv : str
+        The T2 cluster_output.csv
+    from_start : bool
+        Return the rows already in the CSV on the first
+        read, rather than only those added after it
+    """
+    def __init__(self, fn_csv, from_start=False):
+        self.fn_csv = fn_csv
+        self.from_start = from_start
+        self.columns = None
+        # rows returned so far, numbering the new ones
+        self.nrows = 0
+        self._inode = None
+        self._offset = None
+        self._partial = b''
+
+    def _empty(self):
+        """ No rows, with the CSV's columns, or the usual T2
+        columns before its header has been read.
+        """
+        columns = self.columns or list(T2_DTYPES)
+        empty = {col: pd.Series(dtype=T2_DTYPES.get(col, object)) for col in columns}
+        empty['row'] = pd.Series(dtype=int)
+        return pd.DataFrame(empty)
+
+    def _restart(self, reason):
+        logging.warning(f"{self.fn_csv} was {reason}, reading it from the start")
+        self.columns = None
+        self._offset = 0
+        self._partial = b''
+
+    def _skip_existing(self, f, size):
+        """ Start after the last complete line already in the file. """
+        block = min(size, 2**20)
+        f.seek(size - block)
+        tail = f.read(block)
+        end = tail.rfind(b'\n') + 1
+        self._offset = size - block + end if end else 0
+        if self._offset > 0:
+            f.seek(0)
+            self.columns = f.readline().decode().strip().split(',')
+
+    def read(self):
+        """ Rows completed since the last read.
+
+        Returns
+        -------
+        new : pandas.DataFrame
+            The new rows, typed by T2_DTYPES, with their 
+            number since this reader started in 'row'
+        """
+        try:
+            st = os.stat(self.fn_csv)
+        except FileNotFoundError:
+            return self._empty()
+
+        reason = _restart_reason(st, self._inode, self._offset)
+        if reason is not None:
+            self._restart(reason)
+        self._inode = st.st_ino
+
+        with open(self.fn_csv, 'rb') as f:
+            if self._offset is None:
+                if self.from_start:
+                    self._offset = 0
+                else:
+                    self._skip_existing(f, st.st_size)
+            f.seek(self._offset)
+            chunk = f.read()
+        self._offset += len(chunk)
+
+        chunk = self._partial + chunk
+        end = chunk.rfind(b'\n') + 1
+        chunk, self._partial = chunk[:end], chunk[end:]
+
+        if self.columns is None and end > 0:
+            header, chunk = chunk.split(b'\n', 1)
+            self.columns = header.decode().strip().split(',')
+        if not chunk.strip():
+            return self._empty()
+
+        dtype = {col: T2_DTYPES[col] for col in self.columns if col in T2_DTYPES}
+        new = pd.read_csv(io.BytesIO(chunk), header=None,
+                          names=self.columns, dtype=dtype)
+        new['row'] = self.nrows + np.arange(len(new))
+        self.nrows += len(new)
+        return new
+
+def get_store(fn_csv, store_dir=None):
+    """ The T2Store for fn_csv, shared within a process. """
+    key = (os.path.abspath(fn_csv), store_dir)
+    if key not in _stores:
+        _stores[key] = T2Store(fn_csv, store_dir=store_dir)
+    return _stores[key]
+
+def get_tail(fn_csv):
+    """ The T2Tail for fn_csv, shared within a process. """
+    key = os.path.abspath(fn_csv)
+    if key not in _tails:
+        _tails[key] = T2Tail(fn_csv)
+    return _tails[key]
@@ -0,0 +1,213 @@
+""" A bounded pool of worker processes fed through a queue,
+used by T3_monitor so a burst of dumps is processed
+concurrently instead of one candidate at a time.
+
+    pool = worker_pool.WorkerPool(process_candidate, nworker=2, max_queued=8)
+    pool.submit('240321aazm')   # blocks while max_queued jobs are waiting
+    ...
+    pool.close()
+
+Each worker is a separate process, so a crash or a leak
+while processing one candidate can't take the monitor down.
+Jobs wait in the parent and are handed to an idle worker
+through its own queue, so the pool always knows which job
+each worker holds. If one dies (e.g. killed for running out
+of memory) poll reports that job as failed with an error 
+starting with CRASHED, and starts a new worker in its place.
+"""
+import os
+import time
+import queue
+import logging
+import collections
+import multiprocessing as mp
+
+CRASHED = 'worker died'
+
+
+def _worker(func, jobs, results):
+    pid = os.getpid()
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        t0 = time.time()
+        try:
+            func(*job)
+            err = None
+        except Exception as e:
+            logging.error("Error processing %s: %s", job, str(e))
+            err = repr(e)
+        results.put((pid, job, err, time.time() - t0))
+
+
+class WorkerPool:
+    """ Run func(*job) for each submitted job in nworker processes.
+
+    Parameters
+    ----------
+    func : callable
+        Module-level function run on each job
+    nworker : int
+        Number of worker processes
+    max_queued : int
+        Jobs waiting for a worker before submit blocks,
+        which is the backpressure on the caller
+    start_method : str
+        multiprocessing start method. forkserver, as forking
+        a process already running dask or numba threads can 
+        deadlock the child.
+    """
+    def __init__(self, func, nworker=2, max_queued=8, start_method='forkserver'):
+        self._ctx = mp.get_context(start_method)
+        self.func = func
+        self.nworker = nworker
+        self.max_queued = max_queued
+        # jobs not yet handed to a worker
+        self.waiting = collections.deque()
+        self.results = self._ctx.SimpleQueue()
+        # job queue of each worker, and the job and start time
+        # of each busy one, by pid
+        self._inbox = {}
+        self.inflight = {}
+        # finished while submit was waiting for room, for poll
+        self._done = []
+        self._closed = False
+        self.workers = [self._start_worker() for _ in range(nworker)]
+        self.nsubmitted = 0
+        self.nfinished = 0
+        self.nrestarted = 0
+
+    def _start_worker(self):
+        jobs = self._ctx.SimpleQueue()
+        p = self._ctx.Process(target=_worker, args=(self.func, jobs, self.results),
+                              daemon=True)
+        p.start()
+        self._inbox[p.pid] = jobs
+        return p
+
+    @property
+    def pending(self):
+        """ Jobs submitted but not yet finished. """
+        return self.nsubmitted - self.nfinished
+
+    def _dispatch(self):
+        """ Hand waiting jobs to idle workers. """
+        if self._closed:
+            return
+        for p in self.workers:
+            if not self.waiting:
+                break
+            if p.pid not in self.inflight and p.is_alive():
+                job = self.waiting.popleft()
+                self.inflight[p.pid] = (job, time.time())
+                self._inbox[p.pid].put(job)
+
+    def submit(self, *job, timeout=None):
+        """ Queue a job, waiting up to timeout seconds (forever
+        if None) while max_queued jobs are already waiting for
+        a worker. Raises queue.Full if there is no room.
+        """
+        t_end = None if timeout is None else time.time() + timeout
+        self._dispatch()
+        while len(self.waiting) >= self.max_queued:
+            if t_end is not None and time.time() >= t_end:
+                raise queue.Full
+            time.sleep(0.05)
+            self._done += self._collect()
+            self._dispatch()
+        self.waiting.append(job)
+        self.nsubmitted += 1
+        self._dispatch()
+
+    def _read(self):
+        """ Finished jobs already sent by live workers. """
+        done = []
+        while not self.results.empty():
+            pid, job, err, dt = self.results.get()
+            # a job of a worker already reaped was reported then
+            if self.inflight.pop(pid, None) is not None:
+                done.append((job, err, dt))
+        return done
+
+    def _reap(self):
+        """ Replace dead workers, returning their jobs as failed. """
+        done = []
+        if self._closed:
+            return done
+        dead = [ii for ii, p in enumerate(self.workers) if not p.is_alive()]
+        if dead:
+            # a worker may have sent its result just before exiting
+            done += self._read()
+        for ii in dead:
+            p = self.workers[ii]
+            err = f"{CRASHED} (pid {p.pid}, exit code {p.exitcode})"
+            logging.error(f"Worker {err}, starting a new one.")
+            if p.pid in self.inflight:
+                job, t0 = self.inflight.pop(p.pid)
+                done.append((job, err, time.time() - t0))
+            self._inbox.pop(p.pid, None)
+            self.workers[ii] = self._start_worker()
+            self.nrestarted += 1
+        return done
+
+    def _collect(self):
+        """ Finished and crashed jobs, with dead workers
+        replaced and waiting jobs handed on.
+        """
+        done = self._read() + self._reap()
+        self._dispatch()
+        self.nfinished += len(done)
+        return done
+
+    def poll(self, timeout=0):
+        """ Jobs finished since the last poll, as a list of
+        (job, error or None, seconds). Waits up to timeout
+        seconds for the first one. Dead workers are replaced.
+        """
+        done, self._done = self._done, []
+        t_end = time.time() + timeout
+        while True:
+            done += self._collect()
+            if done or time.time() >= t_end:
+                break
+            time.sleep(min(0.05, max(0., t_end - time.time())))
+        return done
+
+    def join(self, timeout=None):
+        """ Wait for every submitted job to finish.
+
+        Returns
+        -------
+        done : list
+            See poll
+        """
+        done = []
+        t0 = time.time()
+        while self.pending > 0:
+            if timeout is not None and time.time() - t0 > timeout:
+                break
+            done += self.poll(timeout=1.)
+        return done
+
+    def close(self, wait=True):
+        """ Stop the workers, after the queued jobs if wait. """
+        if wait:
+            while self.waiting:
+                self._done += self._collect()
+                time.sleep(0.05)
+            self._closed = True
+            for p in self.workers:
+                self._inbox[p.pid].put(None)
+            for p in self.workers:
+                p.join()
+        else:
+            self._closed = True
+            for p in self.workers:
+                p.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,25 @@
+import numpy as np
+import xarray
+import pytest
+
+
+def make_voltage_dump(fn, ntime=4096, nfreq=64, tsamp=8.192e-6, mjd0=60000., seed=0):
+    """ Write a small synthetic grex_dump-*.nc file
+    with int8 voltages of shape (time, freq, pol, reim).
+    """
+    rng = np.random.default_rng(seed)
+    voltages = rng.integers(-20, 20, size=(ntime, nfreq, 2, 2), dtype=np.int8)
+    ds = xarray.Dataset(
+        {"voltages": (("time", "freq", "pol", "reim"), voltages)},
+        coords={"time": mjd0 + np.arange(ntime) * tsamp / 86400.,
+                "freq": np.linspace(1530., 1280., nfreq),
+                "pol": ["a", "b"],
+                "reim": ["real", "imaginary"]})
+    ds.to_netcdf(fn)
+    return voltages
+
+
+@pytest.fixture
+def voltage_dump_factory():
+    """ make_voltage_dump(fn, ntime, nfreq, tsamp, mjd0, seed) """
+    return make_voltage_dump
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+# T3_manager needs the full T3 environment
+pytest.importorskip("dask.distributed")
+pytest.importorskip("sigpyproc")
+pytest.importorskip("dsautils")
+
+from grex_t3 import pol_tools
+
+
+class Lock:
+    """ Enough of a dask Lock for update_json. """
+    def acquire(self, timeout=None):
+        return True
+
+    def release(self):
+        pass
+
+
+def test_run_pol(tmp_path, monkeypatch, voltage_dump_factory):
+    # T3_manager logs to logs/ in the working directory
+    monkeypatch.chdir(tmp_path)
+    from grex_t3 import T3_manager
+
+    voltdir, outdir = tmp_path / "voltages", tmp_path / "output"
+    voltdir.mkdir()
+    outdir.mkdir()
+    monkeypatch.setattr(T3_manager, 'VOLTAGE_PATH', str(voltdir))
+    monkeypatch.setattr(T3_manager, 'OUTPUT_PATH', str(outdir))
+
+    trigname = '240321aazm'
+    voltages = voltage_dump_factory(str(voltdir / f"grex_dump-{trigname}.nc"))
+    dd = T3_manager.run_pol(dict(trigname=trigname, snr=12.), lock=Lock())
+
+    assert dd['voltfile'] == str(voltdir / f"grex_dump-{trigname}.nc")
+    assert dd['polfile'] == str(outdir / f"{trigname}_iquv.h5")
+    data, header = pol_tools.read_stokes_product(dd['polfile'])
+    assert header['stokes'] == 'IQUV'
+    nt = T3_manager.POL_TIMEDOWNSAMPLE
+    iquv = pol_tools.stokes_from_voltages(voltages)
+    np.testing.assert_allclose(data, iquv.reshape(-1, nt, *iquv.shape[1:]).mean(1), rtol=1e-5)
+    assert os.path.exists(outdir / f"{trigname}.json")
+
+    # no dump: nothing built, and the candidate is still passed on
+    dd = T3_manager.run_pol(dict(trigname='240321zzzz'), lock=Lock())
+    assert 'polfile' not in dd
+
+
+class Client:
+    """ Records what is submitted, as a dask Client would run it. """
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args, priority=0, **kwargs):
+        self.submitted.append((func, args[0], priority))
+        return len(self.submitted)
+
+
+def test_submit_filplot_priority(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from grex_t3 import T3_manager
+
+    fn_coincidence = tmp_path / "coincidence.csv"
+    fn_coincidence.write_text("trigger,mjd\n240321aaaa,60000.1\n")
+    monkeypatch.setattr(T3_manager, 'FN_COINCIDENCE', str(fn_coincidence))
+
+    client = Client()
+    for trigname, snr, dm in [('240321aaab', 20., 30.), ('240321aaaa', 9., 300.),
+                              ('240321aaac', 12., 300.)]:
+        T3_manager.submit_filplot({trigname: dict(snr=snr, dm=dm, ibeam=0)}, client=client)
+
+    priority = {list(a.keys())[0]: p for func, a, p in client.submitted}
+    assert all(func is T3_manager.run_filplot for func, a, p in client.submitted)
+    # coincident first, then the high-DM one, then the brighter low-DM one
+    assert priority['240321aaaa'] > priority['240321aaac'] > priority['240321aaab']
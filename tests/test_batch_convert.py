@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+from your import Your
+
+from grex_t3 import batch_convert
+from grex_t3 import candproc_tools
+
+NTIME = 4096
+NFREQ = 64
+
+
+def test_convert_dumps(tmp_path, voltage_dump_factory):
+    files = []
+    for ii in range(2):
+        fn = str(tmp_path / f"grex_dump-{ii}.nc")
+        voltage_dump_factory(fn, ntime=NTIME, nfreq=NFREQ, seed=ii)
+        files.append(fn)
+    outdir = str(tmp_path / "fil")
+
+    stats = batch_convert.convert_dumps(files, outdir, timedownsample=4,
+                                        nproc=2, memory_budget=1e9)
+    assert len(stats) == 2
+    for fn in files:
+        fnout = batch_convert.output_path(fn, outdir, 4, 1)
+        data = Your(fnout).get_data(0, NTIME // 4)
+        ref = candproc_tools.read_voltage_data(fn, timedownsample=4,
+                                               nbit='float32')
+        assert data.shape == (NTIME // 4, NFREQ)
+        np.testing.assert_allclose(data, ref.values, rtol=1e-6)
+
+    # a rerun skips finished files and redoes interrupted ones
+    fnout = batch_convert.output_path(files[1], outdir, 4, 1)
+    os.rename(fnout, fnout + '.part')
+    stats = batch_convert.convert_dumps(files, outdir, timedownsample=4,
+                                        nproc=2, memory_budget=1e9)
+    assert [st['fn_vol'] for st in stats] == [files[1]]
+    assert os.path.exists(fnout) and not os.path.exists(fnout + '.part')
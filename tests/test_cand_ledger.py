@@ -0,0 +1,53 @@
+import os
+import time
+
+from grex_t3 import cand_ledger
+
+
+def test_ledger(tmp_path):
+    fn = str(tmp_path / "T3" / "ledger.jsonl")
+    ledger = cand_ledger.Ledger(fn)
+    assert ledger.status('240321aazm') is None
+
+    png = tmp_path / "grex_cand240321aazm.png"
+    png.write_bytes(b'png')
+    ledger.record('240321aazm', 'failed', error='no json')
+    assert ledger.status('240321aazm') == 'failed'
+    ledger.record('240321aazm', 'done', products=dict(png=str(png)))
+    assert ledger.is_done('240321aazm')
+
+    # state survives a restart, and needs the products to still be there
+    ledger = cand_ledger.Ledger(fn)
+    assert ledger.status('240321aazm') == 'done'
+    os.remove(png)
+    assert not ledger.is_done('240321aazm')
+
+
+def test_unprocessed_dumps(tmp_path):
+    mon_dir = tmp_path / "voltages"
+    mon_dir.mkdir()
+    old = time.time() - 100
+    for ii, c in enumerate(['240321aaaa', '240321bbbb', '240321cccc', '240321dddd']):
+        fn = mon_dir / f"grex_dump-{c}.nc"
+        fn.write_bytes(b'\0')
+        if c != '240321dddd':   # still being written
+            os.utime(fn, (old - ii, old - ii))
+
+    ledger = cand_ledger.Ledger(str(tmp_path / "ledger.jsonl"))
+    ledger.record('240321bbbb', 'done')
+    ledger.record('240321cccc', 'dropped')
+
+    # recent dumps are included unless asked otherwise
+    todo = cand_ledger.unprocessed_dumps(str(mon_dir), ledger)
+    assert [c for c, _ in todo] == ['240321cccc', '240321aaaa', '240321dddd']
+    assert todo[0][1] == str(mon_dir / "grex_dump-240321cccc.nc")
+    todo = cand_ledger.unprocessed_dumps(str(mon_dir), ledger, min_age=10.)
+    assert [c for c, _ in todo] == ['240321cccc', '240321aaaa']
+
+    # aaaa was plotted before there was a ledger
+    (tmp_path / "cand240321aaaa.fil").write_bytes(b'fil')
+    (tmp_path / "grex_cand240321aaaa.png").write_bytes(b'png')
+    def products(c):
+        return dict(fil=str(tmp_path / f"cand{c}.fil"), png=str(tmp_path / f"grex_cand{c}.png"))
+    todo = cand_ledger.unprocessed_dumps(str(mon_dir), ledger, products=products)
+    assert [c for c, _ in todo] == ['240321cccc', '240321dddd']
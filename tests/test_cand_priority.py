@@ -0,0 +1,31 @@
+import pandas as pd
+
+from grex_t3 import cand_priority
+
+
+def test_candidate_score():
+    assert cand_priority.candidate_score(10., 20.) == 10.
+    assert cand_priority.candidate_score(10., 200.) == 20.
+    assert cand_priority.candidate_score(10., 200., coincident=True) == 120.
+    assert cand_priority.candidate_score(10., 20., snr_weight=2., dm_thresh=10.) == 30.
+
+
+def test_candidate_queue():
+    queue = cand_priority.CandidateQueue(max_backlog=4)
+    for ii, score in enumerate([8., 9., 8., 30.]):
+        assert queue.push('rfi%d' % ii, score) == []
+    assert queue.peek_score() == 30.
+
+    # a full backlog drops the lowest, latest first among equals
+    assert queue.push('frb', 120.) == [('rfi2', 8.)]
+    assert queue.push('rfi4', 1.) == [('rfi4', 1.)]
+
+    assert [queue.pop() for _ in range(len(queue))] == ['frb', 'rfi3', 'rfi1', 'rfi0']
+
+
+def test_coincident_triggers(tmp_path):
+    fn = str(tmp_path / "coincidence.csv")
+    assert cand_priority.coincident_triggers(fn) == set()
+    pd.DataFrame({'mjds': [60000.1, 60000.2], 'trigger': ['240321aazm', '240321abcd'],
+                  'STARECAND': ['a', 'b']}).to_csv(fn, index=False)
+    assert cand_priority.coincident_triggers(fn) == {'240321aazm', '240321abcd'}
@@ -0,0 +1,229 @@
+import os
+import tracemalloc
+
+import dask
+import numpy as np
+import xarray
+import pytest
+from your import Your
+
+from grex_t3 import candproc_tools
+
+NTIME = 4096
+NFREQ = 64
+TSAMP = 8.192e-6
+MJD0 = 60000.
+
+
+def stokesi_reference(voltages):
+    v = voltages.astype(np.float64)
+    return (v**2).sum(axis=(2, 3))
+
+
+@pytest.fixture
+def dump(tmp_path, voltage_dump_factory):
+    fn = str(tmp_path / "grex_dump-test.nc")
+    voltages = voltage_dump_factory(fn, ntime=NTIME, nfreq=NFREQ, tsamp=TSAMP, mjd0=MJD0)
+    return fn, voltages
+
+
+def test_voltage_time_window():
+    times = MJD0 + np.arange(100) * TSAMP / 86400.
+    assert candproc_tools.voltage_time_window(times) == slice(0, 100)
+    assert candproc_tools.voltage_time_window(times, half_width=10) == slice(40, 60)
+    assert candproc_tools.voltage_time_window(times, center_sample=5,
+                                              half_width=10) == slice(0, 15)
+    assert candproc_tools.voltage_time_window(times, center_mjd=times[90],
+                                              half_width=20) == slice(70, 100)
+
+
+def test_read_voltage_data(dump):
+    fn, voltages = dump
+    stokesi = candproc_tools.read_voltage_data(fn, nbit='float32')
+    assert stokesi.dims == ('time', 'freq')
+    np.testing.assert_allclose(stokesi.values, stokesi_reference(voltages))
+
+
+def test_read_voltage_data_window(dump):
+    fn, voltages = dump
+    stokesi, t0, dur = candproc_tools.read_voltage_data(
+        fn, nbit='float32', verbose=True, center_sample=1000, half_width=256)
+    assert stokesi.shape == (512, NFREQ)
+    np.testing.assert_allclose(stokesi.values,
+                               stokesi_reference(voltages[744:1256]))
+    np.testing.assert_allclose(t0, MJD0 + 744 * TSAMP / 86400.)
+
+
+def test_read_voltage_data_downsample(dump):
+    fn, voltages = dump
+    full = candproc_tools.read_voltage_data(fn)
+    stokesi = candproc_tools.read_voltage_data(fn, timedownsample=16,
+                                               freqdownsample=3)
+    ref = full.coarsen(time=16, boundary='trim').mean()
+    ref = ref.coarsen(freq=3, boundary='trim').mean()
+    assert stokesi.dtype == ref.dtype
+    np.testing.assert_array_equal(stokesi.values, ref.values)
+    np.testing.assert_array_equal(stokesi.time.values, ref.time.values)
+    np.testing.assert_array_equal(stokesi.freq.values, ref.freq.values)
+
+
+def test_read_voltage_data_downsample_memory(tmp_path, voltage_dump_factory):
+    # peak memory should follow the output, not the full-resolution dump
+    fn = str(tmp_path / "grex_dump-big.nc")
+    ntime = 16 * NTIME
+    voltage_dump_factory(fn, ntime=ntime, nfreq=NFREQ, tsamp=TSAMP, mjd0=MJD0)
+    full_nbytes = ntime * NFREQ * 4
+
+    tracemalloc.start()
+    stokesi = candproc_tools.read_voltage_data(fn, timedownsample=32, nbit='float32')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert stokesi.shape == (ntime // 32, NFREQ)
+    assert stokesi.dtype == np.float32
+    assert peak < full_nbytes / 2
+
+
+def test_stokesi_from_voltages():
+    rng = np.random.default_rng(1)
+    voltages = rng.integers(-128, 128, size=(64, 16, 2, 2), dtype=np.int8)
+    out = np.zeros((64, 16), dtype=np.float32)
+    candproc_tools.stokesi_from_voltages(voltages, out=out)
+    np.testing.assert_array_equal(out, stokesi_reference(voltages))
+
+
+def test_proc_cand_array_matches_fil(dump, tmp_path):
+    fn, voltages = dump
+    stokesi = candproc_tools.read_voltage_data(fn, nbit='float32')
+    fnfil = str(tmp_path / "test.fil")
+    candproc_tools.write_sigproc(fnfil, stokesi, t_start=MJD0)
+
+    cand_fil = candproc_tools.read_proc_fil(fnfil, dm=0, tstart=0,
+                                            tstop=NTIME*TSAMP,
+                                            zero_topbottom=True)
+    cand_mem = candproc_tools.proc_cand_array(stokesi, dm=0, t_start=MJD0,
+                                              zero_topbottom=True)
+    assert cand_mem.data.shape == (NTIME, NFREQ)
+    np.testing.assert_allclose(cand_mem.chan_freqs, cand_fil.chan_freqs)
+    np.testing.assert_allclose(cand_mem.tsamp, cand_fil.tsamp, rtol=1e-6)
+    np.testing.assert_array_equal(cand_mem.data[:cand_fil.data.shape[0]],
+                                  cand_fil.data)
+
+    # ~100 sample sweep, compare away from the wrapped edges
+    cand_fil.dm, cand_mem.dm = 1., 1.
+    cand_fil.dedisperse(target='CPU')
+    cand_mem.dedisperse(target='CPU')
+    np.testing.assert_array_equal(cand_mem.dedispersed[256:-256],
+                                  cand_fil.dedispersed[256:-255])
+
+
+def test_sigproc_writer_chunks(tmp_path):
+    data = np.random.default_rng(3).normal(size=(300, NFREQ)).astype(np.float32)
+    fnfil = str(tmp_path / "chunks.fil")
+    with candproc_tools.SigprocWriter(fnfil, fch1=1530., foff=-1., nchans=NFREQ,
+                                      tsamp=TSAMP, tstart=MJD0) as writer:
+        # out of order, as dask.array.store may deliver them
+        writer[100:300, 0:NFREQ] = data[100:]
+        writer.write(data[:100], start=0)
+        assert writer.nsamples == 300
+        np.testing.assert_allclose(writer.tstop, MJD0 + 300 * TSAMP / 86400.)
+
+    fil = Your(fnfil)
+    assert fil.your_header.nspectra == 300
+    np.testing.assert_array_equal(fil.get_data(0, 300), data)
+
+
+def test_read_voltage_data_to_fil(dump, tmp_path):
+    fn, voltages = dump
+    fnfil = str(tmp_path / "stream.fil")
+    out = candproc_tools.read_voltage_data(fn, timedownsample=8, fnfilout=fnfil)
+    assert out == fnfil
+    ref = candproc_tools.read_voltage_data(fn, timedownsample=8)
+    fil = Your(fnfil)
+    np.testing.assert_allclose(fil.get_data(0, NTIME // 8), ref.values, rtol=1e-6)
+    np.testing.assert_allclose(fil.your_header.tstart, MJD0)
+    # MJD time stamps are only good to ~1e-6 s
+    np.testing.assert_allclose(fil.your_header.tsamp, 8 * TSAMP, rtol=1e-4)
+
+
+@pytest.mark.parametrize("nbits", [8, 16])
+def test_scaled_sigproc_roundtrip(dump, tmp_path, nbits):
+    fn, voltages = dump
+    stokesi = candproc_tools.read_voltage_data(fn, nbit='float32')
+    fn32 = str(tmp_path / "cand32.fil")
+    fnq = str(tmp_path / f"cand{nbits}.fil")
+    candproc_tools.write_sigproc(fn32, stokesi, t_start=MJD0)
+    candproc_tools.write_sigproc(fnq, stokesi, t_start=MJD0, nbits=nbits)
+
+    data32, header32 = candproc_tools.read_sigproc(fn32)
+    data, header = candproc_tools.read_sigproc(fnq)
+    np.testing.assert_array_equal(data32, stokesi.values)
+    assert header['nbits'] == nbits and header['nchans'] == NFREQ
+    assert os.path.getsize(fnq) < os.path.getsize(fn32) * nbits / 32 + 1024
+
+    # within half a quantization step of each channel, plus float32 rounding,
+    # except the few samples clipped at the robust limits
+    with np.load(candproc_tools.scales_path(fnq)) as scales:
+        scale, offset = scales['scale'], scales['offset']
+    top = offset + scale * (2**nbits - 1)
+    inside = (stokesi.values >= offset) & (stokesi.values <= top)
+    assert inside.mean() > 0.999
+    assert np.all(np.abs(data - stokesi.values)[inside] <= 0.5 * np.broadcast_to(scale, data.shape)[inside] + 1e-3)
+    np.testing.assert_allclose(data[~inside], np.clip(stokesi.values, offset, top)[~inside],
+                               rtol=1e-5)
+
+    sub, _ = candproc_tools.read_sigproc(fnq, start=100, nsamp=50)
+    np.testing.assert_array_equal(sub, data[100:150])
+
+    # without the sidecar the integers can't be rescaled
+    os.remove(candproc_tools.scales_path(fnq))
+    with pytest.raises(FileNotFoundError):
+        candproc_tools.read_sigproc(fnq)
+    raw, _ = candproc_tools.read_sigproc(fnq, unscaled=True)
+    assert raw.max() <= 2**nbits - 1
+
+
+def test_channel_scales_ignore_spikes():
+    rng = np.random.default_rng(2)
+    data = rng.normal(100., 1., size=(4096, 4)).astype(np.float32)
+    data[10, 0] = 1e6
+    data[:, 3] = 5.
+    scale, offset = candproc_tools.channel_scales(data, 8)
+    # the spike doesn't set the step of its channel, min to max would be ~4000
+    assert scale[0] < 16. / 255 and scale[3] == 1. and offset[3] == 5.
+    q = candproc_tools.quantize_spectra(data, scale, offset, 8)
+    assert q[10, 0] == 255
+
+
+def test_read_voltage_data_rfi_clean(tmp_path, voltage_dump_factory):
+    fn = str(tmp_path / "grex_dump-rfi.nc")
+    voltages = voltage_dump_factory(str(tmp_path / "grex_dump-test.nc"), ntime=NTIME,
+                                    nfreq=NFREQ, tsamp=TSAMP, mjd0=MJD0)
+    # a noisy channel and a broadband burst
+    voltages[:, 10] = np.random.default_rng(1).integers(-127, 127, size=(NTIME, 2, 2))
+    voltages[3000:3004] = 100
+    with xarray.open_dataset(str(tmp_path / "grex_dump-test.nc")) as ds:
+        ds.assign(voltages=(ds.voltages.dims, voltages)).to_netcdf(fn)
+
+    # with only 64 channels one outlier can't reach 10 sigma
+    stokesi = candproc_tools.read_voltage_data(fn, nbit='float32',
+                                               rfi_clean=dict(sigma_thresh_freq=5.))
+    mask = stokesi.rfi_mask.values
+    assert mask[:, 10].all() and mask[3000:3004].all()
+    assert mask.mean() < 0.1
+    assert np.isfinite(stokesi.values).all()
+
+    ref = stokesi_reference(voltages)
+    np.testing.assert_allclose(stokesi.values[~mask], ref[~mask])
+    # flagged samples are set to their channel's clean mean within the chunk
+    chunk = slice(2048, 4096)
+    good = ~mask[chunk, 0]
+    np.testing.assert_allclose(stokesi.values[3000, 0], ref[chunk, 0][good].mean(),
+                               rtol=1e-5)
+
+    # the flags travel through the graph, so a process pool gives the same
+    with dask.config.set(scheduler='processes', num_workers=2):
+        stokesi_mp = candproc_tools.read_voltage_data(fn, nbit='float32',
+                                                      rfi_clean=dict(sigma_thresh_freq=5.))
+    np.testing.assert_array_equal(stokesi_mp.rfi_mask.values, mask)
+    np.testing.assert_array_equal(stokesi_mp.values, stokesi.values)
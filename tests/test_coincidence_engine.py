@@ -0,0 +1,81 @@
+import numpy as np
+
+from grex_t3 import coincidence_engine
+
+
+def brute_pairs(mjd_a, mjd_b, t_thresh_sec, dm_a, dm_b, dm_thresh, dm_frac):
+    pairs = set()
+    for ii in range(len(mjd_a)):
+        dt = np.abs(mjd_a[ii] - mjd_b) * 86400
+        abs_diff = np.abs(dm_a[ii] - dm_b)
+        frac_diff = abs_diff / (0.5 * (dm_a[ii] + dm_b))
+        for jj in np.where((dt < t_thresh_sec) & ((abs_diff < dm_thresh) | (frac_diff < dm_frac)))[0]:
+            pairs.add((ii, jj))
+    return pairs
+
+
+def test_match_pairs_brute_force():
+    rng = np.random.default_rng(1)
+    # ~1 candidate per second for half an hour, unsorted
+    mjd_a = 60000. + rng.uniform(0, 1800, 2000) / 86400.
+    mjd_b = 60000. + rng.uniform(0, 1800, 1500) / 86400.
+    dm_a = rng.uniform(10, 1000, len(mjd_a))
+    dm_b = rng.uniform(10, 1000, len(mjd_b))
+
+    ia, ib = coincidence_engine.match_pairs(mjd_a, mjd_b, 2.0, dm_a, dm_b,
+                                            dm_thresh=50., dm_frac=0.1)
+    assert len(ia) > 0 and np.all(np.diff(ia) >= 0)
+    assert set(zip(ia, ib)) == brute_pairs(mjd_a, mjd_b, 2.0, dm_a, dm_b, 50., 0.1)
+    assert len(set(zip(ia, ib))) == len(ia)
+
+    # no DM cut, and a window with nothing in it
+    ia, ib = coincidence_engine.match_pairs(mjd_a, mjd_b, 2.0)
+    assert set(zip(ia, ib)) == brute_pairs(mjd_a, mjd_b, 2.0, dm_a, dm_b, np.inf, 0)
+    ia, ib = coincidence_engine.match_pairs(mjd_a + 1, mjd_b, 2.0)
+    assert len(ia) == 0 and len(ib) == 0
+
+
+def test_best_match():
+    mjd_a = 60000. + np.array([0., 10., 20.]) / 86400.
+    mjd_b = 60000. + np.array([10.2, 0.1, 9.9, 0.3, 10.1]) / 86400.
+    snr_b = np.array([8., 12., 20., 12., 20.])
+    ia, ib = coincidence_engine.match_pairs(mjd_a, mjd_b, 0.5)
+    ia, ib = coincidence_engine.best_match(ia, ib, snr_b)
+    # equal S/N goes to the lower index, a[2] has no match
+    assert list(ia) == [0, 1] and list(ib) == [1, 2]
+
+
+def test_cluster_stations():
+    rng = np.random.default_rng(2)
+    nstation = 4
+    # events at 100 s seen by every station, at 200 s by 0 and 2
+    # (and 3, with the wrong DM), and at 300 s by 1 only
+    events = [(100., 500., [0, 1, 2, 3]), (200., 300., [0, 2]),
+              (200.01, 400., [3]), (300., 800., [1])]
+    mjds, dms = [], []
+    for ss in range(nstation):
+        t = [t + rng.uniform(-0.05, 0.05) for t, _, stations in events if ss in stations]
+        dm = [dm + rng.uniform(-2, 2) for _, dm, stations in events if ss in stations]
+        # background candidates after the events, in separate hours
+        t = np.concatenate([t, 3600. * (ss + 1) + rng.uniform(0, 3600, 200)])
+        dm = np.concatenate([dm, rng.uniform(10, 1000, 200)])
+        order = rng.permutation(len(t))
+        mjds.append(60000. + t[order] / 86400.)
+        dms.append(dm[order])
+
+    members = coincidence_engine.cluster_stations(mjds, 0.25, dms, dm_thresh=5.)
+    assert list(members['cluster'].unique()) == [0, 1]
+    c0 = members[members['cluster'] == 0]
+    assert sorted(c0['station']) == [0, 1, 2, 3] and set(c0['nstation']) == {4}
+    for ss, ii, mjd in members[['station', 'index', 'mjd']].itertuples(index=False):
+        assert mjds[ss][ii] == mjd
+    c1 = members[members['cluster'] == 1]
+    assert sorted(c1['station']) == [0, 2]
+    assert np.all(np.abs(c1['mjd'] - (60000. + 200. / 86400)) < 0.1 / 86400)
+
+    members = coincidence_engine.cluster_stations(mjds, 0.25, dms, dm_thresh=5.,
+                                                  min_stations=3)
+    assert len(members) == 4
+    # without the DM cut station 3's 200 s candidate joins
+    members = coincidence_engine.cluster_stations(mjds, 0.25, min_stations=3)
+    assert sorted(members[members['cluster'] == 1]['station']) == [0, 2, 3]
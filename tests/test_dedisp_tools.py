@@ -0,0 +1,113 @@
+import numpy as np
+
+from your.utils.misc import _decimate
+
+from grex_t3 import dedisp_tools
+from grex_t3 import candproc_tools
+
+NTIME = 2048
+NFREQ = 128
+TSAMP = 8.192e-6
+
+
+def make_cand(dm=10., seed=0):
+    # keeps every shift below NTIME; YOUR CPU does not wrap larger shifts
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=(NTIME, NFREQ)).astype(np.float32)
+    return candproc_tools.ArrayCandidate(data, fch1=1530., foff=-250./NFREQ,
+                                         tsamp=TSAMP, tstart=60000., dm=dm)
+
+
+def test_dedisperse_matches_your():
+    cand = make_cand()
+    cand.dedisperse(target='CPU')
+    shifts = dedisp_tools.dispersion_shifts(cand.chan_freqs, TSAMP, cand.dm)
+    data = cand.data.copy()
+    dedisp_tools.dedisperse(data, shifts[0])
+    np.testing.assert_array_equal(data, cand.dedispersed)
+
+    # channel-major layout
+    data = np.ascontiguousarray(cand.data.T)
+    dedisp_tools.dedisperse(data, shifts[0], time_axis=1)
+    np.testing.assert_array_equal(data.T, cand.dedispersed)
+
+
+def test_dmtime_matches_your():
+    cand = make_cand()
+    cand.dmtime(16, target='CPU')
+    dms = cand.dm + np.linspace(-cand.dm, cand.dm, 16)
+    shifts = dedisp_tools.dispersion_shifts(cand.chan_freqs, TSAMP, dms)
+    np.testing.assert_allclose(dedisp_tools.dmtime(cand.data, shifts),
+                               cand.dmt, rtol=1e-4, atol=1e-3)
+
+
+def test_decimate_matches_your():
+    data = np.random.default_rng(1).normal(size=(1000, 64)).astype(np.float32)
+    ref = _decimate(_decimate(data, 16, 1), 7, 0, pad=True)
+    np.testing.assert_allclose(dedisp_tools.decimate(data, (7, 16)), ref,
+                               rtol=1e-5)
+
+
+def test_proc_cand_backends():
+    cand_cpu, cand_your = make_cand(), make_cand()
+    candproc_tools.proc_cand(cand_cpu, dm=cand_cpu.dm, zero_topbottom=True,
+                             ndm=8, dmtime_transform=True, backend='cpu')
+    candproc_tools.proc_cand(cand_your, dm=cand_your.dm, zero_topbottom=True,
+                             ndm=8, dmtime_transform=True, backend='your')
+    candproc_tools.decimate_cand(cand_cpu, 16, 3, backend='cpu')
+    candproc_tools.decimate_cand(cand_your, 16, 3, backend='your')
+    np.testing.assert_allclose(cand_cpu.dedispersed, cand_your.dedispersed,
+                               rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(cand_cpu.dmt, cand_your.dmt, rtol=1e-4, atol=1e-3)
+    assert cand_cpu.tsamp == cand_your.tsamp == 3*TSAMP
+
+
+def test_fdmt_zero_delay_is_channel_sum():
+    data = np.random.default_rng(2).normal(size=(NFREQ, NTIME)).astype(np.float32)
+    dmt = dedisp_tools.fdmt(data, 1280., 1530., 1)
+    np.testing.assert_allclose(dmt[0], data.sum(0), rtol=1e-4, atol=1e-3)
+
+
+def test_fdmt_dmtime_finds_pulse():
+    tsamp = 16 * TSAMP
+    freqs = 1530. - 250./NFREQ * np.arange(NFREQ)
+    dms = np.linspace(-100., 100., 41)
+    for dm in (50., -75.):
+        data = np.zeros((NFREQ, NTIME), dtype=np.float32)
+        shifts = dedisp_tools.dispersion_shifts(freqs, tsamp, dm)[0]
+        data[np.arange(NFREQ), 1000 + shifts] = 1.
+        dmt = dedisp_tools.fdmt_dmtime(data, freqs, tsamp, dms)
+        idm, itime = np.unravel_index(dmt.argmax(), dmt.shape)
+        assert dms[idm] == dm
+        # FDMT delays are quantised differently to per-channel rounding
+        assert abs(itime - 1000) <= 1
+
+
+def test_delay_plan_cache():
+    dms = np.linspace(0., 20., 8)
+    plan = dedisp_tools.get_delay_plan(1530., -250./NFREQ, NFREQ, TSAMP, dms)
+    assert dedisp_tools.get_delay_plan(1530., -250./NFREQ, NFREQ, TSAMP,
+                                       list(dms)) is plan
+    assert dedisp_tools.get_delay_plan(1530., -250./NFREQ, NFREQ, TSAMP,
+                                       dms + 1) is not plan
+    np.testing.assert_array_equal(
+        plan.shifts, dedisp_tools.dispersion_shifts(plan.chan_freqs, TSAMP, dms))
+    assert not plan.shifts.flags.writeable
+
+
+class Block(np.ndarray):
+    """ Just enough of a sigpyproc FilterbankBlock. """
+    def __array_finalize__(self, obj):
+        self.header = getattr(obj, 'header', None)
+        self.dm = getattr(obj, 'dm', 0.)
+
+
+def test_dedisperse_block_matches_cand():
+    cand = make_cand()
+    cand.dedisperse(target='CPU')
+    block = np.ascontiguousarray(cand.data.T).view(Block)
+    block.header = {'fch1': cand.fch1, 'foff': cand.foff, 'tsamp': TSAMP}
+    out = dedisp_tools.dedisperse_block(block, cand.dm)
+    np.testing.assert_array_equal(out.T, cand.dedispersed)
+    assert out.dm == cand.dm and out.header is block.header
+    np.testing.assert_array_equal(block.T, cand.data)
@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+from types import SimpleNamespace
+
+from grex_t3 import file_ready
+
+
+def slow_write(fn, nchunk=5, delay=0.2):
+    with open(fn, 'wb') as f:
+        for ii in range(nchunk):
+            f.write(b'\0' * 1000)
+            f.flush()
+            time.sleep(delay)
+
+
+def test_wait_for_file(tmp_path):
+    fn = str(tmp_path / "grex_dump-test.nc")
+    writer = threading.Thread(target=slow_write, args=(fn,))
+    t0 = time.time()
+    writer.start()
+    assert file_ready.wait_for_file(fn, timeout=10., stable_time=0.5, poll=0.05) == fn
+    writer.join()
+    # not before the writer is done, nor long after
+    assert 1.0 <= time.time() - t0 < 3.0
+    with open(fn, 'rb') as f:
+        assert len(f.read()) == 5000
+
+
+def test_wait_for_file_finished_earlier(tmp_path):
+    fn = tmp_path / "grex_dump-old.nc"
+    fn.write_bytes(b'\0')
+    old = time.time() - 100
+    os.utime(fn, (old, old))
+    t0 = time.time()
+    assert file_ready.wait_for_file(str(fn), timeout=10., stable_time=2.) == str(fn)
+    assert time.time() - t0 < 1.
+
+
+def test_wait_for_file_timeout(tmp_path):
+    t0 = time.time()
+    assert file_ready.wait_for_file(str(tmp_path / "missing.nc"), timeout=0.5,
+                                    poll=0.05) is None
+    assert time.time() - t0 < 2.
+
+
+def test_is_ready_event():
+    assert file_ready.is_ready_event(['IN_CLOSE_WRITE'])
+    assert file_ready.is_ready_event(['IN_MOVED_TO'])
+    assert not file_ready.is_ready_event(['IN_CREATE'])
+
+
+class FakeInotify:
+    """ inotify.adapters.Inotify reporting IN_CLOSE_WRITE for
+    any file in a watched directory once it exists.
+    """
+    watched = []
+
+    def __init__(self, block_duration_s=1.):
+        self.block_duration_s = block_duration_s
+        self.dirs = []
+
+    def add_watch(self, dirname, mask):
+        if not os.path.isdir(dirname):
+            raise OSError(f"Call failed (should not be -1): (-1) ERRNO=(2)")
+        self.dirs.append(dirname)
+        FakeInotify.watched.append(dirname)
+
+    def remove_watch(self, dirname):
+        self.dirs.remove(dirname)
+
+    def event_gen(self, yield_nones=True):
+        while True:
+            for dirname in self.dirs:
+                for filename in os.listdir(dirname):
+                    yield (None, ['IN_CLOSE_WRITE'], dirname, filename)
+            yield None
+            time.sleep(self.block_duration_s)
+
+
+def test_wait_for_file_inotify_missing_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_ready, 'ia', SimpleNamespace(Inotify=FakeInotify))
+    monkeypatch.setattr(file_ready, 'ic', SimpleNamespace(IN_CLOSE_WRITE=8, IN_MOVED_TO=128),
+                        raising=False)
+    dirname = tmp_path / "240321aazm"
+    fn = str(dirname / "240321aazm_1.fil")
+
+    def write_later():
+        time.sleep(0.3)
+        dirname.mkdir()
+        time.sleep(0.2)
+        with open(fn, 'wb') as f:
+            f.write(b'\0' * 100)
+    writer = threading.Thread(target=write_later)
+    writer.start()
+    # stable_time too long to matter, so only the event can end the wait
+    t0 = time.time()
+    assert file_ready.wait_for_file(fn, timeout=5., stable_time=100., poll=0.05) == fn
+    writer.join()
+    assert 0.4 <= time.time() - t0 < 2.
+    assert FakeInotify.watched == [str(dirname)]
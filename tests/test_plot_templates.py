@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+import pytest
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from grex_t3 import plot_templates
+
+
+def render_grex(tpl, rng, ncluster):
+    ntime, nfreq, ndm = 256, 48, 32
+    times = np.linspace(0, 100., ntime)
+    freqs = np.linspace(1300., 1500., nfreq)
+    tpl.render(times, rng.normal(size=ntime), rng.normal(size=(nfreq, ntime)),
+               (-50., 50., 1300., 1500.), 2., np.zeros(nfreq), freqs,
+               rng.normal(size=(ndm, ntime)), (-50., 50., 0., 200.), 'Time (ms)',
+               rng.uniform(-30, 30, ncluster), rng.uniform(0, 500, ncluster),
+               rng.uniform(8, 20, ncluster), (-30., 30.), 'Time (s)',
+               ['DM = 100', 'SNR = 10'])
+
+
+def test_grex_template_reused(tmp_path):
+    rng = np.random.default_rng(0)
+    plot_templates.close_templates()
+    nfig = len(plt.get_fignums())
+    for ii, ncluster in enumerate([5, 0, 12]):
+        tpl = plot_templates.get_template(plot_templates.GrexCandPlot)
+        render_grex(tpl, rng, ncluster)
+        tpl.save(str(tmp_path / f"cand{ii}.png"))
+        assert (tmp_path / f"cand{ii}.png").exists()
+    assert plot_templates.get_template(plot_templates.GrexCandPlot) is tpl
+    assert len(plt.get_fignums()) == nfig + 1
+    assert tpl.texts[1].get_text() == 'SNR = 10' and tpl.texts[2].get_text() == ''
+    assert len(tpl.sc_cl.get_offsets()) == 12
+
+    plot_templates.close_templates()
+    assert tpl.closed and len(plt.get_fignums()) == nfig
+
+
+def test_filplot_template_optional_panels(tmp_path):
+    rng = np.random.default_rng(1)
+    nfreq, ntime = 32, 200
+    freqs = np.linspace(1280., 1530., nfreq)
+    with plot_templates.FilplotTemplate() as tpl:
+        for beams in (rng.normal(size=(256, ntime)), None):
+            tpl.render_ft(rng.normal(size=(nfreq, ntime)), [0, 1000., 1280., 1530.],
+                          100., freqs, (400., 600.), prob=0.9)
+            tpl.render_dmt(rng.normal(size=(16, ntime)), [0, 1000., 0., 200.], (400., 600.))
+            tpl.render_ts(np.linspace(0, 1000., ntime), rng.normal(size=ntime),
+                          (400., 600.), 'Heimdall S/N : 10')
+            tpl.render_beam(beams, [0, 1000., 0, 256], 100, (400., 600.))
+            tpl.render_dm0(None, None)
+            tpl.render_t2(rng.uniform(-10, 10, 4), rng.integers(0, 256, 4),
+                          rng.uniform(0, 1200, 4), rng.uniform(8, 20, 4), ibeam=100)
+            tpl.render_title('cand', fake=False)
+            tpl.save(str(tmp_path / "filplot.png"))
+        assert not tpl.im_beam.get_visible() and tpl.text_nobeam.get_visible()
+        assert tpl.text_prob.get_text() == 'Prob=0.90'
+    assert tpl.closed
+
+
+def test_templates_per_thread(tmp_path):
+    plot_templates.close_templates()
+    tpls, errors = {}, []
+
+    def plot(ii):
+        try:
+            rng = np.random.default_rng(ii)
+            tpl = plot_templates.get_template(plot_templates.GrexCandPlot)
+            for jj in range(3):
+                render_grex(tpl, rng, ncluster=ii + 1)
+                tpl.save(str(tmp_path / f"cand{ii}_{jj}.png"))
+                # nobody else drew into it in the meantime
+                assert len(tpl.sc_cl.get_offsets()) == ii + 1
+            assert plot_templates.get_template(plot_templates.GrexCandPlot) is tpl
+            tpls[ii] = tpl
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=plot, args=(ii,)) for ii in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len({id(tpl.fig) for tpl in tpls.values()}) == 3
+    plot_templates.close_templates()
+    assert all(tpl.closed for tpl in tpls.values())
+
+
+def test_candidate_plot_is_abstract():
+    with pytest.raises(TypeError):
+        plot_templates.CandidatePlot()
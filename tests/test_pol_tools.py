@@ -0,0 +1,37 @@
+import numpy as np
+
+from grex_t3 import pol_tools
+
+NTIME = 4096
+NFREQ = 64
+TSAMP = 8.192e-6
+
+
+def test_stokes_from_voltages():
+    rng = np.random.default_rng(2)
+    voltages = rng.integers(-128, 128, size=(32, 8, 2, 2), dtype=np.int8)
+    iquv = pol_tools.stokes_from_voltages(voltages)
+
+    v = voltages.astype(np.float64)
+    x = v[:, :, 0, 0] + 1j*v[:, :, 0, 1]
+    y = v[:, :, 1, 0] + 1j*v[:, :, 1, 1]
+    np.testing.assert_allclose(iquv[:, 0], np.abs(x)**2 + np.abs(y)**2)
+    np.testing.assert_allclose(iquv[:, 1], np.abs(x)**2 - np.abs(y)**2)
+    np.testing.assert_allclose(iquv[:, 2], 2*np.real(x*np.conj(y)))
+    np.testing.assert_allclose(iquv[:, 3], 2*np.imag(np.conj(x)*y))
+
+
+def test_write_stokes_product(tmp_path, voltage_dump_factory):
+    fn = str(tmp_path / "grex_dump-test.nc")
+    voltages = voltage_dump_factory(fn, ntime=NTIME, nfreq=NFREQ, tsamp=TSAMP)
+    fnout = pol_tools.write_stokes_product(fn, str(tmp_path / "test_iquv.h5"),
+                                           timedownsample=16, freqdownsample=4,
+                                           chunksize=1000)
+    data, header = pol_tools.read_stokes_product(fnout)
+    assert data.shape == (NTIME//16, 4, NFREQ//4)
+    assert header['stokes'] == 'IQUV'
+    np.testing.assert_allclose(header['tsamp'], 16*TSAMP, rtol=1e-6)
+
+    iquv = pol_tools.stokes_from_voltages(voltages)
+    iquv = iquv.reshape(NTIME//16, 16, 4, NFREQ//4, 4).mean(axis=(1, 4))
+    np.testing.assert_allclose(data, iquv, rtol=1e-5)
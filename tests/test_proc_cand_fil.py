@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+import xarray
+
+# filplot_funcs needs the full T3 environment
+pytest.importorskip("sigpyproc")
+pytest.importorskip("dsautils")
+
+from grex_t3 import candproc_tools
+from grex_t3 import filplot_funcs
+from grex_t3 import product_cache
+
+
+def test_proc_cand_fil_cache_hit_matches_miss(tmp_path):
+    ntime, nfreq, tsamp = 4096, 64, 1e-3
+    rng = np.random.default_rng(0)
+    stokesi = xarray.DataArray(rng.normal(100., 1., size=(ntime, nfreq)).astype(np.float32),
+                               dims=("time", "freq"),
+                               coords={"time": 60000. + np.arange(ntime) * tsamp / 86400.,
+                                       "freq": np.linspace(1530., 1280., nfreq)})
+    fn = str(tmp_path / "cand.fil")
+    candproc_tools.write_sigproc(fn, stokesi, t_start=60000.)
+
+    cache = product_cache.ProductCache(str(tmp_path / "cache"))
+    kwargs = dict(pre_rebin=1, nfreq_plot=16, ndm=8, cache=cache)
+    miss = filplot_funcs.proc_cand_fil(fn, 50., 1, **kwargs)
+    hit = filplot_funcs.proc_cand_fil(fn, 50., 1, **kwargs)
+
+    for a, b in zip(miss, hit):
+        assert type(a) == type(b)
+        assert np.shape(a) == np.shape(b)
+        np.testing.assert_allclose(np.asarray(a), np.asarray(b), rtol=1e-6)
+    # the unreduced (nfreq, ntime) block either way
+    assert hit[-1].shape == (nfreq, ntime)
+    assert dict(hit[0].header) == dict(miss[0].header)
+    assert dict(hit[-1].header) == dict(miss[-1].header)
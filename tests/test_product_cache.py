@@ -0,0 +1,72 @@
+import os
+import time
+
+import numpy as np
+
+from grex_t3 import product_cache
+
+
+def test_product_cache_roundtrip(tmp_path):
+    fn = str(tmp_path / "grex_dump-test.nc")
+    with open(fn, 'wb') as f:
+        f.write(b'\0' * 1000)
+
+    cache = product_cache.ProductCache(str(tmp_path / "cache"))
+    key = cache.key(fn, dm=100., ibox=4)
+    assert cache.get(key) is None
+
+    ft = np.random.normal(size=(256, 128)).astype(np.float32)
+    cache.put(key, dict(ft=ft, dms=np.linspace(0, 200, 32), tsamp=8.192e-6))
+    products = cache.get(key)
+    assert np.array_equal(products['ft'], ft)
+    assert products['tsamp'] == 8.192e-6
+
+    # a changed parameter or a rewritten input is a miss
+    assert cache.key(fn, dm=100., ibox=8) != key
+    assert cache.key(fn, ibox=4, dm=100.) == key
+    with open(fn, 'ab') as f:
+        f.write(b'\0')
+    assert cache.key(fn, dm=100., ibox=4) != key
+
+
+def test_product_cache_eviction(tmp_path):
+    arr = np.zeros(1000, dtype=np.float64)
+    cache = product_cache.ProductCache(str(tmp_path), max_bytes=3.5*arr.nbytes)
+    for ii in range(3):
+        cache.put('k%d' % ii, dict(arr=arr))
+        old = time.time() - 100 + ii
+        os.utime(cache._path('k%d' % ii), (old, old))
+
+    # reading k0 makes it the most recently used
+    assert cache.get('k0') is not None
+    cache.put('k3', dict(arr=arr))
+    assert cache.get('k1') is None
+    assert all(cache.get(k) is not None for k in ('k0', 'k2', 'k3'))
+
+    cache.max_age = 50.
+    old = time.time() - 60
+    os.utime(cache._path('k2'), (old, old))
+    assert cache.evict() == 1
+    assert cache.get('k2') is None and cache.get('k3') is not None
+
+
+def test_product_cache_errors_and_header(tmp_path):
+    # a cache that can't be written or read is just skipped
+    blocker = tmp_path / "not_a_dir"
+    blocker.write_text("")
+    cache = product_cache.ProductCache(str(blocker / "cache"))
+    assert cache.put('k', dict(arr=np.zeros(4))) is False
+    assert cache.get('k') is None
+
+    cache = product_cache.ProductCache(str(tmp_path / "cache"))
+    os.makedirs(cache.cache_dir)
+    with open(cache._path('bad'), 'w') as f:
+        f.write("truncated")
+    assert cache.get('bad') is None
+
+    header = dict(nchans=np.int64(4096), tsamp=8.192e-6, source_name='cand1', 
+                  ibeam=None, nbits=32)
+    assert cache.put('h', dict(ft=np.ones((2, 2)), **product_cache.pack_header(header)))
+    out = product_cache.unpack_header(cache.get('h'))
+    assert out == header
+    assert type(out['nchans']) is int and type(out['source_name']) is str
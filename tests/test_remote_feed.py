@@ -0,0 +1,66 @@
+import numpy as np
+
+from grex_t3 import remote_feed
+
+
+def cand_lines(n, start=0):
+    return [f"{10. + ii % 7:.2f} {ii} {ii * 0.5:.3f} 2 0 {100. + ii:.1f} 0 0 "
+            f"60000 1 2 {ii % 60:.3f}\n" for ii in range(start, start + n)]
+
+
+def test_remote_feed_tail(tmp_path):
+    fn = str(tmp_path / "heimdall_3.cand")
+    lines = cand_lines(400)
+    with open(fn, 'w') as f:
+        f.writelines(lines[:300])
+        f.write(lines[300][:10])   # line still being written
+
+    feed = remote_feed.RemoteCandFeed(file_path=fn, maxlen=100, tail_bytes=2000,
+                                      client_factory=remote_feed.LocalSSHClient)
+    nconnect = remote_feed.LocalSSHClient.nconnect
+
+    # the first update only reads the end of the file
+    cands = feed.update()
+    assert 0 < len(cands) < 50 and cands['cand'].iloc[-1] == 299
+    assert np.all(np.diff(cands['cand']) == 1)
+
+    with open(fn, 'a') as f:
+        f.write(lines[300][10:])
+        f.writelines(lines[301:400])
+    cands = feed.update(ncand=50)
+    assert list(cands['cand']) == list(range(350, 400))
+    # the buffer rolls over at maxlen
+    assert len(feed.tail()) == 100 and feed.tail()['cand'].iloc[0] == 300
+    assert feed.update(ncand=1)['dm'].iloc[0] == 100. + 399
+    assert remote_feed.LocalSSHClient.nconnect == nconnect + 1
+
+    # a dropped connection is re-opened within the update
+    feed.client.drop()
+    with open(fn, 'a') as f:
+        f.writelines(cand_lines(5, 400))
+    assert feed.update(ncand=1)['cand'].iloc[0] == 404
+    assert remote_feed.LocalSSHClient.nconnect == nconnect + 2
+
+
+def test_remote_feed_truncate_and_replace(tmp_path):
+    fn = str(tmp_path / "heimdall_3.cand")
+    with open(fn, 'w') as f:
+        f.writelines(cand_lines(100))
+    feed = remote_feed.RemoteCandFeed(file_path=fn, client_factory=remote_feed.LocalSSHClient)
+    assert len(feed.update()) == 100
+
+    # truncated and restarted
+    with open(fn, 'w') as f:
+        f.writelines(cand_lines(3, 1000))
+    assert list(feed.update(ncand=4)['cand']) == [99, 1000, 1001, 1002]
+
+    # replaced by a longer file
+    with open(fn, 'w') as f:
+        f.writelines(cand_lines(50, 2000))
+    assert list(feed.update(ncand=2)['cand']) == [2048, 2049]
+    assert len(feed.tail()) == 153
+
+    # nothing new, and a missing file, leave the buffer alone
+    assert len(feed.update()) == 153
+    feed.file_path = fn + '.missing'
+    assert len(feed.update()) == 153
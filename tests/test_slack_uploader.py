@@ -0,0 +1,77 @@
+import json
+import time
+import threading
+
+from grex_t3 import slack_uploader
+
+
+def read_calls(outdir):
+    with open(outdir / 'slack.jsonl') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_slack_uploader_local(tmp_path):
+    fn = tmp_path / 'grex_cand_test.png'
+    fn.write_bytes(b'png')
+    client = slack_uploader.LocalSlackClient(str(tmp_path / 'slack'))
+    uploader = slack_uploader.SlackUploader(client=client, min_interval=0.)
+
+    t0 = time.time()
+    uploader.upload(str(fn), initial_comment='New candidate')
+    uploader.post('hello')
+    # queuing never waits on Slack
+    assert time.time() - t0 < 0.1
+    assert uploader.flush(timeout=5.)
+    uploader.close()
+
+    calls = read_calls(tmp_path / 'slack')
+    assert [c['method'] for c in calls] == ['files_upload', 'chat_postMessage']
+    assert calls[0]['initial_comment'] == 'New candidate'
+    assert (tmp_path / 'slack' / 'grex_cand_test.png').read_bytes() == b'png'
+
+
+def test_slack_uploader_retry(tmp_path):
+    client = slack_uploader.LocalSlackClient(str(tmp_path), fail=2, ratelimit=1,
+                                             retry_after=0.3)
+    uploader = slack_uploader.SlackUploader(client=client, backoff=0.1,
+                                            min_interval=0.)
+    t0 = time.time()
+    uploader.post('hello')
+    assert uploader.flush(timeout=10.)
+    dt = time.time() - t0
+
+    # backoff of 0.1 and 0.2 s, then the 0.3 s Retry-After
+    assert client.ncall == 4 and uploader.nsent == 1
+    assert 0.6 <= dt < 2.
+    assert len(read_calls(tmp_path)) == 1
+
+    # gives up after max_retries
+    client.fail = 10
+    uploader.max_retries = 2
+    uploader.post('again')
+    assert uploader.flush(timeout=10.)
+    assert uploader.nfailed == 1 and client.ncall == 7
+    uploader.close()
+
+
+def test_get_uploader_threads(tmp_path, monkeypatch):
+    created = []
+
+    class SlowUploader:
+        def __init__(self, slack_file):
+            time.sleep(0.05)
+            created.append(self)
+
+        def close(self, timeout=None):
+            pass
+
+    monkeypatch.setattr(slack_uploader, 'SlackUploader', SlowUploader)
+    monkeypatch.setattr(slack_uploader, '_uploaders', {})
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(
+        slack_uploader.get_uploader(str(tmp_path / 'slack_api')))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1 and all(u is created[0] for u in got)
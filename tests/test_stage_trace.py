@@ -0,0 +1,37 @@
+import time
+
+import numpy as np
+
+from grex_t3 import stage_trace
+
+
+def test_stage_trace(tmp_path):
+    fn = str(tmp_path / "trace.jsonl")
+    for ii in range(20):
+        trace = stage_trace.Trace(fn, 'cand%d' % ii)
+        trace.record('read_clean', 1. + ii, t_start=1000. + ii)
+        trace.record('plot', 0.1, t_start=1000. + ii)
+    with stage_trace.Trace(fn, 'live').span('dedisperse'):
+        with open(fn, 'rb') as f:
+            f.read()
+        data = np.ones(10**6)
+
+    df = stage_trace.read_trace(fn)
+    live = df[df['cand'] == 'live'].iloc[0]
+    assert live['stage'] == 'dedisperse' and live['seconds'] < 1.
+    assert live['time'] > time.time() - 60 and live['rss'] > data.nbytes
+    # only the stage's own growth, not the process's lifetime peak
+    assert 0 <= live['rss_growth'] < stage_trace.max_rss()
+    assert live['bytes_read'] > 0
+
+    summary = stage_trace.summarize(stage_trace.read_trace(fn, start=1005., end=1015.))
+    assert summary.loc['read_clean', 'n'] == 10
+    np.testing.assert_allclose(summary.loc['read_clean', 'p50'], 10.5)
+    np.testing.assert_allclose(summary.loc['read_clean', 'p99'], 14.91)
+    assert summary.loc['plot', 'p95'] == 0.1
+
+    # nothing is written without a file
+    stage_trace.Trace(None, 'x').record('read_clean', 1.)
+    out = stage_trace.main([fn, '--hours', '1'])
+    assert list(out.index) == ['dedisperse']
+    assert out.loc['dedisperse', 'rss_MB'] > data.nbytes / 1e6
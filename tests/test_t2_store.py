@@ -0,0 +1,166 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from grex_t3 import t2_store
+
+COLUMNS = "snr,if,specnum,mjds,ibox,idm,dm,ibeam,cl,cntc,cntb,trigger"
+
+
+def make_rows(n, mjd0, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for ii, mjd in enumerate(np.sort(mjd0 + rng.uniform(0, 1.5, n))):
+        trigger = 'cand%d' % ii if ii % 10 == 0 else '0'
+        rows.append(f"{rng.uniform(8, 50):.2f},0,{ii},{mjd:.10f},{rng.integers(1, 16)},"
+                    f"0,{rng.uniform(0, 1000):.2f},{rng.integers(0, 256)},0,1,1,{trigger}\n")
+    return rows
+
+
+def test_t2_store_tail_and_query(tmp_path):
+    fn = str(tmp_path / "cluster_output.csv")
+    rows = make_rows(400, 60000.)
+    with open(fn, 'w') as f:
+        f.write(COLUMNS + "\n")
+        f.writelines(rows[:300])
+        f.write(rows[300][:20])   # row still being written
+
+    store = t2_store.T2Store(fn)
+    new = store.update()
+    assert len(new) == 300 and store.nrows == 300
+    assert store.days() == [60000, 60001]
+
+    with open(fn, 'a') as f:
+        f.write(rows[300][20:])
+        f.writelines(rows[301:])
+    new = store.update()
+    assert len(new) == 100 and list(new['row']) == list(range(300, 400))
+    assert len(store.update()) == 0
+
+    ref = pd.read_csv(fn)
+    mjd = ref['mjds'].values[200]
+    cands = store.window(mjd, 3600., dm_min=100., dm_max=800., beam=range(128))
+    sel = ref[(np.abs(ref['mjds'] - mjd) <= 3600./86400) & (ref['dm'] >= 100.)
+              & (ref['dm'] <= 800.) & (ref['ibeam'] < 128)]
+    np.testing.assert_array_equal(cands['mjds'].values, sel['mjds'].values)
+    np.testing.assert_array_equal(cands['snr'].values, sel['snr'].values)
+    assert list(cands['trigger']) == list(sel['trigger'].astype(str))
+
+    # a fresh instance picks up from the saved state
+    store = t2_store.T2Store(fn)
+    assert store.nrows == 400 and len(store.update()) == 0
+    since = store.rows_since(350)
+    np.testing.assert_array_equal(since['specnum'].values, np.arange(350, 400))
+
+
+
+def test_t2_store_deltas_and_rotation(tmp_path):
+    fn = str(tmp_path / "cluster_output.csv")
+    rows = make_rows(200, 60000.2)
+    with open(fn, 'w') as f:
+        f.write(COLUMNS + "\n")
+        f.writelines(rows[:50])
+
+    store = t2_store.T2Store(fn, max_deltas=4)
+    store.update()
+    # small updates go to deltas, not into the day's partition
+    for ii in range(50, 80, 10):
+        with open(fn, 'a') as f:
+            f.writelines(rows[ii:ii+10])
+        store.update()
+    assert sorted(os.listdir(store.store_dir)) == [
+        '.lock', 'mjd_60000.d0000.npz', 'mjd_60000.d0001.npz',
+        'mjd_60000.d0002.npz', 'mjd_60000.npz', 'state.json']
+    with open(fn, 'a') as f:
+        f.writelines(rows[80:100])
+    store.update()
+    # merged once a day has max_deltas
+    assert not any('.d0' in fn for fn in os.listdir(store.store_dir))
+    assert list(store.query()['specnum']) == list(range(100))
+
+    # truncated, then replaced by a longer file
+    with open(fn, 'w') as f:
+        f.write(COLUMNS + "\n")
+        f.writelines(rows[100:110])
+    assert list(store.update()['row']) == list(range(100, 110))
+    tmp = fn + '.new'
+    with open(tmp, 'w') as f:
+        f.write(COLUMNS + "\n")
+        f.writelines(rows[110:200])
+    os.replace(tmp, fn)
+    assert list(store.update()['specnum']) == list(range(110, 200))
+    cands = store.query()
+    assert list(cands['row']) == list(range(200))
+    assert np.all(np.diff(cands['mjds'].values) >= 0)
+    np.testing.assert_array_equal(store.rows_since(150)['specnum'].values,
+                                  np.arange(150, 200))
+
+
+def test_t2_tail_partial_rotation_truncation(tmp_path):
+    fn = str(tmp_path / "cluster_output.csv")
+    rows = make_rows(300, 60000.)
+    with open(fn, 'w') as f:
+        f.write(COLUMNS + "\n")
+        f.writelines(rows[:100])
+        f.write(rows[100][:15])
+
+    # rows already there are skipped, unless from_start
+    tail = t2_store.T2Tail(fn)
+    assert len(tail.read()) == 0
+    assert len(t2_store.T2Tail(fn, from_start=True).read()) == 100
+
+    with open(fn, 'a') as f:
+        f.write(rows[100][15:])
+        f.writelines(rows[101:150])
+        f.write(rows[150][:30])
+    new = tail.read()
+    assert list(new['specnum']) == list(range(100, 150))
+    assert list(new['row']) == list(range(50))
+    assert new['ibeam'].dtype == 'Int64' and new['mjds'].dtype == np.float64
+    assert new['trigger'].iloc[0] == 'cand100' and new['trigger'].iloc[1] == '0'
+    assert len(tail.read()) == 0
+
+    # the rest of the partial line, then truncation
+    with open(fn, 'a') as f:
+        f.write(rows[150][30:])
+    assert list(tail.read()['specnum']) == [150]
+    with open(fn, 'w') as f:
+        f.write(COLUMNS + "\n")
+        f.writelines(rows[200:210])
+    new = tail.read()
+    assert list(new['specnum']) == list(range(200, 210))
+    assert list(new['row']) == list(range(51, 61))
+
+    # rotation: a new file moved into place, larger than the offset
+    tmp = fn + '.new'
+    with open(tmp, 'w') as f:
+        f.write(COLUMNS + "\n")
+        f.writelines(rows[210:300])
+    os.replace(tmp, fn)
+    assert list(tail.read()['specnum']) == list(range(210, 300))
+    os.remove(fn)
+    assert len(tail.read()) == 0
+
+
+def test_t2_tail_missing_and_empty_fields(tmp_path):
+    fn = str(tmp_path / "cluster_output.csv")
+    tail = t2_store.T2Tail(fn, from_start=True)
+    # no file, then no complete header yet: still the T2 columns
+    for new in [tail.read(), None]:
+        if new is None:
+            with open(fn, 'w') as f:
+                f.write(COLUMNS[:10])
+            new = tail.read()
+        assert len(new) == 0
+        assert list(new.columns) == COLUMNS.split(',') + ['row']
+        assert len(new[new['trigger'].astype(str) != '0']) == 0
+
+    with open(fn, 'a') as f:
+        f.write(COLUMNS[10:] + "\n")
+        f.write("12.5,0,1,60000.1,4,0,300.0,,0,1,1,cand1\n")
+        f.write("10.0,0,2,60000.2,4,0,400.0,17,0,1,1,\n")
+    new = tail.read()
+    assert list(new['specnum']) == [1, 2]
+    assert new['ibeam'].isna().tolist() == [True, False] and new['ibeam'].iloc[1] == 17
+    assert new['trigger'].iloc[0] == 'cand1' and new['trigger'].isna().iloc[1]
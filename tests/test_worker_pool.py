@@ -0,0 +1,89 @@
+import os
+import time
+import queue
+import signal
+
+import pytest
+
+from grex_t3 import worker_pool
+
+
+def touch(fn, delay):
+    time.sleep(delay)
+    with open(fn, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+def test_worker_pool(tmp_path):
+    fns = [str(tmp_path / f"cand{ii}") for ii in range(6)]
+    t0 = time.time()
+    with worker_pool.WorkerPool(touch, nworker=3, max_queued=2) as pool:
+        for fn in fns:
+            pool.submit(fn, 0.5)
+        done = pool.join(timeout=30)
+    dt = time.time() - t0
+
+    assert sorted(job[0] for job, err, _ in done) == fns
+    assert all(err is None for _, err, _ in done)
+    # 6 jobs of 0.5 s on 3 workers, 3 s if run serially
+    assert dt < 2.0
+    pids = set(open(fn).read() for fn in fns)
+    assert len(pids) > 1 and str(os.getpid()) not in pids
+
+
+def test_worker_pool_errors_and_backpressure():
+    pool = worker_pool.WorkerPool(fail, nworker=1, max_queued=1)
+    pool.submit('a')
+    done = pool.join(timeout=10)
+    assert done[0][0] == ('a',) and 'ValueError' in done[0][1]
+    pool.close(wait=False)
+
+    # nobody consuming, so the second job has nowhere to go
+    pool = worker_pool.WorkerPool(touch, nworker=1, max_queued=1)
+    pool.close(wait=False)
+    pool.submit('x', 0)
+    with pytest.raises(queue.Full):
+        pool.submit('y', 0, timeout=0.2)
+
+
+def crash(fn):
+    if fn == 'crash':
+        os._exit(9)
+    touch(fn, 0)
+
+
+def test_worker_pool_replaces_crashed_workers(tmp_path):
+    fns = [str(tmp_path / f"cand{ii}") for ii in range(3)]
+    with worker_pool.WorkerPool(crash, nworker=1, max_queued=4) as pool:
+        pool.submit('crash')
+        pool.submit('crash')
+        for fn in fns:
+            pool.submit(fn)
+        done = pool.join(timeout=60)
+        assert pool.pending == 0 and pool.nrestarted == 2
+
+    crashed = [err for job, err, _ in done if job == ('crash',)]
+    assert len(crashed) == 2
+    assert all(err.startswith(worker_pool.CRASHED) and 'exit code 9' in err for err in crashed)
+    assert sorted(job[0] for job, err, _ in done if err is None) == fns
+
+
+def test_worker_pool_job_lost_before_start(tmp_path):
+    fn = str(tmp_path / "cand0")
+    with worker_pool.WorkerPool(touch, nworker=1, max_queued=2) as pool:
+        # killed as soon as the job is handed over, before it can run
+        pid = pool.workers[0].pid
+        pool.submit(fn, 0.5)
+        os.kill(pid, signal.SIGKILL)
+        done = pool.join(timeout=30)
+        assert pool.pending == 0 and pool.nrestarted == 1
+        assert done[0][0] == (fn, 0.5) and done[0][1].startswith(worker_pool.CRASHED)
+
+        # the new worker takes the next job
+        pool.submit(fn, 0)
+        done = pool.join(timeout=30)
+        assert done[0][1] is None and os.path.exists(fn)